@@ -13,9 +13,24 @@ the following keyword arguments:
 
 """
 
+import os
+import sys
+
+_PYTHON_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), "python"))
+if _PYTHON_PATH not in sys.path:
+    sys.path.append(_PYTHON_PATH)
+
 
 def create(sg, project_id, log, **kwargs):
     """
-    Insert post-project code here
+    Scaffolds the folders of the new project in one batch.
     """
-    pass
+    try:
+        import sgtk
+        from cbfx_config import scaffold
+
+        tk = sgtk.sgtk_from_entity("Project", project_id)
+        scaffold.scaffold(tk, project_id, log=log)
+    except Exception as e:
+        # the project is usable without its folders, Toolkit creates them lazily
+        log.warning("Failed to scaffold the project folders: %s" % e)
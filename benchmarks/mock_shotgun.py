@@ -0,0 +1,188 @@
+"""
+A mockgun-style, in-memory ShotGrid stand-in with injected latency.
+
+Only the parts of the API the config hooks use are implemented: ``find``,
+``find_one``, ``schema_field_read`` and ``create``, with the common filter
+relations, ``filter_operator`` groups and linked (dotted) fields. Every call
+sleeps for the configured round trip time and is counted, so benchmarks can
+report both the wall time and the number of calls per operation.
+"""
+
+import collections
+import copy
+import itertools
+import threading
+import time
+
+
+class MockShotgun(object):
+    """
+    In-memory ShotGrid stand-in.
+
+    :param float latency_ms: Round trip time added to every API call.
+    """
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.calls = collections.Counter()
+        self._entities = collections.defaultdict(dict)
+        self._ids = itertools.count(1)
+        # calls are made from the hooks' background threads too
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._last_call = time.time()
+
+    # ------------------------------------------------------------------
+    # bookkeeping
+
+    def _call(self, method):
+        with self._lock:
+            self.calls[method] += 1
+            self._in_flight += 1
+        try:
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000.0)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._last_call = time.time()
+
+    @property
+    def call_count(self):
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    def wait_idle(self, quiet=0.1, timeout=30):
+        """
+        Waits until no call was made for ``quiet`` seconds, ie. for the
+        background work of a hook to be done.
+
+        :returns: ``False`` if calls were still made after ``timeout`` seconds.
+        """
+        start = time.time()
+        deadline = start + timeout
+        while time.time() < deadline:
+            with self._lock:
+                # the work may not have made its first call yet
+                last = max(self._last_call, start)
+                idle = not self._in_flight and time.time() - last >= quiet
+            if idle:
+                return True
+            time.sleep(quiet / 4.0)
+        return False
+
+    # ------------------------------------------------------------------
+    # data setup, not counted
+
+    def add(self, entity_type, **fields):
+        """
+        Adds an entity without a round trip.
+
+        :returns: The entity link dictionary.
+        """
+        entity_id = fields.pop("id", None) or next(self._ids)
+        record = dict(fields, type=entity_type, id=entity_id)
+        self._entities[entity_type][entity_id] = record
+        link = {"type": entity_type, "id": entity_id}
+        if "code" in fields or "name" in fields:
+            link["name"] = fields.get("code") or fields.get("name")
+        return link
+
+    # ------------------------------------------------------------------
+    # API
+
+    def create(self, entity_type, data, return_fields=None):
+        self._call("create")
+        link = self.add(entity_type, **data)
+        return self._project(self._entities[entity_type][link["id"]], return_fields or [])
+
+    def schema_field_read(self, entity_type, field_name=None, project_entity=None):
+        self._call("schema_field_read")
+        names = set()
+        for record in self._entities[entity_type].values():
+            names.update(record)
+        return dict(
+            (name, {"data_type": {"value": "text"}, "name": {"value": name}})
+            for name in sorted(names)
+            if field_name is None or name == field_name
+        )
+
+    def find(self, entity_type, filters, fields=None, order=None, filter_operator=None, limit=0, **kwargs):
+        self._call("find")
+        return self._find(entity_type, filters, fields, order, filter_operator, limit)
+
+    def find_one(self, entity_type, filters, fields=None, order=None, filter_operator=None, **kwargs):
+        self._call("find_one")
+        results = self._find(entity_type, filters, fields, order, filter_operator, 1)
+        return results[0] if results else None
+
+    # ------------------------------------------------------------------
+    # query evaluation
+
+    def _find(self, entity_type, filters, fields, order, filter_operator, limit):
+        records = [
+            record
+            for record in self._entities[entity_type].values()
+            if self._match_group(record, filters, filter_operator or "all")
+        ]
+        for sort in reversed(order or []):
+            records.sort(
+                key=lambda r: (r.get(sort["field_name"]) is None, r.get(sort["field_name"])),
+                reverse=sort.get("direction") == "desc",
+            )
+        if limit:
+            records = records[:limit]
+        return [self._project(record, fields or []) for record in records]
+
+    def _project(self, record, fields):
+        result = {"type": record["type"], "id": record["id"]}
+        for field in fields:
+            result[field] = copy.deepcopy(self._value(record, field))
+        return result
+
+    def _value(self, record, field):
+        if "." not in field:
+            return record.get(field)
+        link_field, linked_type, linked_field = field.split(".", 2)
+        link = record.get(link_field)
+        if not link or link.get("type") != linked_type:
+            return None
+        linked_record = self._entities[linked_type].get(link["id"])
+        if linked_record is None:
+            return None
+        return self._value(linked_record, linked_field)
+
+    def _match_group(self, record, filters, operator):
+        matches = (self._match(record, f) for f in filters)
+        return any(matches) if operator == "any" else all(matches)
+
+    def _match(self, record, condition):
+        if isinstance(condition, dict):
+            return self._match_group(record, condition["filters"], condition["filter_operator"])
+
+        field, relation, value = condition[0], condition[1], condition[2:]
+        value = value[0] if len(value) == 1 else list(value)
+        actual = self._value(record, field)
+
+        def key(v):
+            return (v["type"], v["id"]) if isinstance(v, dict) else v
+
+        if isinstance(actual, list) and relation in ("is", "is_not"):
+            found = key(value) in [key(a) for a in actual]
+            return found if relation == "is" else not found
+        if relation == "is":
+            return key(actual) == key(value)
+        if relation == "is_not":
+            return key(actual) != key(value)
+        if relation in ("in", "not_in"):
+            found = key(actual) in [key(v) for v in value]
+            if isinstance(actual, list):
+                found = any(key(a) in [key(v) for v in value] for a in actual)
+            return found if relation == "in" else not found
+        if relation == "greater_than":
+            return actual is not None and actual > value
+        if relation == "less_than":
+            return actual is not None and actual < value
+        raise NotImplementedError("Unsupported filter relation: {}".format(relation))
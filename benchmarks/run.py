@@ -0,0 +1,327 @@
+"""
+Benchmarks of the config hooks against a mock ShotGrid with injected latency.
+
+Runs the context change, engine init, pick environment and folder creation
+core hooks and the Nuke loader sequence-range code against
+:class:`mock_shotgun.MockShotgun` and a synthetic project tree built from
+``core/schema``, and reports calls per operation and wall time at each round
+trip time::
+
+    python benchmarks/run.py --rtt 0 50 200 --output after.json
+    python benchmarks/run.py --compare before.json
+
+Results are regression numbers to compare before and after a config change,
+not absolute timings.
+
+The hooks are only driven through their public entry points, so the same
+benchmarks run against any version of the config. Each scenario runs in its
+own process, with its own ``CBFX_CACHE_DIR``, so no cache of a scenario leaks
+into the next one.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import toolkit_stub  # noqa: E402
+
+toolkit_stub.install()
+
+from mock_shotgun import MockShotgun  # noqa: E402
+import synthetic_project  # noqa: E402
+
+# the benchmarks measure the hooks themselves, not the optional layers
+# around them
+os.environ["CBFX_TRACE"] = "0"
+os.environ.pop("CBFX_SG_MIRROR_DIR", None)
+os.environ.pop("CBFX_CONTEXT_PREFETCH", None)
+os.environ["CBFX_ASYNC_DEFERRED_FOLDERS"] = "0"
+os.environ.setdefault("SHOTGUN_BUNDLE_CACHE_PATH", tempfile.gettempdir())
+
+
+def _result(bench, op, rtt, ops, calls, seconds, **extra):
+    result = {
+        "bench": bench,
+        "op": op,
+        "rtt_ms": rtt,
+        "ops": ops,
+        "calls_per_op": round(calls / float(ops), 3),
+        "ms_per_op": round(seconds * 1000.0 / ops, 3),
+    }
+    result.update(extra)
+    return result
+
+
+def bench_context_change(rtt, switches):
+    module = toolkit_stub.load_hook("core/hooks/context_change.py")
+    sg = MockShotgun()
+    user = sg.add("HumanUser", name="Artist")
+    entities = synthetic_project.populate_shotgun(sg, sequences=4, shots_per_sequence=50, user=user)
+    tk = toolkit_stub.Toolkit(sg)
+    project = entities["Project"][0]
+
+    def context(shot, task=None):
+        return toolkit_stub.Context(tk, project=project, entity=shot, task=task, user=user)
+
+    results = []
+    hook = module.ContextChange()
+    shots = entities["Shot"][:switches]
+    tasks = entities["Task"]
+    switches = min(switches, len(tasks))
+
+    sg.latency_ms = rtt
+    sg.reset_calls()
+    start = time.time()
+    previous = None
+    for shot in shots:
+        current = context(shot)
+        hook.pre_context_change(previous, current)
+        previous = current
+    results.append(_result("context_change", "shot_switch", rtt, len(shots), sg.call_count, time.time() - start))
+
+    sg.reset_calls()
+    start = time.time()
+    # one task was created per shot, in the same order
+    for shot, task in list(zip(entities["Shot"], tasks))[:switches]:
+        current = context(shot, task)
+        hook.pre_context_change(previous, current)
+        previous = current
+        # switch to another task of the same shot
+        other = dict(task, id=task["id"] + 100000)
+        current = context(shot, other)
+        hook.pre_context_change(previous, current)
+        previous = current
+    results.append(_result("context_change", "task_switch", rtt, 2 * switches, sg.call_count, time.time() - start))
+    return results
+
+
+def bench_engine_init(rtt, starts):
+    module = toolkit_stub.load_hook("core/hooks/_engine_init.py")
+    sg = MockShotgun()
+    entities = synthetic_project.populate_shotgun(sg, sequences=1, shots_per_sequence=1)
+    tk = toolkit_stub.Toolkit(sg)
+    engine = types.SimpleNamespace(
+        name="tk-nuke",
+        context=toolkit_stub.Context(tk, project=entities["Project"][0]),
+        shotgun=sg,
+        log_warning=lambda msg: None,
+        log_error=lambda msg: None,
+        log_debug=lambda msg: None,
+        has_ui=False,
+    )
+
+    hook = module.EngineInitHook()
+    sg.latency_ms = rtt
+    seconds = 0.0
+    for _ in range(starts):
+        start = time.time()
+        hook.execute(engine, None)
+        # only what blocks the engine start is timed, the calls of the
+        # settings check made in the background are counted once it is done
+        seconds += time.time() - start
+        sg.wait_idle()
+    return [_result("engine_init", "execute", rtt, starts, sg.call_count, seconds)]
+
+
+def bench_pick_environment(calls):
+    module = toolkit_stub.load_hook("core/hooks/pick_environment.py")
+    sg = MockShotgun()
+    entities = synthetic_project.populate_shotgun(sg, sequences=1, shots_per_sequence=1)
+    tk = toolkit_stub.Toolkit(sg)
+    contexts = [
+        toolkit_stub.Context(tk),
+        toolkit_stub.Context(tk, project=entities["Project"][0]),
+        toolkit_stub.Context(
+            tk,
+            project=entities["Project"][0],
+            entity=entities["Shot"][0],
+            step={"type": "Step", "id": 1},
+        ),
+    ]
+
+    hook = module.PickEnvironment()
+    start = time.time()
+    for index in range(calls):
+        hook.execute(contexts[index % len(contexts)])
+    return [_result("pick_environment", "execute", 0, calls, 0, time.time() - start)]
+
+
+def bench_folder_creation(work_dir, shots, workers=(1, 16)):
+    module = toolkit_stub.load_hook("core/hooks/process_folder_creation.py")
+    sg = MockShotgun()
+    sequences = max(1, shots // 100)
+    entities = synthetic_project.populate_shotgun(
+        sg, sequences=sequences, shots_per_sequence=max(1, shots // sequences), assets=shots // 10
+    )
+    parent = types.SimpleNamespace(sgtk=toolkit_stub.Toolkit(sg, roots={"primary": work_dir}))
+    hook = module.ProcessFolderCreation(parent)
+
+    results = []
+    for count in workers:
+        os.environ["CBFX_FOLDER_WORKERS"] = str(count)
+        items = synthetic_project.build_items(os.path.join(work_dir, "bench_w%d" % count), entities)
+        try:
+            for op in ("create", "existing"):
+                start = time.time()
+                locations = hook.execute(items, False)
+                results.append(_result(
+                    "folder_creation", "%s_w%d" % (op, count), 0, len(items), 0, time.time() - start,
+                    created=len(locations),
+                ))
+        finally:
+            os.environ.pop("CBFX_FOLDER_WORKERS", None)
+    return results
+
+
+def bench_loader(work_dir, frames, loads):
+    import nuke
+
+    module = toolkit_stub.load_hook("hooks/tk-multi-loader2/tk-nuke_actions.py")
+    first_frame = synthetic_project.make_frame_sequence(
+        os.path.join(work_dir, "frames"), frames=frames, missing=(1010, 1011)
+    )
+    path = first_frame.replace("1001", "%04d")
+    sg_publish_data = {"type": "PublishedFile", "id": 1, "code": "render", "path": {"local_path": path}}
+
+    sg = MockShotgun()
+    app = types.SimpleNamespace(
+        sgtk=toolkit_stub.Toolkit(sg),
+        shotgun=sg,
+        log_debug=lambda msg: None,
+        log_info=lambda msg: None,
+        log_warning=lambda msg: None,
+        engine=None,
+    )
+    hook = module.NukeActions(app)
+    start = time.time()
+    for _ in range(loads):
+        hook.execute_action("read_node", {}, sg_publish_data)
+    read_node = nuke.allNodes()[-1]
+    seq_range = [read_node["first"].value(), read_node["last"].value()]
+    return [_result(
+        "loader", "read_node", 0, loads, sg.call_count, time.time() - start,
+        frames=frames, range=seq_range,
+    )]
+
+
+SCENARIOS = {
+    "context_change": lambda args, work_dir, rtt: bench_context_change(rtt, args.switches),
+    "engine_init": lambda args, work_dir, rtt: bench_engine_init(rtt, args.starts),
+    "pick_environment": lambda args, work_dir, rtt: bench_pick_environment(args.picks),
+    "folder_creation": lambda args, work_dir, rtt: bench_folder_creation(work_dir, args.shots),
+    "loader": lambda args, work_dir, rtt: bench_loader(work_dir, args.frames, args.loads),
+}
+
+# the scenarios making ShotGrid calls, run at every round trip time
+_RTT_SCENARIOS = ("context_change", "engine_init")
+
+
+def run_scenario(name, args, work_dir, rtt):
+    """
+    Runs a scenario in a new process.
+
+    :returns: The results of the scenario.
+    """
+    scenario_dir = tempfile.mkdtemp(prefix=name + "_", dir=work_dir)
+    env = dict(os.environ, CBFX_CACHE_DIR=os.path.join(scenario_dir, "cache"))
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        "--scenario", name,
+        "--work-dir", scenario_dir,
+        "--rtt", str(rtt),
+        "--switches", str(args.switches),
+        "--starts", str(args.starts),
+        "--picks", str(args.picks),
+        "--shots", str(args.shots),
+        "--frames", str(args.frames),
+        "--loads", str(args.loads),
+    ]
+    output = subprocess.check_output(command, env=env)
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def run(args):
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="cbfx_bench_")
+    try:
+        for rtt in args.rtt:
+            for name in _RTT_SCENARIOS:
+                results.extend(run_scenario(name, args, work_dir, rtt))
+        for name in SCENARIOS:
+            if name not in _RTT_SCENARIOS:
+                results.extend(run_scenario(name, args, work_dir, 0))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def _key(result):
+    return (result["bench"], result["op"], result["rtt_ms"])
+
+
+def print_results(results, baseline=None):
+    baseline = dict((_key(r), r) for r in baseline or [])
+    row = "{:<18} {:<16} {:>6} {:>7} {:>10} {:>12} {:>10}"
+    print(row.format("bench", "op", "rtt", "ops", "calls/op", "ms/op", "vs base"))
+    for result in results:
+        delta = ""
+        base = baseline.get(_key(result))
+        if base and base["ms_per_op"]:
+            delta = "%+.0f%%" % ((result["ms_per_op"] / base["ms_per_op"] - 1) * 100)
+        print(row.format(
+            result["bench"],
+            result["op"],
+            result["rtt_ms"],
+            result["ops"],
+            result["calls_per_op"],
+            "%.3f" % result["ms_per_op"],
+            delta,
+        ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rtt", type=float, nargs="+", default=[0, 50, 200],
+                        help="ShotGrid round trip times to benchmark, in ms.")
+    parser.add_argument("--switches", type=int, default=20, help="Context switches per run.")
+    parser.add_argument("--starts", type=int, default=5, help="Engine starts per run.")
+    parser.add_argument("--picks", type=int, default=10000, help="Environment picks.")
+    parser.add_argument("--shots", type=int, default=1000, help="Shots in the synthetic tree.")
+    parser.add_argument("--frames", type=int, default=5000, help="Frames in the sequence.")
+    parser.add_argument("--loads", type=int, default=5, help="Sequence range lookups.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against.")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        # a single scenario, in the process run_scenario started
+        results = SCENARIOS[args.scenario](args, args.work_dir, args.rtt[0])
+        print(json.dumps(results))
+        return 0
+
+    results = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Synthetic project data for the benchmarks.
+
+Builds the folder creation items Toolkit would hand to the
+``process_folder_creation`` core hook by expanding ``core/schema`` for a given
+number of sequences, shots, assets and steps, fills a mock ShotGrid with the
+matching entities and writes frame sequences to disk for the loader.
+"""
+
+import fnmatch
+import os
+
+import yaml
+
+from toolkit_stub import CONFIG_ROOT
+
+SCHEMA_ROOT = os.path.join(CONFIG_ROOT, "core", "schema")
+
+DEFAULT_STEPS = ["comp", "lgt", "anim", "fx"]
+
+
+def _ignore_patterns():
+    patterns = []
+    with open(os.path.join(SCHEMA_ROOT, "ignore_files")) as fh:
+        for line in fh:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                patterns.append(line)
+    return patterns
+
+
+def _metadata(schema_dir, name):
+    path = os.path.join(schema_dir, name + ".yml")
+    if not os.path.exists(path):
+        return {"type": "static"}
+    with open(path) as fh:
+        return yaml.safe_load(fh) or {"type": "static"}
+
+
+def build_items(project_root, entities, steps=DEFAULT_STEPS):
+    """
+    Expands the schema into folder creation items.
+
+    :param str project_root: Path the project folder is created at.
+    :param dict entities: Entity links keyed by entity type, used to expand
+        the ``shotgun_entity`` folders.
+    :param list steps: Step short names used to expand ``shotgun_step`` folders.
+    :returns: List of item dictionaries, parents before children.
+    """
+    ignored = _ignore_patterns()
+    items = []
+
+    def expand(schema_dir, target_dir):
+        for name in sorted(os.listdir(schema_dir)):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in ignored):
+                continue
+            schema_path = os.path.join(schema_dir, name)
+
+            if os.path.isfile(schema_path):
+                if name.endswith(".yml") and os.path.isdir(schema_path[:-4]):
+                    continue
+                items.append({
+                    "action": "copy",
+                    "metadata": {},
+                    "source_path": schema_path,
+                    "target_path": os.path.join(target_dir, name),
+                })
+                continue
+
+            metadata = _metadata(schema_dir, name)
+            folder_type = metadata.get("type")
+            if folder_type == "shotgun_entity":
+                for entity in entities.get(metadata["entity_type"], []):
+                    path = os.path.join(target_dir, entity["name"])
+                    items.append({
+                        "action": "entity_folder",
+                        "metadata": metadata,
+                        "path": path,
+                        "entity": entity,
+                    })
+                    expand(schema_path, path)
+            elif folder_type == "shotgun_step":
+                for step in steps:
+                    path = os.path.join(target_dir, step)
+                    items.append({
+                        "action": "entity_folder",
+                        "metadata": metadata,
+                        "path": path,
+                        "entity": {"type": "Step", "id": steps.index(step) + 1, "name": step},
+                    })
+                    expand(schema_path, path)
+            else:
+                path = os.path.join(target_dir, name)
+                items.append({"action": "folder", "metadata": metadata, "path": path})
+                expand(schema_path, path)
+
+    items.append({
+        "action": "entity_folder",
+        "metadata": _metadata(SCHEMA_ROOT, "project"),
+        "path": project_root,
+        "entity": entities["Project"][0],
+    })
+    expand(os.path.join(SCHEMA_ROOT, "project"), project_root)
+    return items
+
+
+def populate_shotgun(sg, sequences=10, shots_per_sequence=100, assets=50, user=None):
+    """
+    Fills the mock ShotGrid with a project, its sequences, shots, assets
+    and one task per shot assigned to ``user``.
+
+    :returns: Entity links keyed by entity type.
+    """
+    project = sg.add(
+        "Project",
+        name="Benchmark",
+        code="BENCH",
+        tank_name="bench",
+        sg_frame_rate=24,
+        sg_fps=24,
+        sg_type="Feature",
+        sg_default_format="2048x1080",
+        sg_camera_raw=None,
+        sg_lut="bench_lut",
+    )
+    entities = {"Project": [project], "Sequence": [], "Shot": [], "Asset": [], "Task": []}
+
+    for seq_index in range(sequences):
+        sequence = sg.add(
+            "Sequence", code="sq%03d" % (seq_index + 1), project=project, sg_lut="seq_lut"
+        )
+        entities["Sequence"].append(sequence)
+        for shot_index in range(shots_per_sequence):
+            shot = sg.add(
+                "Shot",
+                code="%s_sh%04d" % (sequence["name"], (shot_index + 1) * 10),
+                project=project,
+                sg_sequence=sequence,
+                sg_cut_in=1001,
+                sg_cut_out=1100,
+                sg_head_in=993,
+                sg_tail_out=1108,
+            )
+            entities["Shot"].append(shot)
+            entities["Task"].append(sg.add(
+                "Task",
+                content="comp",
+                project=project,
+                entity=shot,
+                task_assignees=[user] if user else [],
+                sg_status_list="ip",
+            ))
+
+    for asset_index in range(assets):
+        entities["Asset"].append(
+            sg.add("Asset", code="asset%03d" % (asset_index + 1), project=project)
+        )
+    return entities
+
+
+def make_frame_sequence(directory, name="render", frames=1000, first=1001, ext=".exr", missing=()):
+    """
+    Writes an empty frame sequence to disk.
+
+    :returns: The path of the first frame.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for frame in range(first, first + frames):
+        if frame in missing:
+            continue
+        open(os.path.join(directory, "%s.%04d%s" % (name, frame, ext)), "w").close()
+    return os.path.join(directory, "%s.%04d%s" % (name, first, ext))
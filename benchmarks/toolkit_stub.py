@@ -0,0 +1,231 @@
+"""
+Minimal stand-ins for the Toolkit modules the config hooks import.
+
+The benchmarks load the hooks outside of a Toolkit session. When tk-core is
+importable it is used as is; otherwise :func:`install` registers just enough
+of ``sgtk``, ``tank`` and ``tank_vendor`` for the hook modules to import and
+run against the mock ShotGrid. Outside of Nuke, it also registers a ``nuke``
+module whose nodes only hold their knob values, for the loader actions.
+"""
+
+import importlib.util
+import logging
+import os
+import sys
+import types
+
+CONFIG_ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+
+class TankError(Exception):
+    pass
+
+
+class Hook(object):
+    """
+    Stand-in for :class:`sgtk.Hook`.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.logger = logging.getLogger("benchmarks.hook")
+
+    @property
+    def sgtk(self):
+        return getattr(self.parent, "sgtk", None)
+
+    def get_publish_path(self, sg_publish_data):
+        return sg_publish_data["path"]["local_path"]
+
+
+class Context(object):
+    """
+    Stand-in for :class:`sgtk.Context`.
+    """
+
+    def __init__(self, tk, project=None, entity=None, step=None, task=None, user=None):
+        self.sgtk = tk
+        self.project = project
+        self.entity = entity
+        self.step = step
+        self.task = task
+        self.user = user
+        self.source_entity = None
+        self.additional_entities = []
+
+    def _identity(self):
+        return tuple(
+            (e["type"], e["id"]) if e else None
+            for e in (self.project, self.entity, self.step, self.task)
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, Context) and self._identity() == other._identity()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        parts = [e.get("name") or str(e["id"]) for e in (self.task, self.entity, self.project) if e]
+        return ", ".join(parts)
+
+    def to_dict(self):
+        return {
+            "project": self.project,
+            "entity": self.entity,
+            "step": self.step,
+            "task": self.task,
+            "user": self.user,
+            "additional_entities": self.additional_entities,
+            "source_entity": self.source_entity,
+        }
+
+
+class _Descriptor(object):
+    def get_uri(self):
+        return "sgtk:descriptor:path?path={}".format(CONFIG_ROOT)
+
+    def get_path(self):
+        return CONFIG_ROOT
+
+
+class Toolkit(object):
+    """
+    Stand-in for :class:`sgtk.Sgtk` wrapping the mock ShotGrid.
+    """
+
+    version = "v0.21.8"
+
+    def __init__(self, shotgun, roots=None):
+        self.shotgun = shotgun
+        self.roots = roots or {}
+        self.configuration_descriptor = _Descriptor()
+
+    def template_from_path(self, path):
+        return None
+
+
+class _Knob(object):
+    def __init__(self):
+        self._value = None
+
+    def value(self):
+        return self._value
+
+    def setValue(self, value):
+        self._value = value
+
+    def fromUserText(self, value):
+        self._value = value
+
+
+class _Node(object):
+    """
+    Stand-in for a Nuke node, holding the values of its knobs.
+    """
+
+    def __init__(self, node_class):
+        self.node_class = node_class
+        self._knobs = dict(
+            (name, _Knob()) for name in ("file", "format", "first", "last", "origfirst", "origlast")
+        )
+
+    def __getitem__(self, name):
+        return self._knobs[name]
+
+    def knobs(self):
+        return self._knobs
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def install():
+    """
+    Registers the stand-in modules, unless tk-core is importable.
+
+    :returns: ``True`` if the stand-ins were installed.
+    """
+    try:
+        import nuke  # noqa: F401
+    except ImportError:
+        nodes = []
+
+        def create_node(node_class, args=""):
+            nodes.append(_Node(node_class))
+            return nodes[-1]
+
+        _module(
+            "nuke",
+            allNodes=lambda: list(nodes),
+            createNode=create_node,
+            formats=lambda: [],
+            addFormat=lambda spec: spec,
+            layers=lambda: [],
+            Layer=lambda name, channels: None,
+            env={},
+        )
+
+    try:
+        import sgtk  # noqa: F401
+
+        return False
+    except ImportError:
+        pass
+
+    platform = _module("sgtk.platform", current_engine=lambda: None)
+    authentication = _module(
+        "sgtk.authentication",
+        serialize_user=lambda user, use_json=False: "{}",
+        deserialize_user=lambda data: None,
+    )
+
+    def ensure_binary(value):
+        return value if isinstance(value, bytes) else value.encode("utf-8")
+
+    def is_windows():
+        return sys.platform == "win32"
+
+    util = _module(
+        "tank.util",
+        is_windows=is_windows,
+        is_linux=lambda: sys.platform.startswith("linux"),
+    )
+    common = dict(
+        Hook=Hook,
+        TankError=TankError,
+        Context=Context,
+        get_hook_baseclass=lambda: Hook,
+        get_authenticated_user=lambda: None,
+        platform=platform,
+        authentication=authentication,
+        util=util,
+        LogManager=lambda: types.SimpleNamespace(
+            global_instance=lambda: logging.getLogger("benchmarks")
+        ),
+    )
+    _module("sgtk", **common)
+    _module("tank", **common)
+    sgutils = _module("tank_vendor.sgutils", ensure_binary=ensure_binary)
+    _module("tank_vendor", sgutils=sgutils, six=sgutils)
+    return True
+
+
+def load_hook(relative_path):
+    """
+    Loads a hook file of the config as a standalone module, the way Toolkit
+    does.
+
+    :param str relative_path: Path of the hook, relative to the config root.
+    :returns: The loaded module.
+    """
+    path = os.path.join(CONFIG_ROOT, relative_path)
+    name = "benchmarks_hook_" + os.path.splitext(relative_path)[0].replace(os.sep, "_").replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
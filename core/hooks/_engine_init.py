@@ -2,11 +2,19 @@
 
 import sgtk
 import os
-try:
-    import tkinter as tk
-    from tkinter import messagebox
-except ImportError:
-    tk = None  # Fallback for environments without tkinter
+import sys
+import threading
+
+_PYTHON_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "python")
+)
+if _PYTHON_PATH not in sys.path:
+    sys.path.append(_PYTHON_PATH)
+
+from cbfx_config import mirror, project_health, project_settings, tracing
+
+# keeps the non-modal warning dialogs alive once shown
+_dialogs = []
 
 class EngineInitHook(sgtk.Hook):
     """
@@ -22,50 +30,97 @@ class EngineInitHook(sgtk.Hook):
             prev_engine_name: Name of the previous engine (if switching), or None.
             **kwargs: Additional arguments from the engine init process.
         """
-        if not engine:
-            # Log error if no engine is provided
-            sgtk.LogManager().global_instance().error("No engine available during initialization.")
-            return
+        with tracing.span(
+            "EngineInitHook.execute",
+            engine=getattr(engine, "name", None),
+            context=getattr(engine, "context", None),
+        ):
+            if not engine:
+                # Log error if no engine is provided
+                sgtk.LogManager().global_instance().error("No engine available during initialization.")
+                return
 
-        context = engine.context
-        if not context or not context.project:
-            engine.log_warning("No project context available during engine init.")
-            return
+            context = engine.context
+            if not context or not context.project:
+                engine.log_warning("No project context available during engine init.")
+                return
+
+            # The validation runs off the startup path, engine bootstrap
+            # never waits on ShotGrid or on the artist
+            self._check_thread = threading.Thread(
+                target=self._check_critical_settings,
+                args=(engine, context.project["id"]),
+                name="cbfx-project-settings-check",
+            )
+            self._check_thread.daemon = True
+            self._check_thread.start()
+
+    def _check_critical_settings(self, engine, project_id):
+        """
+        Checks the critical project settings and warns when some are missing.
+        Runs on a background thread.
+
+        Args:
+            engine: The current engine instance.
+            project_id: Id of the project to check.
+        """
+        try:
+            with tracing.span(
+                "EngineInitHook.check_critical_settings",
+                engine=engine.name,
+                context=engine.context,
+            ) as trace:
+                self._check_project(engine, project_id, trace)
+        except Exception as e:
+            engine.log_warning(f"Failed to check the critical project settings: {e}")
 
-        project_id = context.project["id"]
-        sg = engine.shotgun
+    def _check_project(self, engine, project_id, trace):
+        """
+        Reads the critical project settings and notifies the artist about the
+        missing ones.
+
+        Args:
+            engine: The current engine instance.
+            project_id: Id of the project to check.
+            trace: The tracing span of this check.
+        """
+        # engine.shotgun is thread local, this thread gets its own connection
+        sg = trace.shotgun(engine.shotgun)
         if not sg:
             engine.log_error("No ShotGrid API instance available.")
             return
 
-        # Fetch all project fields
-        project_schema = sg.schema_field_read("Project")
-        all_fields = list(project_schema.keys())
-        project_data = sg.find_one("Project", [["id", "is", project_id]], all_fields)
-        if not project_data:
-            engine.log_error(f"No project data returned for ID: {project_id}")
-            return
+        # The outcome of the check is cached per site, project and session
+        site = getattr(sg, "base_url", None)
+        user = sgtk.get_authenticated_user()
+        session = getattr(user, "login", None)
+        missing_settings = project_settings.get_outcome(site, project_id, session)
+
+        if missing_settings is None:
+            # The site-wide report answers with a local file read
+            missing_settings = project_health.get_missing_settings(site, project_id)
+            if missing_settings is not None:
+                project_settings.set_outcome(site, project_id, session, missing_settings)
+
+        if missing_settings is None:
+            critical_fields = project_settings.CRITICAL_FIELDS
+
+            # Read the critical settings from the local ShotGrid mirror first
+            project_data = mirror.get_entity(
+                project_id, "Project", project_id, list(critical_fields)
+            )
+            if project_data is None:
+                # Only request the critical fields which exist on this site,
+                # the others are reported as missing
+                project_schema = project_settings.read_schema(sg, "Project", site)
+                fields = [f for f in critical_fields if f in project_schema]
+                project_data = sg.find_one("Project", [["id", "is", project_id]], fields)
+                if not project_data:
+                    engine.log_error(f"No project data returned for ID: {project_id}")
+                    return
 
-        # Filter out unwanted fields
-        exclude_fields = {"landing_page_url", "image", "image_blur_hash"}
-        project_data_filtered = {
-            k: v for k, v in project_data.items()
-            if k not in exclude_fields and not k.startswith("custom_non_project_entity")
-        }
-
-        # Check critical settings
-        critical_fields = {
-            "sg_fps": "Default FPS",
-            "sg_type": "Type",
-            "code": "Pipeline Code",
-            "sg_default_format": "Default Format"
-        }
-        missing_settings = []
-        for field_key, field_label in critical_fields.items():
-            value = project_data_filtered.get(field_key)
-            is_empty = value is None or (isinstance(value, (list, str, dict)) and not value)
-            if is_empty:
-                missing_settings.append(field_label)
+            missing_settings = project_settings.missing_settings(project_data)
+            project_settings.set_outcome(site, project_id, session, missing_settings)
 
         if missing_settings:
             warning_message = (
@@ -74,18 +129,46 @@ class EngineInitHook(sgtk.Hook):
                 "\n\nThese must be set in Flow Production Tracking on the Project's Overview page, "
                 "for other pipeline tools to work properly. Please contact your Producer to fix this issue."
             )
+            engine.log_warning(warning_message)
+            self._notify(engine, site, project_id, warning_message)
+
+    def _notify(self, engine, site, project_id, warning_message):
+        """
+        Shows a non-modal warning when the engine has a Qt UI, once per project
+        per day. The GUI toolkit is only imported here, when a warning actually
+        fires.
+
+        Args:
+            engine: The current engine instance.
+            site: The ShotGrid site URL.
+            project_id: The ID of the project.
+            warning_message: The message to show.
+        """
+        if engine.has_ui:
+            # Only bother the artist once per project per day, engines
+            # without a UI don't use up the notification
+            if project_settings.claim_notification(site, project_id):
+                # Qt widgets must be created on the main thread
+                engine.async_execute_in_main_thread(self._show_qt_dialog, warning_message)
+        else:
+            # No Qt in this engine. A tkinter dialog would be modal, and Tk
+            # can't run on this background thread, the warning is only logged.
+            engine.log_debug("No Qt UI in this engine, the warning was only logged.")
+
+    def _show_qt_dialog(self, warning_message):
+        """
+        Shows the warning in a non-modal Qt message box.
+
+        Args:
+            warning_message: The message to show.
+        """
+        from sgtk.platform.qt import QtCore, QtGui
 
-            # Try to show a dialog with tkinter
-            if tk and "DISPLAY" in os.environ:
-                try:
-                    root = tk.Tk()
-                    root.withdraw()  # Hide the root window
-                    messagebox.showwarning("Critical Settings Missing", warning_message)
-                    root.destroy()
-                except Exception as e:
-                    engine.log_warning(f"Failed to show tkinter dialog: {str(e)}. Falling back to log.")
-                    engine.log_warning(warning_message)
-            else:
-                # Fallback to logging if no GUI or tkinter unavailable
-                engine.log_warning("No GUI environment detected or tkinter unavailable.")
-                engine.log_warning(warning_message)
+        dialog = QtGui.QMessageBox(
+            QtGui.QMessageBox.Warning, "Critical Settings Missing", warning_message
+        )
+        dialog.setWindowModality(QtCore.Qt.NonModal)
+        dialog.setAttribute(QtCore.Qt.WA_DeleteOnClose)
+        dialog.finished.connect(lambda *args: _dialogs.remove(dialog))
+        _dialogs.append(dialog)
+        dialog.show()
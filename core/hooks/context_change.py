@@ -12,13 +12,21 @@
 This hook gets executed before and after the context changes in Toolkit.
 """
 
-import base64
 import os
-import pickle
+import sys
 
 import sgtk
 from sgtk import get_hook_baseclass
 
+_PYTHON_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "python")
+)
+if _PYTHON_PATH not in sys.path:
+    sys.path.append(_PYTHON_PATH)
+
+from cbfx_config import bootstrap, mirror, prefetch, tracing
+from cbfx_config.entity_cache import get_entity_cache
+
 try:
     import vfxjob
 
@@ -77,8 +85,41 @@ class ContextChange(get_hook_baseclass()):
         __field_folder_name,
         __field_fps,
     ]
+    __asset_fields = ["code"]
     __task_fields = ["code", "entity"]
 
+    # environment variables grouped by the context component they depend on
+    __context_env_vars = [
+        "SHOTGUN_CONTEXT_ID",
+        "SHOTGUN_CONTEXT_TYPE",
+        "SHOTGUN_TASK_ID",
+        "SHOTGUN_ENTITY_ID",
+        "SHOTGUN_ENTITY_TYPE",
+    ]
+    __entity_env_vars = [
+        "SHOTGUN_SHOT_ID",
+        "SHOTGUN_SHOT_CODE",
+        "SHOTGUN_SEQUENCE_ID",
+        "SHOTGUN_SEQUENCE_CODE",
+        "SHOTGUN_ASSET_ID",
+        "SHOTGUN_ASSET_CODE",
+        "SHOTGUN_EDIT_CUT_IN",
+        "SHOTGUN_EDIT_CUT_OUT",
+        "SHOTGUN_EDIT_HEAD_IN",
+        "SHOTGUN_EDIT_TAIL_OUT",
+        "SHTOGUN_EDIT_CUT_IN",
+        "SHTOGUN_EDIT_CUT_OUT",
+        "SHTOGUN_EDIT_HEAD_IN",
+        "SHTOGUN_EDIT_TAIL_OUT",
+        "SHOT",  # redundant but needed for OCIO context
+        "SEQ",  # redundant but needed for OCIO context
+    ]
+    __project_env_vars = [
+        "SHOTGUN_PROJECT_ID",
+        "SHOTGUN_PROJECT_CODE",
+        "SHOTGUN_FPS",
+    ]
+
     def pre_context_change(self, current_context, next_context):
         """
         Executed before the context has changed.
@@ -90,6 +131,18 @@ class ContextChange(get_hook_baseclass()):
         :param next_context: The context the engine is switching to.
         :type next_context: :class:`~sgtk.Context`
         """
+        with tracing.span(
+            "ContextChange.pre_context_change", context=next_context
+        ) as self._trace:
+            self._change_context(current_context, next_context)
+
+    def _change_context(self, current_context, next_context):
+        """
+        Resolves the environment of ``next_context`` and applies it.
+
+        :param current_context: The context of the engine.
+        :param next_context: The context the engine is switching to.
+        """
         self.current_context = current_context
         self.next_context = next_context
 
@@ -98,32 +151,42 @@ class ContextChange(get_hook_baseclass()):
         self.asset_entity = None
         self.project_entity = None
 
+        if (
+            current_context is None
+            and next_context is not None
+            and next_context.project
+            and next_context.user
+            and prefetch.is_enabled()
+        ):
+            # engine startup: warm up the entities of the user's open tasks
+            # so that later context switches don't need to query ShotGrid
+            prefetch.get_prefetch_store().start(
+                next_context.sgtk,
+                next_context.project,
+                next_context.user,
+                dict(
+                    (entity_type, self._query_fields(entity_type))
+                    for entity_type in ("Shot", "Sequence", "Asset", "Project")
+                ),
+            )
+
         if next_context != current_context and next_context is not None:
             # if next_context.project is none we can assume we are in a 'site' context and
             # we should not fire
             if next_context.project is None:
                 return
 
-            self.env_vars = {
-                "SHOTGUN_CONTEXT_ID": None,
-                "SHOTGUN_CONTEXT_TYPE": None,
-                "SHOTGUN_TASK_ID": None,
-                "SHOTGUN_PROJECT_ID": None,
-                "SHOTGUN_PROJECT_CODE": None,
-                "SHOTGUN_SHOT_ID": None,
-                "SHOTGUN_SHOT_CODE": None,
-                "SHOTGUN_SEQUENCE_ID": None,
-                "SHOTGUN_SEQUENCE_CODE": None,
-                "SHOTGUN_ASSET_ID": None,
-                "SHOTGUN_ASSET_CODE": None,
-                "SHOTGUN_EDIT_CUT_IN": None,
-                "SHOTGUN_EDIT_CUT_OUT": None,
-                "SHOTGUN_EDIT_HEAD_IN": None,
-                "SHOTGUN_EDIT_TAIL_OUT": None,
-                "SHOTGUN_FPS": None,
-                "SHOT": None,  # redundant but needed for OCIO context
-                "SEQ": None,  # redundant but needed for OCIO context
-            }
+            changed = self._changed_components(current_context, next_context)
+            self.logger.debug(
+                "Context components changed: {}".format(", ".join(sorted(changed)))
+            )
+
+            self.env_vars = dict(
+                (key, None)
+                for key in self.__context_env_vars
+                + self.__entity_env_vars
+                + self.__project_env_vars
+            )
 
             if next_context.task:
                 self.env_vars["SHOTGUN_TASK_ID"] = next_context.task["id"]
@@ -151,21 +214,69 @@ class ContextChange(get_hook_baseclass()):
                     self.env_vars["SHOTGUN_CONTEXT_ID"] = self.entity_id
                     self.env_vars["SHOTGUN_CONTEXT_TYPE"] = self.entity_type
 
+            if changed & {"project", "entity"}:
+                self.build_environs(self.entity_type)
+            else:
+                # only the task changed, the entity and project variables set
+                # by the previous context change are still valid
+                for key in self.__entity_env_vars + self.__project_env_vars:
+                    self.env_vars[key] = os.environ.get(key)
+
             # commits required context to an encoded SHOTGUN_BOOTSTRAP_CACHE env var
             self.create_bootstrap_cache(next_context)
 
-            self.build_environs(self.entity_type)
+            self.apply_environs()
 
-            # setting job details for setting proper job environment
-            if vfxjob_loaded:
+            # setting job details for setting proper job environment, which
+            # only depends on the project
+            if vfxjob_loaded and "project" in changed:
                 vfxjob.utils.prep_environment_for_rez(
                     self.project_entity.get(self.__field_folder_name)
                 )
 
+    @staticmethod
+    def _changed_components(current_context, next_context):
+        """
+        Returns which identity components differ between two contexts.
+
+        :param current_context: The context of the engine, or ``None``.
+        :param next_context: The context the engine is switching to.
+        :returns: Set holding any of ``project``, ``entity`` and ``task``.
+        """
+        def identity(entity):
+            return (entity["type"], entity["id"]) if entity else None
+
+        if current_context is None:
+            return {"project", "entity", "task"}
+
+        # the entity and project variables are reused from the environment
+        # on task switches, make sure they were set for this project
+        if os.environ.get("SHOTGUN_PROJECT_ID") != str(next_context.project["id"]):
+            return {"project", "entity", "task"}
+
+        changed = set()
+        if identity(current_context.project) != identity(next_context.project):
+            changed.update(["project", "entity"])
+        if identity(current_context.entity) != identity(next_context.entity):
+            changed.add("entity")
+        if identity(current_context.task) != identity(next_context.task):
+            changed.add("task")
+        return changed
+
     def build_environs(self, context_type):
+        entity_cache = get_entity_cache()
+
+        # every context type is resolved with a single query, pulling the
+        # sequence and project data in as linked fields of the entity
         if context_type == "Shot":
-            self.shot_entity = self.next_context.sgtk.shotgun.find_one(
-                "Shot", [["id", "is", self.entity_id]], self.__shot_fields
+            self.shot_entity = self._find_entity(
+                "Shot", self.entity_id, self._query_fields("Shot")
+            )
+            self.sequence_entity = self._split_linked(
+                self.shot_entity, "sg_sequence", "Sequence", self.__sequence_fields
+            )
+            self.project_entity = self._split_linked(
+                self.shot_entity, "project", "Project", self.__project_fields
             )
 
             self.env_vars["SHOTGUN_SHOT_CODE"] = self.env_vars["SHOT"] = (
@@ -185,65 +296,156 @@ class ContextChange(get_hook_baseclass()):
                 self.__field_tail_out
             )
 
-            shot_sequence = self.shot_entity.get("sg_sequence")
-            if shot_sequence:
-                sequence_id = self.shot_entity.get("sg_sequence").get("id")
-                self.sequence_entity = self.next_context.sgtk.shotgun.find_one(
-                    "Sequence", [["id", "is", sequence_id]], self.__sequence_fields
-                )
-                self.env_vars["SHOTGUN_SEQUENCE_CODE"] = self.env_vars["SEQ"] = (
-                    self.sequence_entity.get("code")
-                )
-                self.env_vars["SHOTGUN_SEQUENCE_ID"] = self.sequence_entity.get("id")
-
-            self.project_entity = self.next_context.sgtk.shotgun.find_one(
-                "Project",
-                [["id", "is", self.next_context.project["id"]]],
-                self.__project_fields,
+        elif context_type == "Sequence":
+            self.sequence_entity = self._find_entity(
+                "Sequence", self.entity_id, self._query_fields("Sequence")
+            )
+            self.project_entity = self._split_linked(
+                self.sequence_entity, "project", "Project", self.__project_fields
             )
-            self.env_vars["SHOTGUN_PROJECT_CODE"] = self.project_entity.get("code")
-            self.env_vars["SHOTGUN_PROJECT_ID"] = self.project_entity.get("id")
-            self.env_vars["SHOTGUN_FPS"] = self.project_entity.get(self.__field_fps)
 
-        if context_type == "Sequence":
-            self.sequence_entity = self.next_context.sgtk.shotgun.find_one(
-                "Sequence", [["id", "is", self.entity_id]], self.__sequence_fields
+        elif context_type == "Asset":
+            self.asset_entity = self._find_entity(
+                "Asset", self.entity_id, self._query_fields("Asset")
+            )
+            self.project_entity = self._split_linked(
+                self.asset_entity, "project", "Project", self.__project_fields
             )
+
+            self.env_vars["SHOTGUN_ASSET_CODE"] = self.asset_entity.get("code")
+            self.env_vars["SHOTGUN_ASSET_ID"] = self.asset_entity.get("id")
+
+        if self.sequence_entity:
             self.env_vars["SHOTGUN_SEQUENCE_CODE"] = self.env_vars["SEQ"] = (
                 self.sequence_entity.get("code")
             )
             self.env_vars["SHOTGUN_SEQUENCE_ID"] = self.sequence_entity.get("id")
 
-        if context_type == "Asset":
-            self.asset_entity = self.next_context.sgtk.shotgun.find_one(
-                "Asset", [["id", "is", self.entity_id]], self.__asset_fields
+        if not self.project_entity:
+            # project contexts, or entities not linked to a project
+            self.project_entity = self._find_entity(
+                "Project", self.next_context.project["id"], self._query_fields("Project")
             )
-            self.env_vars["SHOTGUN_ASSET_CODE"] = self.asset_entity.get("code")
-            self.env_vars["SHOTGUN_ASSET_ID"] = self.asset_entity.get("id")
-
-        self.project_entity = self.next_context.sgtk.shotgun.find_one(
-            "Project",
-            [["id", "is", self.next_context.project["id"]]],
-            self.__project_fields,
-        )
         self.env_vars["SHOTGUN_PROJECT_CODE"] = self.project_entity.get("code")
         self.env_vars["SHOTGUN_PROJECT_ID"] = self.project_entity.get("id")
         self.env_vars["SHOTGUN_FPS"] = self.project_entity.get(self.__field_fps)
 
-        # set the env variables
+        stats = entity_cache.stats()
+        self.logger.debug(
+            "Entity cache: {hits} hits, {misses} misses, {size} entries".format(**stats)
+        )
+        if prefetch.is_enabled():
+            stats = prefetch.get_prefetch_store().stats()
+            self.logger.debug(
+                "Prefetch store: served {served} of {lookups} lookups, "
+                "{size} entries".format(**stats)
+            )
+
+    def apply_environs(self):
+        """
+        Sets the environment variables resolved by :meth:`build_environs`,
+        clearing the ones which resolved to an empty value. Only the variables
+        whose value actually changed are touched.
+        """
         for key, value in self.env_vars.items():
             if not value:
-                if os.environ.get(key):
+                if key in os.environ:
                     self.logger.debug("Clearing ENV variable: {}".format(key))
                     os.environ.pop(key)
-            else:
+            elif os.environ.get(key) != str(value):
                 self.logger.debug("Setting ENV variable: {} = {}".format(key, value))
                 os.environ[key] = str(value)
 
+    def _find_entity(self, entity_type, entity_id, fields):
+        """
+        Returns the given entity, served from the prefetch store, the local
+        ShotGrid mirror or the process-wide entity cache when possible.
+
+        :param str entity_type: ShotGrid entity type.
+        :param int entity_id: ShotGrid entity id.
+        :param list fields: Fields to return.
+        :returns: The entity dictionary, or an empty one if it does not exist.
+        """
+        entity = None
+        if prefetch.is_enabled():
+            entity = prefetch.get_prefetch_store().get(entity_type, entity_id, fields)
+        if entity is None:
+            entity = mirror.get_entity(
+                self.next_context.project["id"], entity_type, entity_id, fields
+            )
+        if entity is None:
+            entity = get_entity_cache().find_one(
+                self._trace.shotgun(self.next_context.sgtk.shotgun),
+                entity_type,
+                entity_id,
+                fields,
+            )
+        return entity or {}
+
+    def _query_fields(self, entity_type):
+        """
+        Returns the fields needed to resolve the environment of a context of
+        the given type, including the linked sequence and project fields.
+
+        :param str entity_type: Shot, Sequence, Asset or Project.
+        :returns: List of ShotGrid field names.
+        """
+        if entity_type == "Project":
+            return list(self.__project_fields)
+
+        project_fields = ["project"] + self._linked_fields(
+            "project", "Project", self.__project_fields
+        )
+        if entity_type == "Shot":
+            return (
+                self.__shot_fields
+                + self._linked_fields("sg_sequence", "Sequence", self.__sequence_fields)
+                + project_fields
+            )
+        if entity_type == "Sequence":
+            return self.__sequence_fields + project_fields
+        if entity_type == "Asset":
+            return self.__asset_fields + project_fields
+        return []
+
+    @staticmethod
+    def _linked_fields(link_field, entity_type, fields):
+        """
+        Returns the ShotGrid linked field names used to fetch ``fields`` of the
+        entity behind ``link_field``, ie. ``sg_sequence.Sequence.code``.
+        """
+        return ["{}.{}.{}".format(link_field, entity_type, field) for field in fields]
+
+    @staticmethod
+    def _split_linked(entity, link_field, entity_type, fields):
+        """
+        Extracts the linked entity fetched with :meth:`_linked_fields` from
+        ``entity`` as a regular entity dictionary.
+
+        :returns: The linked entity dictionary, or ``None`` if ``link_field``
+            is empty.
+        """
+        link = entity.get(link_field)
+        if not link:
+            return None
+
+        linked_entity = {"type": entity_type, "id": link["id"]}
+        for field in fields:
+            linked_entity[field] = entity.get(
+                "{}.{}.{}".format(link_field, entity_type, field)
+            )
+        return linked_entity
+
     def create_bootstrap_cache(self, next_context):
-        def encode_object(obj):
-            return base64.b64encode(pickle.dumps(obj)).decode("utf-8")
+        """
+        Encodes what child processes need to bootstrap without network
+        lookups into ``SHOTGUN_BOOTSTRAP_CACHE``, see
+        :mod:`cbfx_config.bootstrap`, and serializes the current user into
+        ``SHOTGUN_USER_CACHE``.
 
+        :param next_context: The context the engine is switching to.
+        :type next_context: :class:`~sgtk.Context`
+        """
         cached_vars = {
             "SHOTGUN_SITE": None,
             "SHOTGUN_CONFIG_URI": None,
@@ -280,9 +482,17 @@ class ContextChange(get_hook_baseclass()):
         if next_context.project:
             cached_vars["SHOTGUN_PROJECT_ID"] = next_context.project["id"]
 
-        self.env_vars["SHOTGUN_BOOTSTRAP_CACHE"] = encode_object(cached_vars)
-        self.env_vars["SHOTGUN_USER_CACHE"] = sgtk.authentication.serialize_user(
-            sgtk.get_authenticated_user(), use_json=False
+        payload = {
+            "vars": cached_vars,
+            "context": next_context.to_dict(),
+            "environ": dict(
+                (key, None if not value else str(value))
+                for key, value in self.env_vars.items()
+            ),
+        }
+        self.env_vars[bootstrap.ENV_VAR] = bootstrap.encode_payload(payload)
+        self.env_vars[bootstrap.USER_ENV_VAR] = sgtk.authentication.serialize_user(
+            sgtk.get_authenticated_user(), use_json=True
         )
 
     def post_context_change(self, previous_context, current_context):
@@ -0,0 +1,47 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Core hook which creates folders on disk, ie. before an app saves or publishes
+into them.
+"""
+
+import os
+import sys
+
+from tank import Hook
+from tank.util import filesystem
+
+_PYTHON_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "python")
+)
+if _PYTHON_PATH not in sys.path:
+    sys.path.append(_PYTHON_PATH)
+
+from cbfx_config import deferred_folders, tracing
+
+
+class EnsureFolderExists(Hook):
+    def execute(self, path, bundle_obj, **kwargs):
+        """
+        Creates folders on disk.
+
+        The deferred folders the path needs are created first, in case the
+        background worker started at launch isn't done with them yet.
+
+        :param path: path to create
+        :param bundle_obj: Object requesting the creation. This is a legacy
+                           parameter and we recommend using self.parent instead.
+        """
+        with tracing.span("EnsureFolderExists.execute") as trace:
+            if deferred_folders.is_enabled():
+                created = deferred_folders.get_deferred_folders().flush(path)
+                trace.count("deferred_created", created)
+            filesystem.ensure_folder_exists(path, permissions=0o777)
@@ -2,8 +2,19 @@
 Hook which chooses an environment file to use based on the current context.
 """
 
+import os
+import sys
+
 from tank import Hook
 
+_PYTHON_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "python")
+)
+if _PYTHON_PATH not in sys.path:
+    sys.path.append(_PYTHON_PATH)
+
+from cbfx_config import env_snapshot, tracing
+
 
 class PickEnvironment(Hook):
     def execute(self, context, **kwargs):
@@ -11,7 +22,19 @@ class PickEnvironment(Hook):
         The default implementation assumes there are three environments, called shot, asset
         and project, and switches to these based on entity type.
         """
+        with tracing.span("PickEnvironment.execute", context=context):
+            env = self._pick_environment(context)
+            if env and env_snapshot.is_enabled():
+                # Toolkit then loads the environment from its compiled snapshot
+                env_snapshot.prime_yaml_cache(
+                    os.path.join(env_snapshot.ENV_ROOT, env + ".yml")
+                )
+            return env
 
+    def _pick_environment(self, context):
+        """
+        Returns the name of the environment to use for the given context.
+        """
         env = None
 
         if context.source_entity:
@@ -16,13 +16,14 @@ called.
 from tank import Hook
 import os
 import sys
-import shutil
-from tank.util import is_windows
 
-try:
-    from tank_vendor import sgutils
-except ImportError:
-    from tank_vendor import six as sgutils
+_PYTHON_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "python")
+)
+if _PYTHON_PATH not in sys.path:
+    sys.path.append(_PYTHON_PATH)
+
+from cbfx_config import deferred_folders, folder_creation, tracing
 
 
 class ProcessFolderCreation(Hook):
@@ -107,97 +108,68 @@ class ProcessFolderCreation(Hook):
         :rtype: list(str)
         """
 
-        # set the umask so that we get true permissions
+        with tracing.span("ProcessFolderCreation.execute") as trace:
+            return self._process_items(items, preview_mode, trace)
+
+    def _process_items(self, items, preview_mode, trace):
+        """
+        Carries out the folder creation actions described in :meth:`execute`.
+
+        :param list items: Actions that need to take place.
+        :param bool preview_mode: Only report what would be created.
+        :param trace: The tracing span counting the filesystem operations.
+        :returns: List of files and folders that have been created by this
+            call, the deferred folders created in the background aren't in it.
+        """
+        # remote folders are replayed on the roots using synced, independent
+        # storage, the other roots share the storage they were created on
+        remote = [
+            item
+            for item in items
+            if item.get("action") == "remote_entity_folder"
+            and folder_creation.replay_remote_folders(
+                folder_creation.root_name(item["path"], self.sgtk.roots)
+            )
+        ]
+
+        # the defer_creation folders of the launching engine are created in
+        # the background, the launch doesn't wait on them
+        deferred = []
+        if not preview_mode and deferred_folders.is_enabled():
+            items, deferred = deferred_folders.split_items(items)
+
+        # set the umask so that we get true permissions, once for all the
+        # workers since it is process wide
         old_umask = os.umask(0)
-        locations = []
         try:
-
-            # loop through our list of items
-            for i in items:
-
-                action = i.get("action")
-
-                if action in ["entity_folder", "folder"]:
-                    # folder creation
-                    path = i.get("path")
-                    if not os.path.exists(path):
-                        if not preview_mode:
-                            # create the folder using 777 permissions
-                            os.makedirs(path, 0o777)
-                        locations.append(path)
-
-                elif action == "remote_entity_folder":
-                    # Remote folder creation
-                    #
-                    # NOTE! This action happens when another user has created
-                    # a folder on their machine and we are syncing our local path
-                    # cache to be aware of this folder's existance.
-                    #
-                    # For a traditional setup, where the project storage is shared,
-                    # there is no need to do I/O for remote folders - these folders
-                    # have already been created on the remote storage so you have access
-                    # to them already.
-                    #
-                    # On a setup where each user or group of users is attached to
-                    # different, independendent file storages, which are synced,
-                    # it may be meaningful to "replay" the remote folder creation
-                    # on the local system. This would result in the same folder
-                    # scaffold on each disk which is storing project data.
-                    #
-                    # path = i.get("path")
-                    # if not os.path.exists(path):
-                    #     if not preview_mode:
-                    #         # create the folder using open permissions
-                    #         os.makedirs(path, 0o777)
-                    #     locations.append(path)
-                    pass
-
-                elif action == "symlink":
-                    # symbolic link
-                    if is_windows():
-                        # no windows support
-                        continue
-                    path = i.get("path")
-                    target = i.get("target")
-                    # note use of lexists to check existance of symlink
-                    # rather than what symlink is pointing at
-                    if not os.path.lexists(path):
-                        if not preview_mode:
-                            os.symlink(target, path)
-                            # set 777 permissions for the symlink
-                            os.chmod(path, 0o777)
-                        locations.append(path)
-
-                elif action == "copy":
-                    # a file copy
-                    source_path = i.get("source_path")
-                    target_path = i.get("target_path")
-                    if not os.path.exists(target_path):
-                        if not preview_mode:
-                            # do a standard file copy
-                            shutil.copy(source_path, target_path)
-                            # set 777 permissions
-                            os.chmod(target_path, 0o777)
-                        locations.append(target_path)
-
-                elif action == "create_file":
-                    # create a new file based on content
-                    path = i.get("path")
-                    parent_folder = os.path.dirname(path)
-                    content = i.get("content")
-                    if not os.path.exists(parent_folder) and not preview_mode:
-                        os.makedirs(parent_folder, 0o777)
-                    if not os.path.exists(path):
-                        if not preview_mode:
-                            # create the file
-                            fp = open(path, "wb")
-                            fp.write(sgutils.ensure_binary(content))
-                            fp.close()
-                            # set 777 permissions
-                            os.chmod(path, 0o777)
-                        locations.append(path)
+            creator = folder_creation.FolderCreator(preview_mode, trace, roots=self.sgtk.roots)
+            locations = creator.run(items)
         finally:
             # reset umask
             os.umask(old_umask)
 
+        if deferred:
+            journal = deferred_folders.get_deferred_folders().submit(deferred, self.sgtk.roots)
+            self.logger.debug("Deferred the creation of %d items to %s" % (len(deferred), journal))
+            trace.count("deferred_items", len(deferred))
+
+        if remote and preview_mode:
+            self.logger.info("%d remote folders would be replayed." % len(remote))
+        elif remote:
+            created, skipped = deferred_folders.get_deferred_folders().replay(
+                remote, self.sgtk.roots
+            )
+            trace.count("remote_created", created)
+            trace.count("remote_skipped", skipped)
+            self.logger.info(
+                "Replayed %d remote folders: %d created, %d skipped as they already existed."
+                % (len(remote), created, skipped)
+            )
+
+        trace.count("stat_calls_saved", creator.stat_calls_saved)
+        self.logger.debug(
+            "Folder creation made %d stat calls for %d items, %d saved by the path cache."
+            % (creator.paths.stat_calls, len(items), creator.stat_calls_saved)
+        )
+
         return locations
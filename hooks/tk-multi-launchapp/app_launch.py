@@ -8,6 +8,14 @@ import os
 import sys
 import sgtk
 
+_PYTHON_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "python")
+)
+if _PYTHON_PATH not in sys.path:
+    sys.path.append(_PYTHON_PATH)
+
+from cbfx_config import mirror, tracing
+
 
 class AppLaunch(sgtk.Hook):
     """
@@ -28,12 +36,21 @@ class AppLaunch(sgtk.Hook):
         :returns: (dict) The two valid keys are 'command' (str) and 'return_code' (int).
         """
         
+        with tracing.span("AppLaunch.execute", engine=engine_name) as trace:
+            return self._launch(app_path, app_args, trace, **kwargs)
 
+    def _launch(self, app_path, app_args, trace, **kwargs):
+        """
+        Builds and runs the vfxjob-init launch command, see :meth:`execute`.
+        """
         # get the tank_name for the project
         ctx = self.sgtk.context_from_path(self.sgtk.project_path)
-        project = self.sgtk.shotgun.find_one(
-            "Project", [["id", "is", ctx.project["id"]]], ["tank_name"]
-        )
+        project_id = ctx.project["id"]
+        project = mirror.get_entity(project_id, "Project", project_id, ["tank_name"])
+        if project is None:
+            project = trace.shotgun(self.sgtk.shotgun).find_one(
+                "Project", [["id", "is", project_id]], ["tank_name"]
+            )
         tank_name = project["tank_name"]
         prompt_flag = ""
 
@@ -11,15 +11,48 @@
 """
 Hook that loads defines all the available actions, broken down by publish type.
 """
+import contextlib
 import os
-import re
-import glob
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import sgtk
 
+_PYTHON_PATH = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "python")
+)
+if _PYTHON_PATH not in sys.path:
+    sys.path.append(_PYTHON_PATH)
+
+from cbfx_config import exr, sequences
+
 HookBaseClass = sgtk.get_hook_baseclass()
 
+# threads discovering the frame ranges of a selection
+SCAN_WORKERS = 8
+
+# frame range fields of the publish, and of its version, in order of preference
+FRAME_RANGE_FIELDS = [
+    ("sg_first_frame", "sg_last_frame"),
+    ("version.Version.sg_first_frame", "version.Version.sg_last_frame"),
+]
+
+
+def _verify_frame_ranges():
+    """
+    :returns: ``True`` if the frame ranges from ShotGrid are checked against
+        the files on disk, turned on with ``CBFX_LOADER_VERIFY_FRAMES=1``.
+    """
+    return os.environ.get("CBFX_LOADER_VERIFY_FRAMES", "0").lower() not in ("0", "false", "no")
+
+
+def _frame_range(sg_data):
+    for first_field, last_field in FRAME_RANGE_FIELDS:
+        first, last = sg_data.get(first_field), sg_data.get(last_field)
+        if first is not None and last is not None:
+            return (first, last)
+    return None
+
 
 class NukeActions(HookBaseClass):
 
@@ -111,8 +144,14 @@ class NukeActions(HookBaseClass):
         """
         Executes the specified action on a list of items.
 
-        The default implementation dispatches each item from ``actions`` to
-        the ``execute_action`` method.
+        The publish paths of all the items are resolved first. The frame
+        ranges of the sequences to read come from the publishes or their
+        versions, fetched in a single query, and the sequences without one are
+        scanned concurrently, which is only filesystem work. The nodes are then
+        created in a single pass on the main thread, with a progress readout.
+
+        Set ``CBFX_LOADER_VERIFY_FRAMES=1`` to scan every sequence and report
+        the ones not matching their ShotGrid frame range.
 
         The ``actions`` is a list of dictionaries holding all the actions to execute.
         Each entry will have the following values:
@@ -122,9 +161,9 @@ class NukeActions(HookBaseClass):
             params: Parameters passed down from the generate_actions hook.
 
         .. note::
-            This is the default entry point for the hook. It reuses the ``execute_action``
-            method for backward compatibility with hooks written for the previous
-            version of the loader.
+            This is the default entry point for the hook. Both this method and
+            ``execute_action`` dispatch to ``_execute``, which derived hooks
+            can override to customize the actions.
 
         .. note::
             The hook will stop applying the actions on the selection if an error
@@ -132,11 +171,81 @@ class NukeActions(HookBaseClass):
 
         :param list actions: Action dictionaries.
         """
-        for single_action in actions:
-            name = single_action["name"]
-            sg_publish_data = single_action["sg_publish_data"]
-            params = single_action["params"]
-            self.execute_action(name, params, sg_publish_data)
+        app = self.parent
+
+        # resolve paths - forward slashes on all platforms in Nuke
+        paths = [
+            self.get_publish_path(single_action["sg_publish_data"]).replace(os.path.sep, "/")
+            for single_action in actions
+        ]
+
+        # the read nodes of image sequences need their frame range, from
+        # ShotGrid when it has it, otherwise from disk
+        read_nodes = [
+            (path, single_action["sg_publish_data"])
+            for single_action, path in zip(actions, paths)
+            if single_action["name"] == "read_node"
+            and os.path.splitext(path)[1].lower() != ".abc"
+        ]
+        published = self._published_frame_ranges(
+            [sg_data for path, sg_data in read_nodes if sequences.is_sequence_path(path)]
+        )
+        verify = _verify_frame_ranges()
+
+        published_ranges = {}
+        to_scan = set()
+        for path, sg_data in read_nodes:
+            published_range = published.get((sg_data.get("type"), sg_data.get("id")))
+            if published_range and sequences.is_sequence_path(path):
+                published_ranges[path] = published_range
+                if not verify:
+                    continue
+            to_scan.add(path)
+
+        self._sequence_ranges = {}
+        if to_scan:
+            to_scan = sorted(to_scan)
+            with ThreadPoolExecutor(max_workers=min(SCAN_WORKERS, len(to_scan))) as pool:
+                scanned = dict(zip(to_scan, pool.map(self._find_sequence_range, to_scan)))
+            for path, seq_range in scanned.items():
+                published_range = published_ranges.pop(path, None)
+                if published_range and seq_range and tuple(seq_range) != tuple(published_range):
+                    app.log_warning(
+                        "Frame range %d-%d of %s on disk doesn't match its published range %d-%d."
+                        % (seq_range[0], seq_range[1], path, published_range[0], published_range[1])
+                    )
+                self._sequence_ranges[path] = seq_range or published_range
+        self._sequence_ranges.update(published_ranges)
+
+        # the EXR headers, which give the read nodes their format
+        exr_paths = sorted(set(
+            path for path, sg_data in read_nodes if os.path.splitext(path)[1].lower() == ".exr"
+        ))
+        if exr_paths:
+            first_frames = [(self._sequence_ranges.get(path) or (None,))[0] for path in exr_paths]
+            with ThreadPoolExecutor(max_workers=min(SCAN_WORKERS, len(exr_paths))) as pool:
+                list(pool.map(exr.probe, exr_paths, first_frames))
+
+        try:
+            # the clips share one project lookup and undo step, see _clip_importer
+            with self._clip_importer() as import_clip:
+                with self._progress("Loading %d publishes" % len(actions)) as progress:
+                    for index, (single_action, path) in enumerate(zip(actions, paths)):
+                        name = single_action["name"]
+                        sg_publish_data = single_action["sg_publish_data"]
+                        params = single_action["params"]
+                        if not progress(index, len(actions), sg_publish_data.get("code") or path):
+                            app.log_info("Loading cancelled after %d of %d publishes." % (index, len(actions)))
+                            break
+
+                        app.log_debug("Execute action called for action %s. "
+                                      "Parameters: %s. Publish Data: %s" % (name, params, sg_publish_data))
+                        if name == "clip_import":
+                            import_clip(path, sg_publish_data)
+                        else:
+                            self._execute(name, path, sg_publish_data)
+        finally:
+            self._sequence_ranges = {}
 
     def execute_action(self, name, params, sg_publish_data):
         """
@@ -155,7 +264,52 @@ class NukeActions(HookBaseClass):
 
         # resolve path - forward slashes on all platforms in Nuke
         path = self.get_publish_path(sg_publish_data).replace(os.path.sep, "/")
+        self._execute(name, path, sg_publish_data)
+
+    ##############################################################################################################
+    # helper methods which can be subclassed in custom hooks to fine tune the behavior of things
+
+    def _published_frame_ranges(self, publishes):
+        """
+        Gets the frame ranges ShotGrid has for publishes, from the publish
+        data or from their versions, with one query per publish entity type.
 
+        :param list publishes: Shotgun data dictionaries of the publishes.
+        :returns: ``(first, last)`` tuples keyed by ``(type, id)`` of the
+            publishes which have a frame range.
+        """
+        ranges = {}
+        to_fetch = {}
+        for sg_data in publishes:
+            key = (sg_data.get("type"), sg_data.get("id"))
+            frame_range = _frame_range(sg_data)
+            if frame_range:
+                ranges[key] = frame_range
+            elif key[1]:
+                to_fetch.setdefault(key[0], []).append(key[1])
+
+        # only the version fields are standard on every site
+        fields = list(FRAME_RANGE_FIELDS[-1])
+        for entity_type, ids in to_fetch.items():
+            try:
+                records = self.parent.shotgun.find(entity_type, [["id", "in", ids]], fields)
+            except Exception as e:
+                self.parent.log_debug("Couldn't get the frame ranges of %s: %s" % (entity_type, e))
+                continue
+            for record in records:
+                frame_range = _frame_range(record)
+                if frame_range:
+                    ranges[(entity_type, record["id"])] = frame_range
+        return ranges
+
+    def _execute(self, name, path, sg_publish_data):
+        """
+        Executes an action on a resolved publish path.
+
+        :param name: Action name string representing one of the items returned by generate_actions.
+        :param path: Path of the publish, with forward slashes.
+        :param sg_publish_data: Shotgun data dictionary with all the standard publish fields.
+        """
         if name == "read_node":
             self._create_read_node(path, sg_publish_data)
 
@@ -174,8 +328,41 @@ class NukeActions(HookBaseClass):
         if name == "clip_import":
             self._import_clip(path, sg_publish_data)
 
-    ##############################################################################################################
-    # helper methods which can be subclassed in custom hooks to fine tune the behavior of things
+    @contextlib.contextmanager
+    def _progress(self, title):
+        """
+        Shows the progress of a batch in Nuke.
+
+        Yields a function taking the index of the current item, the number of
+        items and a message, and returning ``False`` when the user cancelled.
+
+        :param str title: Title of the progress readout.
+        """
+        # the task is only referenced from here, so the readout closes once
+        # it is released
+        tasks = []
+        try:
+            import nuke
+            tasks.append(nuke.ProgressTask(title))
+        except (ImportError, AttributeError, RuntimeError):
+            # no progress readout outside of the Nuke GUI, ie. in Hiero
+            pass
+
+        def progress(index, total, message):
+            if not tasks:
+                return True
+            if tasks[0].isCancelled():
+                return False
+            tasks[0].setMessage(message)
+            tasks[0].setProgress(int(100.0 * index / max(total, 1)))
+            return True
+
+        try:
+            yield progress
+        finally:
+            if tasks:
+                tasks[0].setProgress(100)
+                del tasks[:]
 
     def _import_clip(self, path, sg_publish_data):
         """
@@ -185,24 +372,73 @@ class NukeActions(HookBaseClass):
         :param dict sg_publish_data: Shotgun data dictionary with all of the standard publish
             fields.
         """
-        if not self.parent.engine.studio_enabled and not self.parent.engine.hiero_enabled:
-            raise Exception("Importing shot clips is only supported in Hiero and Nuke Studio.")
-
-        import hiero
-        from hiero.core import (
-            BinItem,
-            MediaSource,
-            Clip,
-        )
+        with self._clip_importer() as import_clip:
+            import_clip(path, sg_publish_data)
 
-        if not hiero.core.projects():
-            raise Exception("An active project must exist to import clips into.")
+    @contextlib.contextmanager
+    def _clip_importer(self):
+        """
+        Imports publishes into Nuke Studio or Hiero as clips, in one undoable
+        step.
+
+        Yields a function taking the path and the Shotgun data of a publish,
+        which adds a clip of it to a bin named after the shot or sequence the
+        publish is linked to, created if needed. The project and its bins are
+        only looked up for the first clip, and the clips of a same path share
+        their MediaSource.
+        """
+        state = {}
+
+        def import_clip(path, sg_publish_data):
+            if not state:
+                if not self.parent.engine.studio_enabled and not self.parent.engine.hiero_enabled:
+                    raise Exception("Importing shot clips is only supported in Hiero and Nuke Studio.")
+
+                import hiero
+                from hiero.core import (
+                    Bin,
+                    BinItem,
+                    MediaSource,
+                    Clip,
+                )
+
+                projects = hiero.core.projects()
+                if not projects:
+                    raise Exception("An active project must exist to import clips into.")
+
+                project = projects[-1]
+                clips_bin = project.clipsBin()
+                state.update(
+                    Bin=Bin,
+                    BinItem=BinItem,
+                    MediaSource=MediaSource,
+                    Clip=Clip,
+                    project=project,
+                    clips_bin=clips_bin,
+                    bins=dict((item.name(), item) for item in clips_bin.bins()),
+                    media_sources={},
+                )
+                project.beginUndo("Import clips")
+
+            entity = sg_publish_data.get("entity") or {}
+            parent_bin = state["clips_bin"]
+            if entity.get("type") in ("Shot", "Sequence") and entity.get("name"):
+                parent_bin = state["bins"].get(entity["name"])
+                if parent_bin is None:
+                    parent_bin = state["Bin"](entity["name"])
+                    state["clips_bin"].addItem(parent_bin)
+                    state["bins"][entity["name"]] = parent_bin
+
+            media_source = state["media_sources"].get(path)
+            if media_source is None:
+                media_source = state["media_sources"][path] = state["MediaSource"](path)
+            parent_bin.addItem(state["BinItem"](state["Clip"](media_source)))
 
-        project = hiero.core.projects()[-1]
-        bins = project.clipsBin().bins()
-        media_source = MediaSource(path)
-        clip = Clip(media_source)
-        project.clipsBin().addItem(BinItem(clip))
+        try:
+            yield import_clip
+        finally:
+            if state:
+                state["project"].endUndo()
 
     def _import_script(self, path, sg_publish_data):
         """
@@ -274,6 +510,18 @@ class NukeActions(HookBaseClass):
         if ext.lower() not in valid_extensions:
             raise Exception("Unsupported file extension for '%s'!" % path)
 
+        # find the sequence range if it has one:
+        seq_range = self._find_sequence_range(path)
+
+        # The header of an EXR is read directly, which is much cheaper than
+        # letting Nuke probe deep or multi-AOV renders.
+        header = None
+        if ext.lower() == ".exr":
+            header = exr.probe(path, seq_range[0] if seq_range else None)
+        if header:
+            self._create_exr_read_node(path, header, seq_range)
+            return
+
         # `nuke.createNode()` will extract the format and frame range from the
         # file itself (if possible), whereas `nuke.nodes.Read()` won't. We'll
         # also check to see if there's a matching template and override the
@@ -282,14 +530,79 @@ class NukeActions(HookBaseClass):
         read_node = nuke.createNode("Read")
         read_node["file"].fromUserText(path)
 
-        # find the sequence range if it has one:
-        seq_range = self._find_sequence_range(path)
-
         if seq_range:
             # override the detected frame range.
             read_node["first"].setValue(seq_range[0])
             read_node["last"].setValue(seq_range[1])
 
+    def _create_exr_read_node(self, path, header, seq_range):
+        """
+        Create a read node for an EXR file or sequence from its header,
+        without Nuke probing the file. Deep files get a DeepRead node.
+
+        :param path: Path to file.
+        :param dict header: Header of the file, see ``cbfx_config.exr``.
+        :param seq_range: (min, max) frame range of the sequence, or None.
+        """
+        import nuke
+
+        read_node = nuke.createNode("DeepRead" if header["deep"] else "Read")
+        read_node["file"].setValue(path)
+
+        knobs = read_node.knobs()
+        if "format" in knobs:
+            read_node["format"].setValue(self._nuke_format(header))
+        if seq_range:
+            for name, frame in (("first", seq_range[0]), ("origfirst", seq_range[0]),
+                                ("last", seq_range[1]), ("origlast", seq_range[1])):
+                if name in knobs:
+                    read_node[name].setValue(frame)
+
+        self._add_layers(header["channels"])
+
+    def _nuke_format(self, header):
+        """
+        Finds, or adds, the Nuke format of an EXR header.
+
+        :param dict header: Header of the file, see ``cbfx_config.exr``.
+        :returns: A nuke.Format.
+        """
+        import nuke
+
+        width, height, pixel_aspect = header["width"], header["height"], header["pixel_aspect"]
+        for fmt in nuke.formats():
+            if (fmt.width(), fmt.height()) == (width, height) and abs(fmt.pixelAspect() - pixel_aspect) < 1e-3:
+                return fmt
+        # named after everything it is matched on, formats of a same size
+        # but another pixel aspect don't share a name
+        name = "cbfx_%dx%d_%s" % (width, height, ("%g" % pixel_aspect).replace(".", "p"))
+        return nuke.addFormat("%d %d %g %s" % (width, height, pixel_aspect, name))
+
+    def _add_layers(self, channels):
+        """
+        Adds the layers of EXR channels to the script, so they can be picked
+        downstream before the file is read.
+
+        :param list channels: EXR channel names, ie. ``R`` or ``diffuse.R``.
+        """
+        import nuke
+
+        suffixes = {"r": "red", "g": "green", "b": "blue", "a": "alpha"}
+        existing = set(nuke.layers())
+        layers = {}
+        for channel in channels:
+            layer, _, name = channel.rpartition(".")
+            layer = layer.replace(".", "_") or "rgba"
+            if layer in existing:
+                continue
+            name = suffixes.get(name.lower(), name)
+            layers.setdefault(layer, []).append("%s.%s" % (layer, name))
+        for layer, layer_channels in layers.items():
+            try:
+                nuke.Layer(layer, layer_channels)
+            except (AttributeError, RuntimeError, ValueError) as e:
+                self.parent.log_debug("Couldn't add the layer %s: %s" % (layer, e))
+
     def _create_readgeo_node(self, path, sg_publish_data):
         """
         Create a read node representing the publish.
@@ -342,42 +655,23 @@ class NukeActions(HookBaseClass):
         :returns: None if no range could be determined, otherwise (min, max)
         :rtype: tuple or None
         """
-        # This pattern will match the following at the end of a string and
-        # retain the frame number or frame token as group(1) in the resulting
-        # match object:
-        #
-        # 0001
-        # ####
-        # %04d
-        #
-        # The number of digits or hashes does not matter; we match as many as
-        # exist.
-        frame_pattern = re.compile(r"([0-9#]+|[%]0\dd)$")
-        root, ext = os.path.splitext(path)
-        match = re.search(frame_pattern, root)
-
-        # If we did not match, we don't know how to parse the file name, or there
-        # is no frame number to extract.
-        if not match:
+        # The directory is listed once and the result cached until it
+        # changes, see cbfx_config.sequences.
+        sequence_range = sequences.scan(path)
+        if not sequence_range:
             return None
 
-        # We need to get all files that match the pattern from disk so that we
-        # can determine what the min and max frame number is.
-        glob_path = "%s%s" % (
-            re.sub(frame_pattern, "*", root),
-            ext,
-        )
-        files = glob.glob(glob_path)
-
-        # Our pattern from above matches against the file root, so we need
-        # to chop off the extension at the end.
-        file_roots = [os.path.splitext(f)[0] for f in files]
-
-        # We know that the search will result in a match at this point, otherwise
-        # the glob wouldn't have found the file. We can search and pull group 1
-        # to get the integer frame number from the file root name.
-        frames = [int(re.search(frame_pattern, f).group(1)) for f in file_roots]
-        return (min(frames), max(frames))
+        if sequence_range.missing:
+            self.parent.log_debug(
+                "Missing frames in %s: %s" % (
+                    path,
+                    ", ".join(
+                        "%d-%d" % (first, last) if first != last else str(first)
+                        for first, last in sequence_range.missing
+                    ),
+                )
+            )
+        return (sequence_range.first, sequence_range.last)
 
     def _find_sequence_range(self, path):
         """
@@ -390,6 +684,11 @@ class NukeActions(HookBaseClass):
         :param path: Path to file on disk.
         :returns: None if no range could be determined, otherwise (min, max)
         """
+        # discovered up front for a whole selection
+        sequence_ranges = getattr(self, "_sequence_ranges", None) or {}
+        if path in sequence_ranges:
+            return sequence_ranges[path]
+
         # find a template that matches the path:
         template = None
         try:
@@ -410,13 +709,19 @@ class NukeActions(HookBaseClass):
 
         files = self.parent.sgtk.paths_from_template(template, fields, ["SEQ", "eye"])
 
-        # find frame numbers from these files:
+        # find frame numbers from these files, only the paths not looking
+        # like the others are parsed with the template:
+        extractor = sequences.FrameExtractor(template, fields)
         frames = []
         for file in files:
-            fields = template.get_fields(file)
-            frame = fields.get("SEQ")
+            frame = extractor.frame(file)
             if frame is not None:
                 frames.append(frame)
+        if extractor.fallbacks:
+            self.parent.log_debug(
+                "Parsed %d of %d paths of %s with the template."
+                % (extractor.fallbacks, len(files), template.name)
+            )
         if not frames:
             return None
 
@@ -0,0 +1,7 @@
+"""
+Shared helpers used by the hooks of the CBFX configuration.
+
+Hooks are loaded by Toolkit as standalone modules, so anything that has to
+live for the whole process (caches, background workers) is kept here, where
+it is imported once and shared by every hook invocation.
+"""
@@ -0,0 +1,225 @@
+"""
+Network-free bootstrap of child processes from ``SHOTGUN_BOOTSTRAP_CACHE``.
+
+The context change hook commits everything a child process needs to pick up
+where its parent left off into the ``SHOTGUN_BOOTSTRAP_CACHE`` environment
+variable: the config URI, the tk-core python path, the engine name, the
+serialized context and the resolved ``SHOTGUN_*`` environment. Farm jobs and
+spawned DCCs can use this module to rebuild the context and the environment
+straight from that payload, without ``context_from_path`` or ``find_one``
+lookups.
+
+The payload is compact JSON, zlib compressed and urlsafe base64 encoded,
+behind a version prefix (``cbfx1:``). Unlike the pickle it replaces, it is
+safe to decode.
+
+Usage from a shell, ie. a farm job wrapper::
+
+    eval "$(python -m cbfx_config.bootstrap --export)"
+
+Or from python::
+
+    from cbfx_config import bootstrap
+    payload = bootstrap.load()
+    bootstrap.apply_environment(payload)
+    engine = bootstrap.start_engine(payload)
+"""
+
+import argparse
+import base64
+import json
+import os
+import sys
+import zlib
+
+ENV_VAR = "SHOTGUN_BOOTSTRAP_CACHE"
+USER_ENV_VAR = "SHOTGUN_USER_CACHE"
+
+FORMAT_VERSION = 1
+FORMAT_PREFIX = "cbfx{}:".format(FORMAT_VERSION)
+
+
+def encode_payload(payload):
+    """
+    Encodes a payload into the versioned bootstrap cache format.
+
+    :param dict payload: JSON serializable payload.
+    :returns: The encoded payload.
+    :rtype: str
+    """
+    data = json.dumps(payload, separators=(",", ":"), sort_keys=True, default=str)
+    encoded = base64.urlsafe_b64encode(zlib.compress(data.encode("utf-8")))
+    return FORMAT_PREFIX + encoded.decode("ascii")
+
+
+def decode_payload(value):
+    """
+    Decodes a payload written by :func:`encode_payload`.
+
+    :param str value: The encoded payload.
+    :returns: The payload dictionary.
+    :raises ValueError: If the payload was written in an unsupported format,
+        including the legacy pickled payloads which are never loaded.
+    """
+    if not value.startswith(FORMAT_PREFIX):
+        raise ValueError(
+            "Unsupported {} format, expected a '{}' payload.".format(ENV_VAR, FORMAT_PREFIX)
+        )
+    data = zlib.decompress(base64.urlsafe_b64decode(value[len(FORMAT_PREFIX):]))
+    return json.loads(data.decode("utf-8"))
+
+
+def load(environ=None):
+    """
+    Loads the bootstrap payload from the environment.
+
+    :param dict environ: Environment to read from, defaults to ``os.environ``.
+    :returns: The payload dictionary, or ``None`` if there is none.
+    """
+    environ = os.environ if environ is None else environ
+    value = environ.get(ENV_VAR)
+    if not value:
+        return None
+    return decode_payload(value)
+
+
+def get_environment(payload):
+    """
+    Returns the environment variables resolved by the context change hook,
+    where ``None`` means the variable should be unset.
+
+    :param dict payload: The bootstrap payload.
+    :rtype: dict
+    """
+    return dict(payload.get("environ") or {})
+
+
+def apply_environment(payload, environ=None):
+    """
+    Applies the resolved environment variables of the payload.
+
+    :param dict payload: The bootstrap payload.
+    :param dict environ: Environment to update, defaults to ``os.environ``.
+    """
+    environ = os.environ if environ is None else environ
+    for key, value in get_environment(payload).items():
+        if value is None:
+            environ.pop(key, None)
+        else:
+            environ[key] = str(value)
+
+
+def import_sgtk(payload):
+    """
+    Imports the tk-core the parent process was running.
+
+    :param dict payload: The bootstrap payload.
+    :returns: The ``sgtk`` module.
+    """
+    module_path = payload["vars"].get("SHOTGUN_SGTK_MODULE_PATH")
+    if module_path and module_path not in sys.path:
+        sys.path.insert(0, module_path)
+
+    import sgtk
+
+    return sgtk
+
+
+def restore_user(payload=None, environ=None):
+    """
+    Restores the authenticated user serialized in ``SHOTGUN_USER_CACHE``.
+
+    :param dict payload: The bootstrap payload, used to locate tk-core.
+    :param dict environ: Environment to read from, defaults to ``os.environ``.
+    :returns: The :class:`sgtk.authentication.ShotgunUser`, or ``None``.
+    """
+    environ = os.environ if environ is None else environ
+    sgtk = import_sgtk(payload or load(environ))
+
+    serialized_user = environ.get(USER_ENV_VAR)
+    if not serialized_user:
+        return None
+    user = sgtk.authentication.deserialize_user(serialized_user)
+    sgtk.set_authenticated_user(user)
+    return user
+
+
+def context_from_payload(tk, payload):
+    """
+    Rebuilds the context of the parent process without querying ShotGrid.
+
+    :param tk: :class:`sgtk.Sgtk` instance the context belongs to.
+    :param dict payload: The bootstrap payload.
+    :returns: The :class:`sgtk.Context`.
+    """
+    sgtk = import_sgtk(payload)
+    return sgtk.Context.from_dict(tk, payload["context"])
+
+
+def start_engine(payload=None, engine_name=None):
+    """
+    Bootstraps Toolkit and starts an engine in the parent process' context.
+
+    The configuration is resolved from the cached config URI rather than a
+    ShotGrid pipeline configuration lookup, and the context is rebuilt from
+    the payload rather than from a path or an entity.
+
+    :param dict payload: The bootstrap payload, loaded from the environment
+        if not given.
+    :param str engine_name: Engine to start, defaults to the parent's engine.
+    :returns: The started engine.
+    """
+    payload = payload or load()
+    if payload is None:
+        raise RuntimeError("{} is not set.".format(ENV_VAR))
+
+    sgtk = import_sgtk(payload)
+    user = restore_user(payload)
+    cached_vars = payload["vars"]
+    engine_name = engine_name or cached_vars["SHOTGUN_ENGINE_NAME"]
+
+    manager = sgtk.bootstrap.ToolkitManager(user)
+    manager.base_configuration = cached_vars["SHOTGUN_CONFIG_URI"]
+    manager.do_shotgun_config_lookup = False
+
+    project = payload["context"].get("project")
+    config_path, _ = manager.prepare_engine(engine_name, project)
+
+    tk = sgtk.sgtk_from_path(config_path)
+    context = context_from_payload(tk, payload)
+    return sgtk.platform.start_engine(engine_name, tk, context)
+
+
+def _quote(value):
+    return "'{}'".format(str(value).replace("'", "'\\''"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Inspect or apply the {} payload.".format(ENV_VAR)
+    )
+    parser.add_argument(
+        "--export",
+        action="store_true",
+        help="Print shell statements applying the resolved environment.",
+    )
+    args = parser.parse_args(argv)
+
+    payload = load()
+    if payload is None:
+        parser.error("{} is not set.".format(ENV_VAR))
+
+    if not args.export:
+        print(json.dumps(payload, indent=2, sort_keys=True))
+        return 0
+
+    for key, value in sorted(get_environment(payload).items()):
+        if value is None:
+            print("unset {}".format(key))
+        else:
+            print("export {}={}".format(key, _quote(value)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
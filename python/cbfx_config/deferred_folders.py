@@ -0,0 +1,344 @@
+"""
+Background creation of the ``defer_creation`` folders.
+
+Schema folders such as ``tasks/step/workfiles/nuke`` are only created when
+their engine starts (``defer_creation: "tk-nuke"``), synchronously, as part of
+the launch. The process folder creation hook hands those items to
+:class:`DeferredFolders` instead: they are written to a journal on disk and
+created by a background thread, so the launch doesn't wait on NFS.
+
+Any process can finish the work: the ``ensure_folder_exists`` core hook,
+which apps call before saving or publishing into a folder, flushes the journal
+entries covering that folder first, so the folders always exist when they are
+needed, even if the launcher exited before its worker was done. A journal
+entry is claimed by renaming it with the host and pid of the claiming
+process, so an entry is only ever applied by one thread, and applying it
+again would be harmless anyway. An entry failing to apply is logged and
+renamed to ``.failed``, so it doesn't hold up the next flushes.
+
+The cache directory can be a home directory shared by several hosts. Whether
+the process of a claim is alive is only checked on the host which claimed it,
+the claims of other hosts are taken over once older than
+:data:`STALE_CLAIM_AGE`. A flush waits at most :data:`FLUSH_TIMEOUT` on the
+claims of live processes, then creates their folders itself.
+
+Set ``CBFX_ASYNC_DEFERRED_FOLDERS=0`` to create the deferred folders
+synchronously, like the default Toolkit hook.
+
+The same journal backs the replay of the ``remote_entity_folder`` actions on
+multi-site storage, see :meth:`DeferredFolders.replay`.
+"""
+
+import json
+import logging
+import os
+import queue
+import re
+import socket
+import threading
+import time
+import uuid
+
+from . import folder_creation, project_settings, tracing
+
+logger = logging.getLogger(__name__)
+
+# seconds to wait for folders claimed by another thread or process
+FLUSH_TIMEOUT = 5
+
+# seconds after which the claim of another host is considered abandoned
+STALE_CLAIM_AGE = 600
+
+_CLAIMED = ".claimed"
+
+_FAILED = ".failed"
+
+_deferred = None
+_deferred_lock = threading.Lock()
+
+
+def is_enabled():
+    """
+    :returns: ``True`` unless turned off with ``CBFX_ASYNC_DEFERRED_FOLDERS=0``.
+    """
+    return os.environ.get("CBFX_ASYNC_DEFERRED_FOLDERS", "1").lower() not in ("0", "false", "no")
+
+
+def journal_dir():
+    """
+    :returns: Directory of the journal, ``deferred_folders`` in the cache
+        directory.
+    """
+    return os.path.join(project_settings.cache_root(), "deferred_folders")
+
+
+def _under(path, parent):
+    return path == parent or path.startswith(parent.rstrip(os.sep) + os.sep)
+
+
+def split_items(items):
+    """
+    Separates the deferred items, the folders with ``defer_creation`` and
+    everything under them, from the others.
+
+    :param list items: Folder creation items.
+    :returns: A tuple of the items to create now and the deferred items.
+    """
+    deferred_roots = [
+        os.path.normpath(item["path"])
+        for item in items
+        if (item.get("metadata") or {}).get("defer_creation") and item.get("path")
+    ]
+    if not deferred_roots:
+        return items, []
+
+    now, deferred = [], []
+    for item in items:
+        path = folder_creation.item_path(item)
+        if path and any(_under(os.path.normpath(path), root) for root in deferred_roots):
+            deferred.append(item)
+        else:
+            now.append(item)
+    return now, deferred
+
+
+def _host():
+    # no dots, the claim names are split on them
+    return re.sub(r"[^\w-]", "_", socket.gethostname())
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (OSError, AttributeError, ValueError):
+        # no way to tell, ie. permissions or Windows
+        return True
+    return True
+
+
+class DeferredFolders(object):
+    """
+    Journal of the deferred folders and the background worker creating them.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # claims being applied by the threads of this process
+        self._applying = set()
+
+    def submit(self, items, roots=None):
+        """
+        Journals deferred items and queues them for the background worker.
+
+        :param list items: Deferred folder creation items.
+        :param dict roots: Root paths keyed by name, as returned by
+            ``tk.roots``.
+        :returns: Path of the journal entry.
+        """
+        path = self._journal(items, roots)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._work, name="cbfx-deferred-folders")
+                self._thread.daemon = True
+                self._thread.start()
+        self._queue.put(path)
+        return path
+
+    def replay(self, items, roots=None):
+        """
+        Replays remote folder creation actions, in bulk, in this thread.
+
+        The actions are journaled first, so a replay interrupted half way is
+        finished by the next flush. Folders which already exist are skipped.
+
+        :param list items: ``remote_entity_folder`` items.
+        :param dict roots: Root paths keyed by name, as returned by
+            ``tk.roots``.
+        :returns: A tuple of the number of folders created and skipped.
+        """
+        folders = [
+            {"action": "folder", "metadata": item.get("metadata") or {}, "path": item["path"]}
+            for item in items
+        ]
+        created = self._apply(self._journal(folders, roots))
+        return created, len(folders) - created
+
+    def _work(self):
+        while True:
+            path = self._queue.get()
+            self._apply_logged(path)
+
+    def _journal(self, items, roots):
+        directory = journal_dir()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        name = "{:.6f}-{}-{}.json".format(time.time(), os.getpid(), uuid.uuid4().hex[:8])
+        path = os.path.join(directory, name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump({"roots": roots or {}, "items": items}, fh, default=str)
+        os.replace(tmp_path, path)
+        return path
+
+    def _claim(self, path):
+        claimed = "{}.{}.{}{}".format(path, _host(), os.getpid(), _CLAIMED)
+        # registered first, a flush must never see the claim unregistered
+        with self._lock:
+            self._applying.add(claimed)
+        try:
+            os.rename(path, claimed)
+        except OSError:
+            # applied or claimed by someone else already
+            with self._lock:
+                self._applying.discard(claimed)
+            return None
+        try:
+            # the age of the claim, for the other hosts
+            os.utime(claimed, None)
+        except OSError:
+            pass
+        return claimed
+
+    def _apply(self, path):
+        """
+        Applies a journal entry.
+
+        :param str path: Path of the entry.
+        :returns: The number of folders created.
+        :raises: Whatever the folder creation raised, once the entry is set
+            aside as ``.failed``.
+        """
+        claimed = self._claim(path)
+        if not claimed:
+            return 0
+        try:
+            with open(claimed) as fh:
+                journal = json.load(fh)
+            with tracing.span("DeferredFolders.apply") as trace:
+                creator = folder_creation.FolderCreator(
+                    False, trace, roots=journal.get("roots"), chmod_folders=True
+                )
+                created = creator.run(journal["items"])
+            os.remove(claimed)
+        except Exception:
+            logger.exception("Failed to apply %s, setting it aside", path)
+            try:
+                os.rename(claimed, path + _FAILED)
+            except OSError:
+                pass
+            raise
+        finally:
+            with self._lock:
+                self._applying.discard(claimed)
+        logger.debug("Created %d deferred folders from %s", len(created), path)
+        return len(created)
+
+    def _pending(self):
+        try:
+            names = sorted(os.listdir(journal_dir()))
+        except OSError:
+            return []
+        return [os.path.join(journal_dir(), n) for n in names if n.endswith((".json", _CLAIMED))]
+
+    def _abandoned(self, claimed):
+        # whether the process of a claim is gone, only the host which claimed
+        # it can check the process itself
+        original, host, pid = claimed[: -len(_CLAIMED)].rsplit(".", 2)
+        if host != _host():
+            try:
+                return time.time() - os.stat(claimed).st_mtime > STALE_CLAIM_AGE
+            except OSError:
+                return False
+        if int(pid) == os.getpid():
+            # a claim of this process no thread is applying anymore
+            with self._lock:
+                return claimed not in self._applying
+        return not _pid_alive(int(pid))
+
+    def _create_claimed(self, claimed):
+        # creates the folders of an entry claimed by a live process without
+        # taking it over, creating them twice is harmless
+        try:
+            with open(claimed) as fh:
+                journal = json.load(fh)
+        except (OSError, IOError, ValueError):
+            # applied meanwhile
+            return 0
+        try:
+            with tracing.span("DeferredFolders.apply") as trace:
+                creator = folder_creation.FolderCreator(
+                    False, trace, roots=journal.get("roots"), chmod_folders=True
+                )
+                return len(creator.run(journal["items"]))
+        except Exception:
+            logger.exception("Failed to create the folders of %s", claimed)
+            return 0
+
+    @staticmethod
+    def _covers(journal_path, path):
+        try:
+            with open(journal_path) as fh:
+                items = json.load(fh)["items"]
+        except (OSError, IOError, ValueError, KeyError):
+            # claimed and removed meanwhile
+            return False
+        for item in items:
+            item_path = folder_creation.item_path(item)
+            if item_path and _under(path, os.path.normpath(item_path)):
+                return True
+        return False
+
+    def flush(self, path=None):
+        """
+        Creates the journaled folders a path needs, now, in this thread.
+
+        :param str path: Path about to be used, all the journaled folders are
+            created if not set.
+        :returns: The number of folders created.
+        """
+        path = os.path.normpath(path) if path else None
+        created = 0
+        deadline = time.time() + FLUSH_TIMEOUT
+        for journal_path in self._pending():
+            if path and not self._covers(journal_path, path):
+                continue
+            if not journal_path.endswith(_CLAIMED):
+                created += self._apply_logged(journal_path)
+                continue
+            # wait for whoever claimed it, unless it is abandoned
+            while os.path.exists(journal_path):
+                if self._abandoned(journal_path):
+                    original = journal_path[: -len(_CLAIMED)].rsplit(".", 2)[0]
+                    try:
+                        os.rename(journal_path, original)
+                    except OSError:
+                        break
+                    created += self._apply_logged(original)
+                    break
+                if time.time() >= deadline:
+                    created += self._create_claimed(journal_path)
+                    break
+                time.sleep(0.05)
+        return created
+
+    def _apply_logged(self, path):
+        # a failed entry must not fail the save or publish flushing it
+        try:
+            return self._apply(path)
+        except Exception:
+            return 0
+
+
+def get_deferred_folders():
+    """
+    :returns: The :class:`DeferredFolders` of the process.
+    """
+    global _deferred
+    with _deferred_lock:
+        if _deferred is None:
+            _deferred = DeferredFolders()
+        return _deferred
@@ -0,0 +1,134 @@
+"""
+Process-wide cache for ShotGrid entity lookups.
+
+Entities are keyed by ``(entity type, id, field set)`` so that two callers
+asking for different fields never see each other's partial records. Entries
+expire after a TTL and the cache is bounded in size, evicting the least
+recently used entry first.
+
+The TTL and size can be tuned with the ``CBFX_ENTITY_CACHE_TTL`` (seconds) and
+``CBFX_ENTITY_CACHE_SIZE`` environment variables.
+"""
+
+import collections
+import copy
+import os
+import threading
+import time
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_SIZE = 512
+
+
+class EntityCache(object):
+    """
+    A thread-safe, TTL and size bounded cache of ShotGrid entity records.
+
+    :param float ttl: Number of seconds a record stays valid.
+    :param int max_size: Maximum number of records kept before evicting.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(entity_type, entity_id, fields):
+        """
+        Builds the cache key for a lookup.
+
+        :param str entity_type: ShotGrid entity type.
+        :param int entity_id: ShotGrid entity id.
+        :param list fields: Fields requested for the entity.
+        :returns: Hashable key.
+        """
+        return (entity_type, entity_id, tuple(sorted(set(fields))))
+
+    def get(self, entity_type, entity_id, fields):
+        """
+        Returns a copy of the cached record, or ``None`` if it is missing or
+        has expired.
+        """
+        key = self.make_key(entity_type, entity_id, fields)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, record = entry
+                if expires > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(record)
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def set(self, entity_type, entity_id, fields, record):
+        """
+        Stores a record, evicting the least recently used entries if the
+        cache grew past its maximum size.
+        """
+        key = self.make_key(entity_type, entity_id, fields)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, copy.deepcopy(record))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def find_one(self, sg, entity_type, entity_id, fields):
+        """
+        Returns the entity record from the cache, querying ShotGrid on a miss.
+
+        :param sg: ShotGrid API connection.
+        :param str entity_type: ShotGrid entity type.
+        :param int entity_id: ShotGrid entity id.
+        :param list fields: Fields to return.
+        :returns: The entity dictionary or ``None`` if it does not exist.
+        """
+        record = self.get(entity_type, entity_id, fields)
+        if record is None:
+            record = sg.find_one(entity_type, [["id", "is", entity_id]], fields)
+            if record is not None:
+                self.set(entity_type, entity_id, fields, record)
+        return record
+
+    def invalidate(self, entity_type=None, entity_id=None):
+        """
+        Drops cached records. Without arguments the whole cache is cleared,
+        otherwise only the records matching the given type and/or id.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                if entity_type is not None and key[0] != entity_type:
+                    continue
+                if entity_id is not None and key[1] != entity_id:
+                    continue
+                del self._entries[key]
+
+    def stats(self):
+        """
+        :returns: Dictionary with the ``hits``, ``misses`` and ``size`` counters.
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_entity_cache():
+    """
+    Returns the process-wide :class:`EntityCache`, creating it on first use.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EntityCache(
+                ttl=float(os.environ.get("CBFX_ENTITY_CACHE_TTL", DEFAULT_TTL)),
+                max_size=int(os.environ.get("CBFX_ENTITY_CACHE_SIZE", DEFAULT_MAX_SIZE)),
+            )
+        return _cache
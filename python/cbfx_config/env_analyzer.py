@@ -0,0 +1,421 @@
+"""
+Static analysis of the environment configuration.
+
+Every environment includes whole settings files, ie. ``shot_step.yml`` pulls
+in the Maya, Houdini and Nuke settings with all their app instances, so
+Toolkit parses and validates a lot of configuration it never uses. This tool
+walks the environments :class:`PickEnvironment` can return, follows their
+``includes`` chains and ``@`` references, and reports:
+
+- settings blocks of the include files no reachable environment references,
+- app and engine locations nothing references,
+- templates of ``core/templates.yml`` referenced neither by the environments
+  nor by the hooks,
+- the parse time each environment would save without its dead blocks.
+
+With ``--emit-trimmed`` it also writes a copy of the environments without the
+dead blocks, and checks each trimmed environment still resolves to the same
+data::
+
+    python -m cbfx_config.env_analyzer --emit-trimmed /tmp/trimmed
+"""
+
+import argparse
+import ast
+import collections
+import json
+import os
+import re
+import sys
+import time
+
+from . import env_snapshot
+
+CONFIG_ROOT = os.path.normpath(os.path.join(env_snapshot.ENV_ROOT, os.pardir))
+
+PICK_ENVIRONMENT_HOOK = os.path.join(CONFIG_ROOT, "core", "hooks", "pick_environment.py")
+
+TEMPLATES_PATH = os.path.join(CONFIG_ROOT, "core", "templates.yml")
+
+# folders scanned for template names used by code
+SOURCE_ROOTS = ["core/hooks", "hooks", "python"]
+
+# top level keys holding location descriptors
+_LOCATION_KEY = re.compile(r"^(apps|engines)\..+\.location$")
+
+
+def environment_names(hook_path=PICK_ENVIRONMENT_HOOK):
+    """
+    Lists the environment names the pick environment hook can return, from
+    the string literals it assigns to ``env``.
+
+    :param str hook_path: Path to the pick environment hook.
+    :rtype: list
+    """
+    with open(hook_path) as fh:
+        tree = ast.parse(fh.read(), hook_path)
+    names = []
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Assign)
+            and any(isinstance(t, ast.Name) and t.id == "env" for t in node.targets)
+            and isinstance(node.value, ast.Constant)
+            and isinstance(node.value.value, str)
+            and node.value.value not in names
+        ):
+            names.append(node.value.value)
+    return names
+
+
+def _references(value):
+    if isinstance(value, dict):
+        for item in value.values():
+            for reference in _references(item):
+                yield reference
+    elif isinstance(value, list):
+        for item in value:
+            for reference in _references(item):
+                yield reference
+    elif isinstance(value, str) and value.startswith("@"):
+        yield value[1:]
+
+
+def _strings(value):
+    if isinstance(value, dict):
+        for item in value.values():
+            for string in _strings(item):
+                yield string
+    elif isinstance(value, list):
+        for item in value:
+            for string in _strings(item):
+                yield string
+    elif isinstance(value, str):
+        yield value
+
+
+class _File(object):
+    """
+    A parsed YAML file of the config, with the line span of each of its top
+    level blocks and the time it takes to parse.
+    """
+
+    def __init__(self, path):
+        yaml = env_snapshot._yaml()
+        self.path = path
+        with open(path) as fh:
+            self.text = fh.read()
+        self.lines = self.text.count("\n") + 1
+
+        start = time.time()
+        self.data = yaml.load(self.text, Loader=yaml.SafeLoader) or {}
+        self.parse_time = time.time() - start
+
+        self.blocks = collections.OrderedDict()
+        node = yaml.compose(self.text, Loader=yaml.SafeLoader)
+        for key, value in getattr(node, "value", None) or []:
+            end = value.end_mark.line
+            if value.end_mark.column:
+                end += 1
+            self.blocks[key.value] = (key.start_mark.line, end)
+
+    def block_lines(self, keys):
+        return sum(b - a for k, (a, b) in self.blocks.items() if k in keys)
+
+    def _block_text(self, key):
+        start, end = self.blocks[key]
+        return "".join(self.text.splitlines(True)[start:end])
+
+    def removable(self, dead_keys):
+        """
+        Filters out the dead blocks defining YAML anchors which blocks that
+        are kept still alias.
+
+        :returns: The list of the dead blocks which can be removed.
+        """
+        dead_keys = [k for k in dead_keys if k in self.blocks]
+        anchors = dict(
+            (anchor, key)
+            for key in dead_keys
+            for anchor in re.findall(r"&([\w-]+)", self._block_text(key))
+        )
+        kept = [k for k in self.blocks if k not in dead_keys]
+        while kept:
+            text = self._block_text(kept.pop())
+            for alias in re.findall(r"\*([\w-]+)", text):
+                key = anchors.pop(alias, None)
+                if key in dead_keys:
+                    dead_keys.remove(key)
+                    kept.append(key)
+        return dead_keys
+
+    def trimmed(self, dead_keys):
+        """
+        :returns: The file content without the given top level blocks.
+        """
+        removed = set()
+        for key in self.removable(dead_keys):
+            if key in self.blocks:
+                removed.update(range(*self.blocks[key]))
+        return "".join(
+            line
+            for index, line in enumerate(self.text.splitlines(True))
+            if index not in removed
+        )
+
+
+def _used_keys(env_data, closure):
+    """
+    Follows the references of an environment through the blocks of the files
+    it includes.
+
+    :returns: The set of top level keys the environment uses.
+    """
+    definitions = collections.defaultdict(list)
+    for config_file in closure:
+        for key, value in config_file.data.items():
+            if key not in env_snapshot._INCLUDE_KEYS:
+                definitions[key].append(value)
+
+    used = set()
+    pending = list(_references(env_data))
+    while pending:
+        key = pending.pop()
+        if key in used:
+            continue
+        used.add(key)
+        for value in definitions.get(key, []):
+            pending.extend(_references(value))
+    return used
+
+
+def _source_strings(roots):
+    strings = set()
+    for root in roots:
+        for dirpath, _, filenames in os.walk(os.path.join(CONFIG_ROOT, root)):
+            for filename in filenames:
+                if not filename.endswith(".py"):
+                    continue
+                with open(os.path.join(dirpath, filename), errors="replace") as fh:
+                    strings.update(re.findall(r"[\"']([\w.-]+)[\"']", fh.read()))
+    return strings
+
+
+def _used_templates(templates, strings):
+    definitions = dict(templates.get("paths") or {})
+    definitions.update(templates.get("strings") or {})
+    used = set()
+    pending = [name for name in definitions if name in strings]
+    while pending:
+        name = pending.pop()
+        if name in used:
+            continue
+        used.add(name)
+        definition = definitions[name]
+        if isinstance(definition, dict):
+            definition = definition.get("definition")
+        if isinstance(definition, str):
+            pending.extend(re.findall(r"@(\w+)", definition))
+    return used, sorted(set(definitions) - used)
+
+
+def analyze(env_root=env_snapshot.ENV_ROOT, templates_path=TEMPLATES_PATH):
+    """
+    Analyzes the environments of the config.
+
+    :param str env_root: Folder of the environment files.
+    :param str templates_path: Path to the templates file.
+    :returns: The report as a dictionary. Environments which can't be
+        resolved are reported in ``broken_environments`` with their error,
+        the analysis carries on without them.
+    """
+    files = {}
+
+    def load(path):
+        if path not in files:
+            files[path] = _File(path)
+        return files[path]
+
+    all_includes = set()
+    for dirpath, _, filenames in os.walk(os.path.join(env_root, "includes")):
+        all_includes.update(
+            os.path.normpath(os.path.join(dirpath, f)) for f in filenames if f.endswith(".yml")
+        )
+
+    report = {
+        "environments": {},
+        "missing_environments": [],
+        "unreachable_environments": [],
+        "broken_environments": {},
+    }
+    reachable = set()
+    used_globally = set()
+    env_strings = set()
+    closures = {}
+    for name in environment_names():
+        env_path = os.path.normpath(os.path.join(env_root, name + ".yml"))
+        if not os.path.exists(env_path):
+            report["missing_environments"].append(name)
+            continue
+        # the environment is returned by PickEnvironment, whether it resolves
+        reachable.add(env_path)
+        try:
+            resolved, hashes = env_snapshot.resolve_environment(env_path)
+        except env_snapshot.SnapshotError as e:
+            report["broken_environments"][name] = str(e)
+            continue
+        env_strings.update(_strings(resolved))
+        closure = [load(path) for path in hashes]
+        closures[env_path] = closure
+        reachable.update(hashes)
+        used = _used_keys(load(env_path).data, closure)
+        used_globally.update(used)
+
+        parse_time = sum(f.parse_time for f in closure)
+        saved = 0.0
+        dead_blocks = 0
+        for config_file in closure:
+            if config_file.path == env_path:
+                continue
+            dead = config_file.removable(
+                [k for k in config_file.blocks if k not in used and k not in env_snapshot._INCLUDE_KEYS]
+            )
+            dead_blocks += len(dead)
+            saved += config_file.parse_time * config_file.block_lines(dead) / config_file.lines
+        report["environments"][name] = {
+            "path": os.path.relpath(env_path, CONFIG_ROOT),
+            "files": len(closure),
+            "lines": sum(f.lines for f in closure),
+            "parse_ms": round(parse_time * 1000, 2),
+            "dead_blocks": dead_blocks,
+            "estimated_savings_ms": round(saved * 1000, 2),
+        }
+
+    for filename in sorted(os.listdir(env_root)):
+        path = os.path.normpath(os.path.join(env_root, filename))
+        if filename.endswith(".yml") and path not in reachable:
+            report["unreachable_environments"].append(os.path.relpath(path, CONFIG_ROOT))
+
+    dead_blocks = collections.OrderedDict()
+    unused_locations = []
+    for path in sorted(all_includes):
+        config_file = load(path)
+        dead = [
+            key
+            for key in config_file.blocks
+            if key not in used_globally and key not in env_snapshot._INCLUDE_KEYS
+        ]
+        if path not in reachable:
+            dead = ["<whole file, never included>"]
+        if dead:
+            dead_blocks[os.path.relpath(path, CONFIG_ROOT)] = dead
+        unused_locations.extend(k for k in dead if _LOCATION_KEY.match(k))
+    report["dead_blocks"] = dead_blocks
+    report["unused_locations"] = unused_locations
+
+    with open(templates_path) as fh:
+        yaml = env_snapshot._yaml()
+        templates = yaml.load(fh, Loader=yaml.SafeLoader) or {}
+    _, unused_templates = _used_templates(templates, env_strings | _source_strings(SOURCE_ROOTS))
+    report["unused_templates"] = unused_templates
+
+    report["_trim"] = (closures, used_globally, files)
+    return report
+
+
+def emit_trimmed(report, output_dir, env_root=env_snapshot.ENV_ROOT):
+    """
+    Writes the reachable environments and their include files without the
+    dead blocks, then checks every trimmed environment resolves to the same
+    data as the original.
+
+    :returns: The names of the environments whose resolution changed.
+    """
+    closures, used, files = report["_trim"]
+    for config_file in files.values():
+        if not any(config_file in closure for closure in closures.values()):
+            continue
+        target = os.path.join(output_dir, os.path.relpath(config_file.path, os.path.dirname(env_root)))
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        if config_file.path in closures:
+            content = config_file.text
+        else:
+            content = config_file.trimmed(
+                [k for k in config_file.blocks if k not in used and k not in env_snapshot._INCLUDE_KEYS]
+            )
+        with open(target, "w") as fh:
+            fh.write(content)
+
+    changed = []
+    for env_path in closures:
+        trimmed_path = os.path.join(output_dir, os.path.relpath(env_path, os.path.dirname(env_root)))
+        original = env_snapshot.resolve_environment(env_path)[0]
+        if env_snapshot.resolve_environment(trimmed_path)[0] != original:
+            changed.append(os.path.splitext(os.path.basename(env_path))[0])
+    return changed
+
+
+def print_report(report):
+    row = "{:<18} {:>6} {:>7} {:>10} {:>6} {:>12}"
+    print(row.format("environment", "files", "lines", "parse ms", "dead", "saved ms"))
+    for name, env in report["environments"].items():
+        print(row.format(
+            name, env["files"], env["lines"], env["parse_ms"], env["dead_blocks"], env["estimated_savings_ms"]
+        ))
+
+    for name in report["missing_environments"]:
+        print("\nPickEnvironment returns '{}' but there is no env/{}.yml".format(name, name))
+    for path in report["unreachable_environments"]:
+        print("\n{} is never returned by PickEnvironment".format(path))
+    for name, error in report["broken_environments"].items():
+        print("\nenv/{}.yml can't be resolved: {}".format(name, error))
+    if report["broken_environments"]:
+        print("\nThe blocks only the broken environments use are reported as dead.")
+
+    print("\nDead settings blocks:")
+    for path, keys in report["dead_blocks"].items():
+        print("  {}".format(path))
+        for key in keys:
+            print("    {}".format(key))
+
+    print("\nUnused app and engine locations:")
+    for key in report["unused_locations"]:
+        print("  {}".format(key))
+
+    print("\nUnreferenced templates:")
+    for name in report["unused_templates"]:
+        print("  {}".format(name))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Report the settings, locations and templates the environments never use."
+    )
+    parser.add_argument("--root", default=env_snapshot.ENV_ROOT, help="Folder of the environment files.")
+    parser.add_argument("--templates", default=TEMPLATES_PATH, help="Path to templates.yml.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    parser.add_argument("--emit-trimmed", metavar="DIR", help="Write trimmed environments to DIR.")
+    args = parser.parse_args(argv)
+
+    report = analyze(args.root, args.templates)
+
+    changed = None
+    if args.emit_trimmed:
+        changed = emit_trimmed(report, args.emit_trimmed, args.root)
+
+    del report["_trim"]
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if changed is not None:
+        if changed:
+            print("\nTrimmed environments resolve differently: {}".format(", ".join(changed)))
+            return 1
+        print("\nTrimmed environments written to {}, all resolve identically".format(args.emit_trimmed))
+    return 1 if report["broken_environments"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
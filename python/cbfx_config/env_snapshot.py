@@ -0,0 +1,387 @@
+"""
+Compiled snapshots of the resolved environment files.
+
+Each engine start resolves an environment such as ``env/shot_step.yml``, which
+means parsing the environment, ``frameworks.yml``, the location files and a
+handful of large ``env/includes/settings`` files, then resolving the ``@``
+references between them. This module does that resolution once and stores the
+result as a ``marshal`` file, recording the SHA-256 of every file of the
+include graph. A snapshot is only used while all those hashes still match, so
+editing any file of the graph recompiles it on the next load.
+
+The pick environment hook primes the tk-core YAML cache with the snapshot of
+the environment it returns, so Toolkit finds the environment already parsed
+and resolved instead of reading the YAML files. Toolkit then only checks the
+stat of the environment file itself, so the stats of every file of the graph
+are checked each time the environment is picked, and the cache is primed
+again when any of them changed. The snapshot holds the resolved data without
+its ``includes``: it is only meant for loading environments, and isn't primed
+in ``tank`` commands, which edit environments.
+
+Snapshots are written to ``env_snapshots`` in the cache directory and can be
+built ahead of time and checked against tk-core's resolution with::
+
+    python -m cbfx_config.env_snapshot --verify
+"""
+
+import argparse
+import copy
+import hashlib
+import logging
+import marshal
+import os
+import sys
+import threading
+import time
+
+from . import project_settings
+
+logger = logging.getLogger(__name__)
+
+ENV_ROOT = os.path.normpath(
+    os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, "env")
+)
+
+SNAPSHOT_VERSION = 1
+
+# top level keys tk-core reads the included files from
+_INCLUDE_KEYS = ("include", "includes")
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+class SnapshotError(Exception):
+    """
+    Raised when an environment can't be compiled into a snapshot.
+    """
+
+
+def is_enabled():
+    """
+    :returns: ``True`` unless snapshots were turned off with
+        ``CBFX_ENV_SNAPSHOT=0``.
+    """
+    return os.environ.get("CBFX_ENV_SNAPSHOT", "1").lower() not in ("0", "false", "no")
+
+
+def _yaml():
+    try:
+        from tank_vendor import yaml
+    except ImportError:
+        import yaml
+    return yaml
+
+
+def _read(path, files, parsed):
+    if path not in parsed:
+        with open(path, "rb") as fh:
+            content = fh.read()
+        files[path] = hashlib.sha256(content).hexdigest()
+        yaml = _yaml()
+        parsed[path] = yaml.load(content, Loader=yaml.SafeLoader) or {}
+    return parsed[path]
+
+
+def _include_paths(path, data):
+    includes = []
+    for key in _INCLUDE_KEYS:
+        value = data.get(key)
+        if isinstance(value, list):
+            includes.extend(value)
+        elif value:
+            includes.append(value)
+
+    for include in includes:
+        include = os.path.expandvars(os.path.expanduser(include))
+        if "{" in include:
+            # template based includes depend on the context
+            raise SnapshotError("Context dependent include {} in {}".format(include, path))
+        if not os.path.isabs(include):
+            include = os.path.join(os.path.dirname(path), include)
+        yield os.path.normpath(include)
+
+
+def _lookup(path, data, files, parsed, stack):
+    # the references of a file resolve against what it includes, not against
+    # its own keys, which is how "frameworks: '@frameworks'" works
+    lookup = {}
+    for include in _include_paths(path, data):
+        if include in stack:
+            raise SnapshotError("Circular include of {} in {}".format(include, path))
+        included = _read(include, files, parsed)
+        included_lookup = _lookup(include, included, files, parsed, stack + [include])
+        lookup.update(included_lookup)
+        lookup.update(
+            (k, _resolve_refs(included_lookup, v))
+            for k, v in included.items()
+            if k not in _INCLUDE_KEYS
+        )
+    return lookup
+
+
+def _resolve_refs(lookup, data):
+    if isinstance(data, list):
+        return [_resolve_refs(lookup, item) for item in data]
+    if isinstance(data, dict):
+        return dict((k, _resolve_refs(lookup, v)) for k, v in data.items())
+    if isinstance(data, str) and data.startswith("@"):
+        if data[1:] not in lookup:
+            raise SnapshotError("Undefined reference {}".format(data))
+        return _resolve_refs(lookup, copy.deepcopy(lookup[data[1:]]))
+    return data
+
+
+def resolve_environment(env_path):
+    """
+    Resolves an environment file the way tk-core does, following the
+    ``includes`` chains and replacing the ``@`` references.
+
+    :param str env_path: Path to the environment file.
+    :returns: A tuple of the resolved data, without its includes, and the
+        SHA-256 of every file read keyed by path.
+    :raises SnapshotError: If the environment can't be resolved statically.
+    """
+    env_path = os.path.normpath(env_path)
+    files = {}
+    parsed = {}
+    data = _read(env_path, files, parsed)
+    lookup = _lookup(env_path, data, files, parsed, [env_path])
+    resolved = _resolve_refs(
+        lookup, dict((k, v) for k, v in data.items() if k not in _INCLUDE_KEYS)
+    )
+    return resolved, files
+
+
+def snapshot_path(env_path):
+    """
+    :returns: Path of the snapshot of an environment file, in a folder
+        specific to the config the file belongs to.
+    """
+    env_path = os.path.normpath(os.path.abspath(env_path))
+    config_key = hashlib.sha1(os.path.dirname(env_path).encode("utf-8")).hexdigest()[:12]
+    name = os.path.splitext(os.path.basename(env_path))[0]
+    return os.path.join(
+        project_settings.cache_root(), "env_snapshots", config_key, name + ".snapshot"
+    )
+
+
+def _files_match(files):
+    for path, digest in files.items():
+        try:
+            with open(path, "rb") as fh:
+                if hashlib.sha256(fh.read()).hexdigest() != digest:
+                    return False
+        except (OSError, IOError):
+            return False
+    return True
+
+
+def _load_snapshot(env_path):
+    try:
+        with open(snapshot_path(env_path), "rb") as fh:
+            snapshot = marshal.load(fh)
+    except (OSError, IOError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        return None
+    if not _files_match(snapshot["files"]):
+        return None
+    return snapshot
+
+
+def load_snapshot(env_path):
+    """
+    Loads the snapshot of an environment if it matches the current files.
+
+    :param str env_path: Path to the environment file.
+    :returns: The resolved environment data, or ``None`` if there is no
+        up to date snapshot.
+    """
+    snapshot = _load_snapshot(env_path)
+    return snapshot["data"] if snapshot else None
+
+
+def compile_environment(env_path):
+    """
+    Resolves an environment and writes its snapshot.
+
+    :param str env_path: Path to the environment file.
+    :returns: The resolved environment data.
+    :raises SnapshotError: If the environment can't be resolved statically.
+    """
+    return _compile_environment(env_path)[0]
+
+
+def _compile_environment(env_path):
+    data, files = resolve_environment(env_path)
+    path = snapshot_path(env_path)
+    try:
+        content = marshal.dumps({"version": SNAPSHOT_VERSION, "files": files, "data": data})
+    except ValueError:
+        raise SnapshotError("{} holds values marshal can't store".format(env_path))
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as fh:
+            fh.write(content)
+        os.replace(tmp_path, path)
+    except (OSError, IOError) as e:
+        logger.debug("Failed to write the environment snapshot %s: %s", path, e)
+    return data, files
+
+
+def _get_snapshot(env_path):
+    snapshot = _load_snapshot(env_path)
+    if snapshot:
+        return snapshot["data"], snapshot["files"]
+    return _compile_environment(env_path)
+
+
+def get_environment(env_path):
+    """
+    Returns the resolved data of an environment, from its snapshot when it is
+    up to date, compiling it otherwise.
+
+    :param str env_path: Path to the environment file.
+    :raises SnapshotError: If the environment can't be resolved statically.
+    """
+    return _get_snapshot(env_path)[0]
+
+
+def _stats(paths):
+    stats = []
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stats.append((path, None))
+        else:
+            stats.append((path, stat.st_mtime, stat.st_size))
+    return tuple(stats)
+
+
+def is_read_only_process():
+    """
+    :returns: ``False`` in ``tank`` commands, which load the environments to
+        edit them and must read the YAML files as they are on disk.
+    """
+    return not os.path.basename(sys.argv[0] if sys.argv else "").startswith("tank_cmd")
+
+
+def _replace_cache_item(yaml_cache, cache_item_class, env_path, data, stat):
+    # the cache keeps an item with the same stat as the one merged, an item
+    # with a different size is merged first so the new data replaces it
+    placeholder = os.stat_result(tuple(stat)[:6] + (-1,) + tuple(stat)[7:10])
+    yaml_cache.merge_cache_items([cache_item_class(env_path, data={}, stat=placeholder)])
+    yaml_cache.merge_cache_items([cache_item_class(env_path, data=data, stat=stat)])
+
+
+def prime_yaml_cache(env_path):
+    """
+    Hands the resolved environment to the tk-core YAML cache, keyed by the
+    current stat of the environment file, so Toolkit doesn't parse it nor its
+    includes.
+
+    An environment is primed again when the stat of any file of its include
+    graph changed since it was last primed by this process. Nothing is primed
+    in processes which aren't :func:`is_read_only_process`.
+
+    :param str env_path: Path to the environment file.
+    :returns: ``True`` if the cache was primed by this call.
+    """
+    if not is_read_only_process():
+        return False
+    env_path = os.path.normpath(env_path)
+    with _snapshots_lock:
+        primed = _snapshots.get(env_path)
+    if primed and _stats(entry[0] for entry in primed) == primed:
+        return False
+
+    try:
+        from tank.util.yaml_cache import CacheItem, g_yaml_cache
+
+        stat = os.stat(env_path)
+        started = time.time()
+        data, files = _get_snapshot(env_path)
+        stats = _stats(files)
+        _replace_cache_item(g_yaml_cache, CacheItem, env_path, data, stat)
+    except Exception as e:
+        logger.debug("Not priming the environment %s: %s", env_path, e)
+        with _snapshots_lock:
+            _snapshots.pop(env_path, None)
+        return False
+
+    # a file modified while it was read may not show in its stat, the
+    # environment is then checked against its files again on the next pick
+    if any(len(entry) == 3 and entry[1] >= started - 1 for entry in stats):
+        stats = None
+    with _snapshots_lock:
+        _snapshots[env_path] = stats
+    return True
+
+
+def _reference_resolution(env_path):
+    """
+    Resolves an environment with tk-core's include processing.
+
+    :raises ImportError: If tk-core isn't available.
+    """
+    from tank.platform import environment_includes
+
+    with open(env_path) as fh:
+        yaml = _yaml()
+        data = yaml.load(fh, Loader=yaml.SafeLoader) or {}
+    data = environment_includes.process_includes(env_path, data, None)
+    return dict((k, v) for k, v in data.items() if k not in _INCLUDE_KEYS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compile the environment snapshots of the config."
+    )
+    parser.add_argument("envs", nargs="*", help="Environment names, all by default.")
+    parser.add_argument("--root", default=ENV_ROOT, help="Folder of the environment files.")
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check each snapshot is identical to the tk-core resolution, "
+        "tk-core must be importable.",
+    )
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        try:
+            from tank.platform import environment_includes  # noqa: F401
+        except ImportError:
+            # comparing the resolver with itself would prove nothing
+            parser.error("--verify needs tk-core, add its python folder to PYTHONPATH")
+
+    envs = args.envs or sorted(
+        os.path.splitext(name)[0] for name in os.listdir(args.root) if name.endswith(".yml")
+    )
+    failures = 0
+    for env in envs:
+        env_path = os.path.join(args.root, env + ".yml")
+        try:
+            get_environment(env_path)
+        except (SnapshotError, OSError, IOError) as e:
+            print("{:<20} not compiled: {}".format(env, e))
+            failures += 1
+            continue
+        if not args.verify:
+            print("{:<20} {}".format(env, snapshot_path(env_path)))
+            continue
+        # compare what hooks get, the snapshot read back from disk
+        snapshot = load_snapshot(env_path)
+        if snapshot == _reference_resolution(env_path):
+            print("{:<20} identical to the tk-core resolution".format(env))
+        else:
+            print("{:<20} DIFFERS from the tk-core resolution".format(env))
+            failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
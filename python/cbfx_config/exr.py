@@ -0,0 +1,221 @@
+"""
+Minimal OpenEXR header reader.
+
+Creating a Read node with ``nuke.createNode`` makes Nuke probe the file for
+its format and frame range, which is slow on deep and multi-AOV renders. The
+loader reads what it needs itself instead: the header of an EXR is a short
+list of attributes at the start of the file, so :func:`read_header` only reads
+the first few KB, without decoding any pixel.
+
+Headers are cached per sequence, the frames of a render share their header.
+A cached header is only used while the file it was read from keeps its
+modification time and size, so re-rendering a sequence in place is picked up.
+"""
+
+import collections
+import os
+import struct
+import threading
+
+from . import sequences
+
+MAGIC = 20000630
+
+# header bytes read at once, most headers fit in the first chunk
+CHUNK_SIZE = 4096
+
+# headers larger than this are considered corrupted
+MAX_HEADER_SIZE = 1024 * 1024
+
+# sequences kept in the cache
+MAX_CACHE_SIZE = 256
+
+COMPRESSIONS = ("none", "rle", "zips", "zip", "piz", "pxr24", "b44", "b44a", "dwaa", "dwab")
+
+PIXEL_TYPES = ("uint", "half", "float")
+
+# version field flags
+_TILED = 0x200
+_NON_IMAGE = 0x800
+_MULTIPART = 0x1000
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class ExrError(Exception):
+    """
+    Raised when a file isn't a valid EXR.
+    """
+
+
+class _Reader(object):
+    """
+    Reads the header of an open file, a chunk at a time.
+    """
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.data = b""
+        self.offset = 0
+
+    def _fill(self, size):
+        while self.offset + size > len(self.data):
+            if len(self.data) >= MAX_HEADER_SIZE:
+                raise ExrError("Header larger than %d bytes" % MAX_HEADER_SIZE)
+            chunk = self.fh.read(CHUNK_SIZE)
+            if not chunk:
+                raise ExrError("Truncated header")
+            self.data += chunk
+
+    def read(self, size):
+        self._fill(size)
+        value = self.data[self.offset: self.offset + size]
+        self.offset += size
+        return value
+
+    def string(self):
+        # null terminated
+        end = self.data.find(b"\0", self.offset)
+        while end == -1:
+            self._fill(len(self.data) - self.offset + 1)
+            end = self.data.find(b"\0", self.offset)
+        value = self.data[self.offset: end]
+        self.offset = end + 1
+        return value.decode("utf-8", "replace")
+
+
+def _channels(value):
+    channels = []
+    offset = 0
+    while offset < len(value) and value[offset:offset + 1] != b"\0":
+        end = value.index(b"\0", offset)
+        name = value[offset:end].decode("utf-8", "replace")
+        pixel_type = struct.unpack_from("<i", value, end + 1)[0]
+        channels.append((name, PIXEL_TYPES[pixel_type] if 0 <= pixel_type < len(PIXEL_TYPES) else pixel_type))
+        # pixel type, pLinear, reserved, x and y sampling
+        offset = end + 1 + 16
+    return channels
+
+
+def _read_attributes(reader):
+    attributes = {}
+    while True:
+        name = reader.string()
+        if not name:
+            return attributes
+        attribute_type = reader.string()
+        size = struct.unpack("<i", reader.read(4))[0]
+        value = reader.read(size)
+        if attribute_type == "box2i":
+            attributes[name] = struct.unpack("<4i", value)
+        elif attribute_type == "chlist":
+            attributes[name] = _channels(value)
+        elif attribute_type == "compression":
+            attributes[name] = COMPRESSIONS[value[0]] if value[0] < len(COMPRESSIONS) else value[0]
+        elif attribute_type == "float":
+            attributes[name] = struct.unpack("<f", value)[0]
+        elif attribute_type == "string":
+            attributes[name] = value.decode("utf-8", "replace")
+
+
+def read_header(path):
+    """
+    Reads the header of an EXR file.
+
+    :param str path: Path to the file.
+    :returns: A dictionary with the ``data_window`` and ``display_window``
+        ``(xmin, ymin, xmax, ymax)`` tuples, the ``width`` and ``height`` of
+        the display window, the ``pixel_aspect``, the ``channels`` names,
+        the ``compression`` name and whether the file is ``deep``, ``tiled``
+        or ``multipart``.
+    :raises ExrError: If the file isn't a valid EXR.
+    :raises OSError: If the file can't be read.
+    """
+    with open(path, "rb") as fh:
+        reader = _Reader(fh)
+        magic, version = struct.unpack("<ii", reader.read(8))
+        if magic != MAGIC:
+            raise ExrError("%s is not an EXR file" % path)
+
+        parts = []
+        while True:
+            attributes = _read_attributes(reader)
+            if not attributes:
+                # the empty header ending the headers of a multi-part file
+                break
+            parts.append(attributes)
+            if not version & _MULTIPART:
+                break
+
+    if not parts:
+        raise ExrError("%s has no header" % path)
+    header = parts[0]
+    for key in ("dataWindow", "displayWindow", "channels"):
+        if key not in header:
+            raise ExrError("%s has no %s attribute" % (path, key))
+
+    channels = []
+    for part in parts:
+        for name, pixel_type in part.get("channels", []):
+            if name not in channels:
+                channels.append(name)
+    display_window = header["displayWindow"]
+    return {
+        "data_window": header["dataWindow"],
+        "display_window": display_window,
+        "width": display_window[2] - display_window[0] + 1,
+        "height": display_window[3] - display_window[1] + 1,
+        "pixel_aspect": header.get("pixelAspectRatio", 1.0),
+        "channels": channels,
+        "compression": header.get("compression"),
+        "deep": bool(version & _NON_IMAGE) or "deep" in (header.get("type") or ""),
+        "tiled": bool(version & _TILED),
+        "multipart": bool(version & _MULTIPART),
+    }
+
+
+def probe(path, frame=None):
+    """
+    Reads the header of an EXR file or sequence, cached per sequence.
+
+    :param str path: Path of a file, or of a sequence, ie. ``file.####.exr``.
+    :param int frame: Frame of the sequence to read, the first frame on disk
+        if not set.
+    :returns: The header, as returned by :func:`read_header`, or ``None`` if
+        it couldn't be read.
+    """
+    file_path = path
+    if sequences.is_sequence_path(path):
+        if frame is None:
+            sequence_range = sequences.scan(path)
+            if not sequence_range:
+                return None
+            frame = sequence_range.first
+        file_path = sequences.frame_path(path, frame)
+
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    # a render written again in place gets a new modification time or size
+    signature = (file_path, stat.st_mtime_ns, stat.st_size)
+
+    key = sequences.split_path(path) or path
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == signature:
+            _cache.move_to_end(key)
+            return cached[1]
+
+    try:
+        header = read_header(file_path)
+    except (OSError, IOError, ExrError, struct.error, ValueError):
+        return None
+
+    with _cache_lock:
+        _cache[key] = (signature, header)
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return header
@@ -0,0 +1,151 @@
+"""
+File copies of the folder creation schema payloads.
+
+Folder creation copies the same few schema files, ie. ``workspace.mel`` or
+``ref/cbfx_repo_v000.nk``, into every shot and asset. :class:`FileCopier`
+makes those copies as cheap as the filesystem allows:
+
+- a reflink (``FICLONE``) when source and target share a copy-on-write
+  filesystem, which copies no data at all,
+- otherwise, for payloads up to :data:`MEMORY_LIMIT`, a single write of the
+  source content, read once per run and kept in memory,
+- otherwise ``os.copy_file_range``, which lets the kernel, or the NFS server,
+  copy the data without a round trip through the process.
+
+In ``hardlink`` mode, meant for payloads nobody edits, the first copy of a
+source on a filesystem is made read-only and every other target is a hard link
+to it. Editing a hard linked file would change it in every shot, hence the
+read-only permissions.
+"""
+
+import collections
+import errno
+import os
+import shutil
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# linux ioctl cloning a file, from linux/fs.h
+FICLONE = 0x40049409
+
+# payloads up to this size are kept in memory for the run
+MEMORY_LIMIT = 1024 * 1024
+
+# errors meaning the filesystems can't do a reflink or a kernel side copy
+_UNSUPPORTED = (errno.EXDEV, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY, errno.ENOSYS)
+
+COPY_MODES = ("copy", "hardlink")
+
+# errors meaning a hard link can't be made here, the file is copied instead:
+# another filesystem, too many links, or no hard links on the filesystem
+_NO_LINK = (errno.EXDEV, errno.EMLINK, errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP)
+
+
+class FileCopier(object):
+    """
+    Copies files for a folder creation run, caching the source contents.
+
+    Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self.stats = collections.Counter()
+        self._contents = {}
+        self._links = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._reflink = fcntl is not None and sys.platform.startswith("linux")
+        self._copy_file_range = hasattr(os, "copy_file_range")
+
+    def copy(self, source_path, target_path, hardlink=False):
+        """
+        Copies a file and opens up its permissions.
+
+        :param str source_path: File to copy.
+        :param str target_path: Destination, which must not exist.
+        :param bool hardlink: Hard link the target to an earlier copy of the
+            same source when possible, copy it otherwise.
+        :returns: The method used, ie. ``"reflink"`` or ``"hardlink"``.
+        """
+        if hardlink:
+            with self._lock:
+                links = list(self._links[source_path])
+            for link in links:
+                try:
+                    os.link(link, target_path)
+                except OSError as e:
+                    if e.errno not in _NO_LINK:
+                        raise
+                    # another copy may work, ie. on another filesystem
+                    continue
+                return self._count("hardlink")
+
+        method = self._copy_data(source_path, target_path)
+        if hardlink:
+            # shared by all the links, nobody must write to it
+            os.chmod(target_path, 0o444)
+            with self._lock:
+                self._links[source_path].append(target_path)
+        else:
+            # set 777 permissions
+            os.chmod(target_path, 0o777)
+        return self._count(method)
+
+    def _count(self, method):
+        with self._lock:
+            self.stats[method] += 1
+        return method
+
+    def _copy_data(self, source_path, target_path):
+        with self._lock:
+            content = self._contents.get(source_path)
+        if content is not None:
+            with open(target_path, "wb") as fh:
+                fh.write(content)
+            return "memory"
+
+        with open(source_path, "rb") as src:
+            size = os.fstat(src.fileno()).st_size
+            with open(target_path, "wb") as dst:
+                if self._reflink:
+                    try:
+                        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                        return "reflink"
+                    except OSError as e:
+                        if e.errno not in _UNSUPPORTED:
+                            raise
+                        # don't try again for the rest of the run
+                        self._reflink = False
+
+                if size <= MEMORY_LIMIT:
+                    content = src.read()
+                    with self._lock:
+                        self._contents[source_path] = content
+                    dst.write(content)
+                    return "memory"
+
+                if self._copy_file_range:
+                    try:
+                        offset = 0
+                        while offset < size:
+                            copied = os.copy_file_range(src.fileno(), dst.fileno(), size - offset)
+                            if not copied:
+                                break
+                            offset += copied
+                        if offset == size:
+                            return "copy_file_range"
+                    except OSError as e:
+                        if e.errno not in _UNSUPPORTED:
+                            raise
+                        self._copy_file_range = False
+                    # restart from scratch with a plain copy
+                    src.seek(0)
+                    dst.seek(0)
+                    dst.truncate()
+
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+                return "stream"
@@ -0,0 +1,412 @@
+"""
+Folder creation engine of the process folder creation core hook.
+
+Toolkit hands the hook a flat list of folder, file and symlink items, parents
+before children. Creating them one at a time on NFS means one metadata round
+trip after the other, which makes large batches, ie. a 600 shot sequence,
+take minutes. :class:`FolderCreator` groups the items by depth and creates the
+items of a same depth concurrently through a bounded thread pool: parents are
+always at a lower depth, so they exist before their children are created.
+
+The number of workers is set per storage root with ``folder_workers`` in
+``core/roots.yml`` and can be overridden for all roots with
+``CBFX_FOLDER_WORKERS``. One worker creates the items in order, like the
+default Toolkit hook.
+
+Existence checks go through a run-local :class:`PathCache`, which checks the
+requested paths top-down and never stats the subtree of a missing directory,
+nor the paths created during the run. On the deep shot and task schema, most
+of the per item ``os.path.exists`` calls of the default hook are saved.
+
+Schema files are copied by :class:`cbfx_config.file_copy.FileCopier`, set
+``folder_copy_mode: hardlink`` on a root to hard link the copies instead.
+"""
+
+import collections
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import file_copy
+
+CONFIG_ROOT = os.path.normpath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+ROOTS_PATH = os.path.join(CONFIG_ROOT, "core", "roots.yml")
+
+DEFAULT_WORKERS = 1
+
+_root_settings = None
+_root_settings_lock = threading.Lock()
+
+
+def root_settings():
+    """
+    :returns: The storage roots settings read from ``core/roots.yml``, keyed
+        by root name.
+    """
+    global _root_settings
+    with _root_settings_lock:
+        if _root_settings is None:
+            try:
+                from tank_vendor import yaml
+            except ImportError:
+                import yaml
+            try:
+                with open(ROOTS_PATH) as fh:
+                    _root_settings = yaml.load(fh, Loader=yaml.SafeLoader) or {}
+            except (OSError, IOError):
+                _root_settings = {}
+        return _root_settings
+
+
+def root_name(path, roots):
+    """
+    Returns the name of the storage root a path belongs to.
+
+    :param str path: Path of a folder creation item.
+    :param dict roots: Root paths for the current OS keyed by name, as
+        returned by ``tk.roots``.
+    :returns: The root name, or ``None`` if the path is under no root.
+    """
+    path = os.path.normcase(os.path.normpath(path))
+    best = None
+    for name, root_path in (roots or {}).items():
+        if not root_path:
+            continue
+        root_path = os.path.normcase(os.path.normpath(root_path))
+        if path == root_path or path.startswith(root_path.rstrip(os.sep) + os.sep):
+            if best is None or len(root_path) > len(roots[best]):
+                best = name
+    return best
+
+
+def workers_for_root(name):
+    """
+    :returns: The number of folder creation workers of a storage root.
+    """
+    if os.environ.get("CBFX_FOLDER_WORKERS"):
+        return max(1, int(os.environ["CBFX_FOLDER_WORKERS"]))
+    settings = root_settings().get(name) or {}
+    return max(1, int(settings.get("folder_workers") or DEFAULT_WORKERS))
+
+
+def copy_mode_for_root(name):
+    """
+    :returns: How the schema files are copied under a storage root, ``copy``
+        or ``hardlink``, from ``folder_copy_mode`` in ``core/roots.yml`` or
+        ``CBFX_FOLDER_COPY_MODE``.
+    """
+    settings = root_settings().get(name) or {}
+    mode = os.environ.get("CBFX_FOLDER_COPY_MODE") or settings.get("folder_copy_mode") or "copy"
+    if mode not in file_copy.COPY_MODES:
+        raise ValueError("Invalid folder copy mode {} for root {}".format(mode, name))
+    return mode
+
+
+def replay_remote_folders(name):
+    """
+    :returns: ``True`` if the remote folder creation actions are replayed on
+        a storage root, ``replay_remote_folders`` in ``core/roots.yml``.
+    """
+    settings = root_settings().get(name) or {}
+    return bool(settings.get("replay_remote_folders"))
+
+
+def item_path(item):
+    """
+    :returns: The path an item creates.
+    """
+    if item.get("action") == "copy":
+        return item.get("target_path")
+    return item.get("path")
+
+
+def _depth(path):
+    return os.path.normpath(path).count(os.sep)
+
+
+def _ensure_binary(content):
+    if isinstance(content, bytes):
+        return content
+    return content.encode("utf-8")
+
+
+class PathCache(object):
+    """
+    Run-local record of which paths of a folder creation request exist.
+
+    :meth:`prefetch` builds the prefix tree of all the requested paths and
+    checks them top-down: once a directory is known to be missing, nothing
+    under it is stat'ed, its whole subtree is missing too. Paths created
+    during the run are recorded, so they are never stat'ed either.
+
+    :param trace: The tracing span counting the filesystem operations.
+    """
+
+    def __init__(self, trace):
+        self.trace = trace
+        self.stat_calls = 0
+        self._exists = {}
+        self._lock = threading.Lock()
+
+    def _stat(self, path, link=False):
+        self.trace.count("fs_ops")
+        with self._lock:
+            self.stat_calls += 1
+        return os.path.lexists(path) if link else os.path.exists(path)
+
+    def _known_missing_ancestor(self, path):
+        parent = os.path.dirname(path)
+        while parent and parent != path:
+            exists = self._exists.get(parent)
+            if exists is not None:
+                return not exists
+            path, parent = parent, os.path.dirname(parent)
+        return False
+
+    def prefetch(self, paths, map_func=map):
+        """
+        Checks the existence of the paths top-down.
+
+        :param dict paths: ``True`` for the paths to check with ``lexists``,
+            ie. symlinks, ``False`` for the others, keyed by path.
+        :param map_func: ``map`` like function the stats of a same depth are
+            run through, ie. a thread pool's.
+        """
+        by_depth = collections.defaultdict(list)
+        for path in paths:
+            by_depth[_depth(path)].append(os.path.normpath(path))
+
+        for depth in sorted(by_depth):
+            to_stat = []
+            for path in by_depth[depth]:
+                if path in self._exists:
+                    continue
+                if self._known_missing_ancestor(path):
+                    self._exists[path] = False
+                else:
+                    to_stat.append(path)
+            results = map_func(lambda p: self._stat(p, paths.get(p, False)), to_stat)
+            for path, exists in zip(to_stat, results):
+                self._exists[path] = exists
+
+    def exists(self, path, link=False):
+        """
+        :returns: ``True`` if the path exists, stat'ing it only when the run
+            knows nothing about it yet.
+        """
+        path = os.path.normpath(path)
+        exists = self._exists.get(path)
+        if exists is None:
+            exists = False if self._known_missing_ancestor(path) else self._stat(path, link)
+            self._exists[path] = exists
+        return exists
+
+    def created(self, path):
+        """
+        Records a path created during the run.
+        """
+        self._exists[os.path.normpath(path)] = True
+
+
+class FolderCreator(object):
+    """
+    Creates the items of a folder creation request.
+
+    The caller is responsible for the umask: it is process wide, so it must
+    be set once around :meth:`run`, never from the workers. Callers which
+    can't change the umask, ie. background threads, set ``chmod_folders``
+    instead.
+
+    :param bool preview_mode: Only report what would be created.
+    :param trace: The tracing span counting the filesystem operations.
+    :param dict roots: Root paths keyed by name, used to pick the number of
+        workers of each item.
+    :param bool chmod_folders: Set the permissions of the folders created
+        with an explicit ``chmod``.
+    """
+
+    def __init__(self, preview_mode, trace, roots=None, chmod_folders=False):
+        self.preview_mode = preview_mode
+        self.trace = trace
+        self.roots = roots or {}
+        self.chmod_folders = chmod_folders
+        self.paths = PathCache(trace)
+        self.copier = file_copy.FileCopier()
+        # stat calls the plain, item by item, creation would have made
+        self.naive_stat_calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def stat_calls_saved(self):
+        return self.naive_stat_calls - self.paths.stat_calls
+
+    def _count_naive(self, amount):
+        with self._lock:
+            self.naive_stat_calls += amount
+
+    def _prefetch(self, items, map_func):
+        paths = {}
+        for item in items:
+            action = item.get("action")
+            path = item_path(item)
+            if not path or action not in ("entity_folder", "folder", "symlink", "copy", "create_file"):
+                continue
+            paths[os.path.normpath(path)] = action == "symlink"
+            if action == "create_file":
+                paths.setdefault(os.path.normpath(os.path.dirname(path)), False)
+        self.paths.prefetch(paths, map_func)
+
+    def run(self, items):
+        """
+        Creates the items.
+
+        :param list items: Folder creation items.
+        :returns: The paths created, in the order of the items.
+        """
+        created = [None] * len(items)
+
+        by_root = collections.defaultdict(list)
+        for index, item in enumerate(items):
+            path = item_path(item)
+            by_root[root_name(path, self.roots) if path else None].append(index)
+
+        for name, indexes in by_root.items():
+            workers = workers_for_root(name)
+            hardlink = copy_mode_for_root(name) == "hardlink"
+            if workers == 1:
+                self._prefetch([items[i] for i in indexes], map)
+                for index in indexes:
+                    created[index] = self._process(items[index], hardlink)
+                continue
+
+            by_depth = collections.defaultdict(list)
+            for index in indexes:
+                path = item_path(items[index])
+                by_depth[_depth(path) if path else 0].append(index)
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                self._prefetch([items[i] for i in indexes], pool.map)
+                for depth in sorted(by_depth):
+                    level = by_depth[depth]
+                    for index, path in zip(level, pool.map(lambda i: self._process(items[i], hardlink), level)):
+                        created[index] = path
+
+        return [path for path in created if path]
+
+    def _makedirs(self, path):
+        try:
+            if self.paths.exists(os.path.dirname(path)):
+                # a single mkdir when the parent is known to exist
+                os.mkdir(path, 0o777)
+            else:
+                self._count_naive(1)
+                os.makedirs(path, 0o777)
+        except FileExistsError:
+            # created by another worker in the meantime
+            return False
+        self.trace.count("fs_ops")
+        if self.chmod_folders:
+            os.chmod(path, 0o777)
+            self.trace.count("fs_ops")
+        self.paths.created(path)
+        return True
+
+    def _process(self, item, hardlink=False):
+        """
+        Creates a single item.
+
+        :param dict item: Folder creation item.
+        :param bool hardlink: Hard link the copies of a same schema file.
+        :returns: The path created, or ``None``.
+        """
+        action = item.get("action")
+
+        if action in ["entity_folder", "folder"]:
+            # folder creation
+            path = item.get("path")
+            self._count_naive(1)
+            if not self.paths.exists(path):
+                if not self.preview_mode:
+                    # os.makedirs stats the parent before creating the folder
+                    self._count_naive(1)
+                    if not self._makedirs(path):
+                        return None
+                return path
+
+        elif action == "remote_entity_folder":
+            # Remote folder creation
+            #
+            # NOTE! This action happens when another user has created
+            # a folder on their machine and we are syncing our local path
+            # cache to be aware of this folder's existance.
+            #
+            # For a traditional setup, where the project storage is shared,
+            # there is no need to do I/O for remote folders - these folders
+            # have already been created on the remote storage so you have access
+            # to them already.
+            #
+            # On a setup where each user or group of users is attached to
+            # different, independendent file storages, which are synced,
+            # it may be meaningful to "replay" the remote folder creation
+            # on the local system. This would result in the same folder
+            # scaffold on each disk which is storing project data.
+            #
+            # The hook replays them in bulk for the storage roots with
+            # replay_remote_folders set, see DeferredFolders.replay.
+            pass
+
+        elif action == "symlink":
+            # symbolic link
+            if sys.platform == "win32":
+                # no windows support
+                return None
+            path = item.get("path")
+            target = item.get("target")
+            # note use of lexists to check existance of symlink
+            # rather than what symlink is pointing at
+            self._count_naive(1)
+            if not self.paths.exists(path, link=True):
+                if not self.preview_mode:
+                    os.symlink(target, path)
+                    # set 777 permissions for the symlink
+                    os.chmod(path, 0o777)
+                    self.trace.count("fs_ops", 2)
+                    self.paths.created(path)
+                return path
+
+        elif action == "copy":
+            # a file copy
+            source_path = item.get("source_path")
+            target_path = item.get("target_path")
+            self._count_naive(1)
+            if not self.paths.exists(target_path):
+                if not self.preview_mode:
+                    # reflink, in memory or kernel side copy, 777 permissions
+                    method = self.copier.copy(source_path, target_path, hardlink)
+                    self.trace.count("fs_ops", 2)
+                    self.trace.count("copy_" + method)
+                    self.paths.created(target_path)
+                return target_path
+
+        elif action == "create_file":
+            # create a new file based on content
+            path = item.get("path")
+            parent_folder = os.path.dirname(path)
+            content = item.get("content")
+            self._count_naive(2)
+            if not self.paths.exists(parent_folder) and not self.preview_mode:
+                self._makedirs(parent_folder)
+            if not self.paths.exists(path):
+                if not self.preview_mode:
+                    # create the file
+                    with open(path, "wb") as fp:
+                        fp.write(_ensure_binary(content))
+                    # set 777 permissions
+                    os.chmod(path, 0o777)
+                    self.trace.count("fs_ops", 2)
+                    self.paths.created(path)
+                return path
+
+        return None
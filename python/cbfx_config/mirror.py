@@ -0,0 +1,486 @@
+"""
+Local SQLite mirror of the pipeline critical ShotGrid fields of a project.
+
+The config hooks only depend on a handful of fields (shot cut/head/tail, LUT,
+camera raw, project tank_name, fps and default format). This module keeps a
+per-project SQLite database (in WAL mode, so hooks can read while the follower
+writes) holding those fields, so context changes and launches read them
+locally and keep working during ShotGrid slowdowns.
+
+The mirror is kept current by :class:`MirrorFollower`, which polls
+``EventLogEntry`` incrementally from the last event id it processed. It only
+relies on plain ``find``/``find_one`` calls, so it runs against mockgun as
+well as a real site.
+
+Mirrors live in the directory pointed to by ``CBFX_SG_MIRROR_DIR``; hooks
+silently fall back to ShotGrid when it is not set or when a project has no
+mirror yet. They also fall back, with a warning, when the follower hasn't
+polled successfully for ``CBFX_SG_MIRROR_MAX_AGE`` seconds (5 minutes by
+default), as the mirror may then be out of date.
+
+Run the follower with::
+
+    python -m cbfx_config.mirror --project-id 123 --follow
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from . import shotgun
+
+logger = logging.getLogger(__name__)
+
+# fields mirrored for each entity type
+MIRRORED_FIELDS = {
+    "Project": [
+        "code",
+        "tank_name",
+        "sg_frame_rate",
+        "sg_fps",
+        "sg_type",
+        "sg_default_format",
+        "sg_camera_raw",
+        "sg_lut",
+    ],
+    "Sequence": ["code", "project", "sg_camera_raw", "sg_lut"],
+    "Shot": [
+        "code",
+        "project",
+        "sg_sequence",
+        "sg_camera_raw",
+        "sg_lut",
+        "sg_cut_in",
+        "sg_cut_out",
+        "sg_head_in",
+        "sg_tail_out",
+    ],
+    "Asset": ["code", "project"],
+}
+
+# number of events processed per poll
+EVENT_BATCH_SIZE = 500
+
+# seconds since the last successful poll after which the mirror isn't trusted
+DEFAULT_MAX_AGE = 300
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    type TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (type, id)
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def max_age():
+    """
+    :returns: Seconds since the last successful poll after which the hooks
+        query ShotGrid rather than the mirror, ``CBFX_SG_MIRROR_MAX_AGE``.
+    """
+    try:
+        return float(os.environ.get("CBFX_SG_MIRROR_MAX_AGE", DEFAULT_MAX_AGE))
+    except ValueError:
+        return DEFAULT_MAX_AGE
+
+
+def mirror_path(project_id, root=None):
+    """
+    Returns the path of the mirror database of a project.
+
+    :param int project_id: ShotGrid project id.
+    :param str root: Mirror directory, defaults to ``CBFX_SG_MIRROR_DIR``.
+    :returns: The database path, or ``None`` if no mirror directory is set.
+    """
+    root = root or os.environ.get("CBFX_SG_MIRROR_DIR")
+    if not root:
+        return None
+    return os.path.join(root, "project_{}.sqlite".format(project_id))
+
+
+class Mirror(object):
+    """
+    Access to the mirror database of a project.
+
+    :param str path: Path to the SQLite database.
+    :param bool readonly: Open the database read-only, as the hooks do.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self._lock = threading.Lock()
+        if readonly:
+            self._connection = sqlite3.connect(
+                "file:{}?mode=ro".format(path), uri=True, check_same_thread=False
+            )
+        else:
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(_SCHEMA)
+            self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+    def _record(self, entity_type, entity_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM entities WHERE type = ? AND id = ?",
+                (entity_type, entity_id),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def get(self, entity_type, entity_id, fields):
+        """
+        Returns the requested fields of an entity, following linked fields
+        such as ``sg_sequence.Sequence.code`` through the mirrored records.
+
+        :param str entity_type: ShotGrid entity type.
+        :param int entity_id: ShotGrid entity id.
+        :param list fields: Fields to return.
+        :returns: The entity dictionary, or ``None`` if the mirror can't
+            answer for all the requested fields.
+        """
+        record = self._record(entity_type, entity_id)
+        if record is None:
+            return None
+
+        entity = {"type": entity_type, "id": entity_id}
+        linked_records = {}
+        for field in fields:
+            if "." not in field:
+                if field not in MIRRORED_FIELDS.get(entity_type, []):
+                    return None
+                entity[field] = record.get(field)
+                continue
+
+            link_field, linked_type, linked_field = field.split(".", 2)
+            if linked_field not in MIRRORED_FIELDS.get(linked_type, []):
+                return None
+            link = record.get(link_field)
+            if not link:
+                entity[field] = None
+                continue
+            if link["id"] not in linked_records:
+                linked_records[link["id"]] = self._record(linked_type, link["id"])
+            linked_record = linked_records[link["id"]]
+            if linked_record is None:
+                return None
+            entity[field] = linked_record.get(linked_field)
+        return entity
+
+    def upsert(self, records):
+        """
+        Stores ShotGrid records, replacing existing ones.
+
+        :param list records: Entity dictionaries holding the mirrored fields.
+        """
+        now = time.time()
+        rows = [
+            (record["type"], record["id"], json.dumps(record, default=str), now)
+            for record in records
+        ]
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entities (type, id, data, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._connection.commit()
+
+    def delete(self, entity_type, entity_ids):
+        """
+        Removes records, ie. for retired entities.
+        """
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM entities WHERE type = ? AND id = ?",
+                [(entity_type, entity_id) for entity_id in entity_ids],
+            )
+            self._connection.commit()
+
+    def get_state(self, key, default=None):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM state WHERE key = ?", (key,)
+            ).fetchone()
+        return default if row is None else row[0]
+
+    def set_state(self, key, value):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                (key, str(value)),
+            )
+            self._connection.commit()
+
+    @property
+    def last_event_id(self):
+        """
+        Id of the last ``EventLogEntry`` applied to the mirror.
+        """
+        value = self.get_state("last_event_id")
+        return None if value is None else int(value)
+
+    @last_event_id.setter
+    def last_event_id(self, value):
+        self.set_state("last_event_id", value)
+
+    @property
+    def last_poll_at(self):
+        """
+        Time of the last successful poll of the follower, ``None`` if it
+        never polled.
+        """
+        value = self.get_state("last_poll_at")
+        return None if value is None else float(value)
+
+    @last_poll_at.setter
+    def last_poll_at(self, value):
+        self.set_state("last_poll_at", value)
+
+    def age(self):
+        """
+        :returns: Seconds since the last successful poll, ``None`` if the
+            follower never polled.
+        """
+        last_poll_at = self.last_poll_at
+        return None if last_poll_at is None else time.time() - last_poll_at
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+# mirrors already reported as stale, not to warn on every lookup
+_stale = set()
+
+
+def open_mirror(project_id):
+    """
+    Returns a read-only mirror of the project, shared by the whole process.
+
+    :param int project_id: ShotGrid project id.
+    :returns: A :class:`Mirror`, or ``None`` if the project isn't mirrored.
+    """
+    path = mirror_path(project_id)
+    if not path or not os.path.exists(path):
+        return None
+
+    with _readers_lock:
+        if path not in _readers:
+            try:
+                _readers[path] = Mirror(path, readonly=True)
+            except sqlite3.Error as e:
+                logger.debug("Unable to open ShotGrid mirror %s: %s", path, e)
+                return None
+        return _readers[path]
+
+
+def get_entity(project_id, entity_type, entity_id, fields):
+    """
+    Convenience lookup used by the hooks, returning ``None`` whenever the
+    mirror can't answer so callers fall back to ShotGrid.
+    """
+    mirror = open_mirror(project_id)
+    if mirror is None:
+        return None
+    try:
+        age = mirror.age()
+        if age is None or age > max_age():
+            if mirror.path not in _stale:
+                _stale.add(mirror.path)
+                logger.warning(
+                    "ShotGrid mirror %s was last updated %s, querying ShotGrid "
+                    "instead. Is the mirror follower running?",
+                    mirror.path,
+                    "never" if age is None else "%d seconds ago" % age,
+                )
+            return None
+        _stale.discard(mirror.path)
+        return mirror.get(entity_type, entity_id, fields)
+    except sqlite3.Error as e:
+        logger.debug("ShotGrid mirror lookup failed: %s", e)
+        return None
+
+
+class MirrorFollower(object):
+    """
+    Keeps the mirror of a project in sync with ShotGrid.
+
+    :param sg: ShotGrid API connection, or a mockgun instance.
+    :param mirror: The writable :class:`Mirror`.
+    :param int project_id: ShotGrid project id.
+    """
+
+    def __init__(self, sg, mirror, project_id):
+        self.sg = sg
+        self.mirror = mirror
+        self.project = {"type": "Project", "id": project_id}
+
+    def _event_types(self):
+        return [
+            "Shotgun_{}_{}".format(entity_type, action)
+            for entity_type in MIRRORED_FIELDS
+            for action in ("New", "Change", "Retirement", "Revival")
+        ]
+
+    def _fetch(self, entity_type, filters):
+        return self.sg.find(entity_type, filters, MIRRORED_FIELDS[entity_type])
+
+    def sync_all(self):
+        """
+        Mirrors every entity of the project. The event id is recorded before
+        querying so no change is missed while the sync is running.
+
+        :returns: Number of mirrored entities.
+        """
+        last_event = self.sg.find_one(
+            "EventLogEntry", [], ["id"], order=[{"field_name": "id", "direction": "desc"}]
+        )
+
+        count = 0
+        for entity_type in MIRRORED_FIELDS:
+            if entity_type == "Project":
+                filters = [["id", "is", self.project["id"]]]
+            else:
+                filters = [["project", "is", self.project]]
+            records = self._fetch(entity_type, filters)
+            self.mirror.upsert(records)
+            count += len(records)
+
+        self.mirror.last_event_id = last_event["id"] if last_event else 0
+        self.mirror.last_poll_at = time.time()
+        logger.info("Mirrored %d entities of project %d", count, self.project["id"])
+        return count
+
+    def poll(self):
+        """
+        Applies the events logged since the last poll.
+
+        :returns: Number of events processed.
+        """
+        last_event_id = self.mirror.last_event_id
+        if last_event_id is None:
+            self.sync_all()
+            return 0
+
+        events = self.sg.find(
+            "EventLogEntry",
+            [
+                ["id", "greater_than", last_event_id],
+                ["event_type", "in", self._event_types()],
+                {
+                    "filter_operator": "any",
+                    "filters": [
+                        ["project", "is", self.project],
+                        ["entity", "is", self.project],
+                    ],
+                },
+            ],
+            ["id", "event_type", "entity", "attribute_name", "meta"],
+            order=[{"field_name": "id", "direction": "asc"}],
+            limit=EVENT_BATCH_SIZE,
+        )
+        if not events:
+            self.mirror.last_poll_at = time.time()
+            return 0
+
+        changed = dict((entity_type, set()) for entity_type in MIRRORED_FIELDS)
+        retired = dict((entity_type, set()) for entity_type in MIRRORED_FIELDS)
+        for event in events:
+            _, entity_type, action = event["event_type"].split("_", 2)
+            entity_id = (event.get("meta") or {}).get("entity_id")
+            if entity_id is None and event.get("entity"):
+                entity_id = event["entity"]["id"]
+            if entity_id is None:
+                continue
+
+            if action == "Retirement":
+                retired[entity_type].add(entity_id)
+                changed[entity_type].discard(entity_id)
+            elif (
+                action != "Change"
+                or event.get("attribute_name") in MIRRORED_FIELDS[entity_type]
+            ):
+                changed[entity_type].add(entity_id)
+                retired[entity_type].discard(entity_id)
+
+        for entity_type, entity_ids in changed.items():
+            if not entity_ids:
+                continue
+            records = self._fetch(entity_type, [["id", "in", list(entity_ids)]])
+            self.mirror.upsert(records)
+            # entities which were not returned are gone
+            retired[entity_type].update(entity_ids - set(r["id"] for r in records))
+
+        for entity_type, entity_ids in retired.items():
+            if entity_ids:
+                self.mirror.delete(entity_type, entity_ids)
+
+        self.mirror.last_event_id = events[-1]["id"]
+        self.mirror.last_poll_at = time.time()
+        logger.debug("Applied %d events to the ShotGrid mirror", len(events))
+        return len(events)
+
+    def follow(self, interval=10):
+        """
+        Polls for new events forever, draining the backlog before sleeping.
+
+        :param float interval: Seconds to wait between polls.
+        """
+        while True:
+            try:
+                while self.poll() >= EVENT_BATCH_SIZE:
+                    pass
+            except Exception:
+                logger.exception("Failed to poll ShotGrid events")
+            time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Maintain the local ShotGrid mirror of a project. The site "
+        "and script credentials are read from SHOTGUN_SITE, CBFX_SCRIPT_NAME "
+        "and CBFX_SCRIPT_KEY."
+    )
+    parser.add_argument("--project-id", type=int, required=True)
+    parser.add_argument("--root", help="Mirror directory, defaults to CBFX_SG_MIRROR_DIR.")
+    parser.add_argument("--sync", action="store_true", help="Run a full sync first.")
+    parser.add_argument("--follow", action="store_true", help="Keep following events.")
+    parser.add_argument("--interval", type=float, default=10)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    path = mirror_path(args.project_id, args.root)
+    if not path:
+        parser.error("No mirror directory, set CBFX_SG_MIRROR_DIR or pass --root.")
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    follower = MirrorFollower(shotgun.connect(), Mirror(path), args.project_id)
+    if args.sync:
+        follower.sync_all()
+    if args.follow:
+        follower.follow(args.interval)
+    else:
+        follower.poll()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
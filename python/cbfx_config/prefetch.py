@@ -0,0 +1,176 @@
+"""
+Background prefetch of the entities behind an artist's open tasks.
+
+When an engine starts we already know the user and the project, so the
+Shot/Sequence/Asset data for every open task assigned to the user can be
+fetched with a single bulk ``find`` on a worker thread. Later context switches
+read that warm store first and resolve without any network call.
+
+Prefetching is opt-in and enabled by setting ``CBFX_CONTEXT_PREFETCH=1``.
+Records are considered stale after ``CBFX_CONTEXT_PREFETCH_TTL`` seconds.
+"""
+
+import concurrent.futures
+import copy
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 900
+
+# maximum number of tasks pulled by a single prefetch
+MAX_TASKS = 2000
+
+# task statuses which are not worth prefetching
+CLOSED_STATUSES = ["fin", "omt", "cmpt", "na"]
+
+
+def is_enabled():
+    """
+    :returns: ``True`` if prefetching was turned on for this process.
+    """
+    return os.environ.get("CBFX_CONTEXT_PREFETCH", "").lower() in ("1", "true", "yes")
+
+
+class PrefetchStore(object):
+    """
+    Warm in-memory store of entity records filled by a single worker thread.
+
+    :param float ttl: Number of seconds the prefetched records stay valid.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.lookups = 0
+        self.served = 0
+        self._records = {}
+        self._fetched_at = 0
+        self._project_id = None
+        self._future = None
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="cbfx-prefetch"
+        )
+
+    def start(self, tk, project, user, fields_by_type):
+        """
+        Schedules the prefetch of the user's open tasks on the worker thread.
+        Nothing happens if a prefetch for the same project is running or its
+        results are still fresh.
+
+        :param tk: :class:`sgtk.Sgtk` instance, its ShotGrid connection is
+            thread local so the worker gets its own.
+        :param dict project: Project entity dictionary.
+        :param dict user: HumanUser entity dictionary.
+        :param dict fields_by_type: Fields to prefetch, keyed by entity type.
+            ``Project`` holds the fields fetched for the project itself.
+        :returns: The :class:`concurrent.futures.Future` of the prefetch.
+        """
+        with self._lock:
+            if self._project_id == project["id"] and self._future is not None:
+                running = not self._future.done()
+                if running or self._fetched_at + self.ttl > time.time():
+                    return self._future
+            self._project_id = project["id"]
+            self._future = self._executor.submit(
+                self._prefetch, tk, project, user, fields_by_type
+            )
+            return self._future
+
+    def _prefetch(self, tk, project, user, fields_by_type):
+        fields = ["entity"]
+        for entity_type, entity_fields in fields_by_type.items():
+            link_field = "project" if entity_type == "Project" else "entity"
+            fields.extend(
+                "{}.{}.{}".format(link_field, entity_type, field)
+                for field in entity_fields
+            )
+
+        start = time.time()
+        tasks = tk.shotgun.find(
+            "Task",
+            [
+                ["project", "is", project],
+                ["task_assignees", "is", user],
+                ["sg_status_list", "not_in", CLOSED_STATUSES],
+            ],
+            fields,
+            limit=MAX_TASKS,
+        )
+
+        records = {}
+        project_record = {"type": "Project", "id": project["id"]}
+        for task in tasks:
+            for field in fields_by_type.get("Project", []):
+                project_record[field] = task.get("project.Project.{}".format(field))
+
+            entity = task.get("entity")
+            if not entity or entity["type"] not in fields_by_type:
+                continue
+            record = {"type": entity["type"], "id": entity["id"]}
+            for field in fields_by_type[entity["type"]]:
+                record[field] = task.get(
+                    "entity.{}.{}".format(entity["type"], field)
+                )
+            records[(entity["type"], entity["id"])] = record
+
+        if tasks and "Project" in fields_by_type:
+            records[("Project", project["id"])] = project_record
+
+        with self._lock:
+            self._records = records
+            self._fetched_at = time.time()
+
+        logger.debug(
+            "Prefetched %d entities from %d tasks in %.3fs",
+            len(records),
+            len(tasks),
+            time.time() - start,
+        )
+        return len(records)
+
+    def get(self, entity_type, entity_id, fields):
+        """
+        Returns a copy of the prefetched record if it holds all the requested
+        fields and is still fresh, ``None`` otherwise.
+        """
+        with self._lock:
+            self.lookups += 1
+            if self._fetched_at + self.ttl < time.time():
+                return None
+            record = self._records.get((entity_type, entity_id))
+            if record is None or any(field not in record for field in fields):
+                return None
+            self.served += 1
+            return copy.deepcopy(record)
+
+    def stats(self):
+        """
+        :returns: Dictionary with the ``lookups``, ``served`` and ``size`` counters.
+        """
+        with self._lock:
+            return {
+                "lookups": self.lookups,
+                "served": self.served,
+                "size": len(self._records),
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_prefetch_store():
+    """
+    Returns the process-wide :class:`PrefetchStore`, creating it on first use.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = PrefetchStore(
+                ttl=float(os.environ.get("CBFX_CONTEXT_PREFETCH_TTL", DEFAULT_TTL))
+            )
+        return _store
@@ -0,0 +1,226 @@
+"""
+Site-wide report of the critical project settings.
+
+Every engine start checks the critical settings of its project, which across
+the studio runs the same query thousands of times a day. This module checks
+all the active projects of a site with a single bulk ``find``, using the rules
+of :mod:`cbfx_config.project_settings`, and writes the result as a small signed
+JSON file in the shared config area. The engine init hook then reads the
+report from disk and only queries ShotGrid for projects it doesn't cover or
+when the report is stale.
+
+The report is signed with an HMAC-SHA256 of its content, keyed with the
+secret in ``CBFX_REPORT_KEY``, which both the cron job and the hooks need.
+Without the key no report is written, and the hooks ignore the report and
+query ShotGrid. Readers reject reports whose signature doesn't match, so a
+truncated or hand edited file never hides missing settings.
+
+The report is keyed by the site, see
+:func:`cbfx_config.project_settings.site_key`, so a report of another site is
+never used.
+
+Refresh the report from a cron job with::
+
+    python -m cbfx_config.project_health
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from . import project_settings, shotgun
+
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+
+# reports older than this are ignored by the hooks
+REPORT_MAX_AGE = 6 * 60 * 60
+
+_reports = {}
+_reports_lock = threading.Lock()
+
+
+def report_path():
+    """
+    :returns: Path of the report, ``CBFX_PROJECT_HEALTH_REPORT`` or
+        ``reports/project_health.json`` in the config.
+    """
+    return os.environ.get("CBFX_PROJECT_HEALTH_REPORT") or os.path.normpath(
+        os.path.join(
+            os.path.dirname(__file__),
+            os.pardir,
+            os.pardir,
+            "reports",
+            "project_health.json",
+        )
+    )
+
+
+class ReportKeyError(Exception):
+    """
+    Raised when a report has to be signed and ``CBFX_REPORT_KEY`` isn't set.
+    """
+
+
+def _signature(body):
+    """
+    :returns: The HMAC-SHA256 signature of a report body.
+    :raises ReportKeyError: If ``CBFX_REPORT_KEY`` isn't set.
+    """
+    key = os.environ.get("CBFX_REPORT_KEY")
+    if not key:
+        raise ReportKeyError("CBFX_REPORT_KEY isn't set, the report can't be signed or trusted")
+    payload = json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return "hmac-sha256:" + hmac.new(key.encode("utf-8"), payload, hashlib.sha256).hexdigest()
+
+
+def build_report(sg, site=None):
+    """
+    Checks the critical settings of every active project of the site.
+
+    :param sg: ShotGrid API connection.
+    :param str site: Site URL, used to key the schema cache.
+    :returns: The report body, missing settings keyed by project id.
+    """
+    critical_fields = project_settings.CRITICAL_FIELDS
+    schema = project_settings.read_schema(sg, "Project", site)
+    fields = [f for f in critical_fields if f in schema]
+
+    filters = [["archived", "is", False], ["is_template", "is", False]]
+    if "sg_status" in schema:
+        filters.append(["sg_status", "is", "Active"])
+
+    projects = sg.find("Project", filters, fields)
+    return {
+        "version": REPORT_VERSION,
+        "site": project_settings.site_key(site),
+        "generated_at": int(time.time()),
+        "projects": dict(
+            (str(project["id"]), project_settings.missing_settings(project))
+            for project in projects
+        ),
+    }
+
+
+def write_report(body, path=None):
+    """
+    Signs the report and writes it atomically.
+
+    :param dict body: Report body returned by :func:`build_report`.
+    :param str path: Destination, defaults to :func:`report_path`.
+    :raises ReportKeyError: If ``CBFX_REPORT_KEY`` isn't set.
+    """
+    path = path or report_path()
+    report = {"body": body, "signature": _signature(body)}
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as fh:
+        json.dump(report, fh, sort_keys=True, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_report(path=None, max_age=REPORT_MAX_AGE):
+    """
+    Reads and verifies the report, caching it per file modification time.
+
+    :param str path: Report path, defaults to :func:`report_path`.
+    :param int max_age: Age in seconds beyond which the report is ignored.
+    :returns: The report body, or ``None`` if there is no valid and recent
+        report, or no key to verify it.
+    """
+    if not os.environ.get("CBFX_REPORT_KEY"):
+        return None
+    path = path or report_path()
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    with _reports_lock:
+        cached = _reports.get(path)
+    if cached and cached[0] == mtime:
+        body = cached[1]
+    else:
+        try:
+            with open(path) as fh:
+                report = json.load(fh)
+            body = report["body"]
+            signature = report["signature"]
+        except (OSError, IOError, ValueError, KeyError, TypeError):
+            logger.warning("Ignoring unreadable project health report %s", path)
+            return None
+        if not hmac.compare_digest(str(signature), _signature(body)):
+            logger.warning("Ignoring project health report %s, bad signature", path)
+            return None
+        if body.get("version") != REPORT_VERSION:
+            return None
+        with _reports_lock:
+            _reports[path] = (mtime, body)
+
+    if time.time() - body.get("generated_at", 0) > max_age:
+        return None
+    return body
+
+
+def get_missing_settings(site, project_id, path=None):
+    """
+    Looks up a project in the report.
+
+    :param str site: Site URL the caller is connected to.
+    :param int project_id: ShotGrid project id.
+    :returns: The list of missing settings, or ``None`` if the report can't
+        answer for this project.
+    """
+    body = load_report(path)
+    if not body or body.get("site") != project_settings.site_key(site):
+        return None
+    missing = body["projects"].get(str(project_id))
+    return None if missing is None else list(missing)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check the critical settings of all active projects and "
+        "write the signed project health report. The site and script "
+        "credentials are read from SHOTGUN_SITE, CBFX_SCRIPT_NAME and "
+        "CBFX_SCRIPT_KEY."
+    )
+    parser.add_argument("--output", help="Report path, defaults to the config reports folder.")
+    parser.add_argument("--print", action="store_true", help="Print the projects with missing settings.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    if not os.environ.get("CBFX_REPORT_KEY"):
+        parser.error("CBFX_REPORT_KEY must be set to sign the report.")
+
+    sg = shotgun.connect()
+    start = time.time()
+    # keyed like the hooks key it, from the connection
+    body = build_report(sg, sg.base_url)
+    path = write_report(body, args.output)
+    failing = dict((pid, missing) for pid, missing in body["projects"].items() if missing)
+    logger.info(
+        "Checked %d projects in %.1fs, %d with missing settings, report written to %s",
+        len(body["projects"]),
+        time.time() - start,
+        len(failing),
+        path,
+    )
+    if args.print:
+        for project_id, missing in sorted(failing.items(), key=lambda item: int(item[0])):
+            print("{}: {}".format(project_id, ", ".join(missing)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
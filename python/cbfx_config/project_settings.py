@@ -0,0 +1,147 @@
+"""
+Rules and caches for the critical project settings check.
+
+The engine init hook warns artists when critical Project fields are empty.
+This module holds those rules together with the caches which keep the check
+cheap: the Project schema is read from ShotGrid at most once a day and kept on
+disk, the outcome of a check is remembered per site, project and session for
+the lifetime of the process, and warnings are shown once per project per day.
+"""
+
+import collections
+import json
+import os
+import re
+import threading
+import time
+
+# critical Project fields and the label shown to artists
+CRITICAL_FIELDS = collections.OrderedDict(
+    [
+        ("sg_fps", "Default FPS"),
+        ("sg_type", "Type"),
+        ("code", "Pipeline Code"),
+        ("sg_default_format", "Default Format"),
+    ]
+)
+
+SCHEMA_MAX_AGE = 24 * 60 * 60
+
+_outcomes = {}
+_outcomes_lock = threading.Lock()
+
+
+def cache_root():
+    """
+    :returns: Directory of the on-disk caches, ``CBFX_CACHE_DIR`` or
+        ``~/.cbfx/cache``.
+    """
+    return os.environ.get("CBFX_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cbfx", "cache"
+    )
+
+
+def site_key(site):
+    """
+    Turns a site URL into a name usable in file names. The scheme, trailing
+    slashes and case don't matter, ``https://Studio.shotgunstudio.com/`` and
+    ``studio.shotgunstudio.com`` have the same key.
+    """
+    site = re.sub(r"^\w+://", "", (site or "default").strip()).rstrip("/").lower()
+    return re.sub(r"[^\w.-]+", "_", site).strip("_")
+
+
+def is_empty(value):
+    """
+    :returns: ``True`` if a field value counts as not set.
+    """
+    return value is None or (isinstance(value, (list, str, dict)) and not value)
+
+
+def missing_settings(project_data, fields=CRITICAL_FIELDS):
+    """
+    Returns the labels of the critical settings which are not set.
+
+    :param dict project_data: Project entity holding the critical fields.
+    :param dict fields: Critical fields and their labels.
+    :rtype: list
+    """
+    return [label for field, label in fields.items() if is_empty(project_data.get(field))]
+
+
+def read_schema(sg, entity_type, site=None, max_age=SCHEMA_MAX_AGE):
+    """
+    Returns the field names and data types of an entity type, reading the
+    ShotGrid schema at most once per ``max_age`` seconds.
+
+    :param sg: ShotGrid API connection.
+    :param str entity_type: Entity type to read the schema of.
+    :param str site: Site URL, used to key the cache.
+    :returns: Dictionary of data types keyed by field name.
+    """
+    path = os.path.join(cache_root(), "schema", site_key(site), entity_type + ".json")
+    try:
+        if time.time() - os.path.getmtime(path) < max_age:
+            with open(path) as fh:
+                return json.load(fh)
+    except (OSError, IOError, ValueError):
+        pass
+
+    schema = dict(
+        (field, (info.get("data_type") or {}).get("value"))
+        for field, info in sg.schema_field_read(entity_type).items()
+    )
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # write then rename so concurrent engine starts never read a partial file
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as fh:
+            json.dump(schema, fh)
+        os.replace(tmp_path, path)
+    except (OSError, IOError):
+        pass
+    return schema
+
+
+def get_outcome(site, project_id, session):
+    """
+    :returns: The list of missing settings recorded for this site, project
+        and session, or ``None`` if the project wasn't checked yet.
+    """
+    with _outcomes_lock:
+        return _outcomes.get((site, project_id, session))
+
+
+def set_outcome(site, project_id, session, missing):
+    """
+    Records the outcome of a check.
+    """
+    with _outcomes_lock:
+        _outcomes[(site, project_id, session)] = list(missing)
+
+
+def claim_notification(site, project_id):
+    """
+    Claims the warning about a project's missing settings for today, so
+    artists are notified at most once per project per day across all their
+    sessions.
+
+    :returns: ``True`` if the caller should notify, ``False`` if a
+        notification was already shown today.
+    """
+    path = os.path.join(
+        cache_root(),
+        "notifications",
+        "{}_{}_{}".format(site_key(site), project_id, time.strftime("%Y%m%d")),
+    )
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    except (OSError, IOError):
+        # no way to dedupe, rather notify twice than never
+        pass
+    return True
@@ -0,0 +1,442 @@
+"""
+Bulk folder scaffolding of a whole project.
+
+Toolkit creates folders lazily, one entity at a time, so the first artist into
+each shot pays for the ShotGrid queries, the path checks and the folder
+creation. This module creates the folders of a whole project in one go: it
+fetches the project's sequences, shots, assets, steps and tasks with one query
+per entity type, expands ``core/schema`` in memory and hands the resulting
+items to the ``process_folder_creation`` core hook as a single batch, where
+they are created in parallel (see :mod:`cbfx_config.folder_creation`).
+
+Folders with ``defer_creation`` are left to the engines which ask for them.
+Scaffolding only creates the folders on disk, Toolkit still registers them in
+its path cache the first time a context needs them, so the folder names must
+be the ones Toolkit would use: entity names go through the
+``process_folder_name`` core hook, and schemas using folder types or filters
+this module can't expand like Toolkit does are rejected with a
+:class:`SchemaError`.
+
+It runs from ``after_project_create.py`` for new projects, and standalone for
+existing ones::
+
+    python -m cbfx_config.scaffold --project-id 123
+"""
+
+import argparse
+import collections
+import fnmatch
+import logging
+import os
+import re
+import sys
+import time
+
+from . import folder_creation
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_ROOT = os.path.join(folder_creation.CONFIG_ROOT, "core", "schema")
+
+# statuses of the entities which don't get folders
+OMITTED_STATUSES = ["omt"]
+
+_NAME_TOKEN = re.compile(r"\{([^}]+)\}")
+
+# folder types expanded by this module
+SUPPORTED_TYPES = ("project", "static", "shotgun_entity", "shotgun_step")
+
+
+class SchemaError(Exception):
+    """
+    Raised when the schema uses features the scaffold can't expand the way
+    Toolkit does.
+    """
+
+
+def _yaml():
+    try:
+        from tank_vendor import yaml
+    except ImportError:
+        import yaml
+    return yaml
+
+
+class SchemaFolder(object):
+    """
+    A folder of ``core/schema``, with its configuration and content.
+
+    :param str name: Folder name in the schema.
+    :param str path: Path of the folder in the schema.
+    :param dict metadata: Content of the folder's yml file.
+    """
+
+    def __init__(self, name, path, metadata):
+        self.name = name
+        self.path = path
+        self.metadata = metadata
+        self.type = metadata.get("type", "static")
+        self.children = []
+        self.files = []
+
+    def name_fields(self):
+        """
+        :returns: The entity fields the folder name is built from.
+        """
+        name = self.metadata.get("name", "code")
+        return _NAME_TOKEN.findall(name) or [name]
+
+
+def load_schema(schema_root=SCHEMA_ROOT):
+    """
+    Reads the schema folders, their configuration and files.
+
+    :param str schema_root: Path to ``core/schema``.
+    :returns: The root :class:`SchemaFolder` of the project.
+    """
+    yaml = _yaml()
+    with open(os.path.join(schema_root, "ignore_files")) as fh:
+        ignored = [
+            line.strip() for line in fh if line.strip() and not line.strip().startswith("#")
+        ]
+
+    def metadata(path):
+        if not os.path.exists(path + ".yml"):
+            return {"type": "static"}
+        with open(path + ".yml") as fh:
+            return yaml.load(fh, Loader=yaml.SafeLoader) or {"type": "static"}
+
+    def read(folder):
+        for name in sorted(os.listdir(folder.path)):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in ignored):
+                continue
+            path = os.path.join(folder.path, name)
+            if os.path.isdir(path):
+                child = SchemaFolder(name, path, metadata(path))
+                folder.children.append(child)
+                read(child)
+            elif not (name.endswith(".yml") and os.path.isdir(path[:-4])):
+                folder.files.append(path)
+
+    project = SchemaFolder("project", os.path.join(schema_root, "project"), metadata(
+        os.path.join(schema_root, "project")
+    ))
+    read(project)
+    check_schema(project)
+    return project
+
+
+def _is_parent_filter(condition):
+    values = condition.get("values") or []
+    return (
+        condition.get("relation", "is") == "is"
+        and len(values) == 1
+        and isinstance(values[0], str)
+        and values[0].startswith("$")
+    )
+
+
+def check_schema(schema):
+    """
+    Checks the scaffold can expand a schema exactly like Toolkit.
+
+    Only ``filters`` linking an entity to a parent folder, ie.
+    ``{"path": "project", "relation": "is", "values": ["$project"]}``, are
+    supported.
+
+    :param schema: The root :class:`SchemaFolder`.
+    :raises SchemaError: Listing every unsupported folder.
+    """
+    errors = []
+    pending = [schema]
+    while pending:
+        folder = pending.pop()
+        pending.extend(folder.children)
+        if folder.type not in SUPPORTED_TYPES:
+            errors.append("{}: unsupported folder type {}".format(folder.path, folder.type))
+        elif folder.type == "static" and folder.metadata.get("constrain_by_entity"):
+            errors.append("{}: constrain_by_entity isn't supported".format(folder.path))
+        elif folder.type == "shotgun_step" and folder.metadata.get("filters"):
+            errors.append("{}: step filters aren't supported".format(folder.path))
+        elif folder.type == "shotgun_entity":
+            for condition in folder.metadata.get("filters") or []:
+                if not _is_parent_filter(condition):
+                    errors.append("{}: unsupported filter {}".format(folder.path, condition))
+    if errors:
+        raise SchemaError("The schema can't be scaffolded:\n" + "\n".join(sorted(errors)))
+
+
+def _entity_folders(schema):
+    folders = []
+    pending = [schema]
+    while pending:
+        folder = pending.pop()
+        if folder.type == "shotgun_entity":
+            folders.append(folder)
+        pending.extend(folder.children)
+    return folders
+
+
+def fetch_entities(sg, project_id, schema):
+    """
+    Fetches everything the schema needs to be expanded, with one query per
+    entity type.
+
+    :param sg: ShotGrid API connection.
+    :param int project_id: Id of the project to scaffold.
+    :param schema: The root :class:`SchemaFolder`.
+    :returns: A tuple of the entities keyed by type and the steps keyed by
+        the ``(type, id)`` of the entity their tasks are linked to.
+    """
+    fields_by_type = collections.defaultdict(set)
+    for folder in _entity_folders(schema):
+        entity_type = folder.metadata["entity_type"]
+        fields_by_type[entity_type].update(folder.name_fields())
+        for condition in folder.metadata.get("filters") or []:
+            fields_by_type[entity_type].add(condition["path"])
+
+    project_filter = ["project", "is", {"type": "Project", "id": project_id}]
+    entities = {}
+    for entity_type, fields in fields_by_type.items():
+        entities[entity_type] = sg.find(
+            entity_type,
+            [project_filter, ["sg_status_list", "not_in", OMITTED_STATUSES]],
+            sorted(fields),
+        )
+
+    steps = dict(
+        (step["id"], step)
+        for step in sg.find("Step", [], ["short_name", "entity_type"])
+    )
+    steps_by_entity = collections.defaultdict(list)
+    for task in sg.find("Task", [project_filter], ["entity", "step"]):
+        if not task.get("entity") or not task.get("step"):
+            continue
+        step = steps.get(task["step"]["id"])
+        key = (task["entity"]["type"], task["entity"]["id"])
+        if step and step not in steps_by_entity[key]:
+            steps_by_entity[key].append(step)
+    return entities, steps_by_entity
+
+
+def folder_name(entity_type, entity_id, field_name, value):
+    """
+    Turns a field value into a folder name like the default
+    ``process_folder_name`` core hook, for when there is no Toolkit instance.
+    """
+    if isinstance(value, dict):
+        value = value.get("name")
+    return re.sub(r"[^\w\-.]", "_", str(value))
+
+
+def _entity_name(folder, entity, process_name):
+    name = folder.metadata.get("name", "code")
+    fields = folder.name_fields()
+    values = {}
+    for field in fields:
+        value = entity.get(field)
+        if value is None:
+            return None
+        # each field is processed on its own, like Toolkit does
+        values[field] = process_name(entity["type"], entity["id"], field, value)
+    if "{" not in name:
+        return values[name]
+    return _NAME_TOKEN.sub(lambda m: values[m.group(1)], name)
+
+
+def _matches(entity, filters, parents):
+    for condition in filters or []:
+        for value in condition.get("values", []):
+            if isinstance(value, str) and value.startswith("$"):
+                parent = parents.get(value[1:])
+                if parent is None:
+                    return False
+                link = entity.get(condition["path"]) or {}
+                if condition.get("relation", "is") == "is" and link.get("id") != parent["id"]:
+                    return False
+    return True
+
+
+def expand(schema, project, project_root, entities, steps_by_entity, process_name=folder_name):
+    """
+    Expands the schema into folder creation items, the way Toolkit would.
+
+    :param schema: The root :class:`SchemaFolder`.
+    :param dict project: Project entity link, with its ``name``.
+    :param str project_root: Path of the project folder.
+    :param dict entities: Entities keyed by type, from :func:`fetch_entities`.
+    :param dict steps_by_entity: Steps keyed by ``(type, id)``.
+    :param process_name: Function turning a field value into a folder name,
+        with the arguments of the ``process_folder_name`` core hook.
+    :returns: List of item dictionaries, parents before children.
+    """
+    items = [{
+        "action": "entity_folder",
+        "metadata": schema.metadata,
+        "path": project_root,
+        "entity": project,
+    }]
+
+    def walk(folder, target_dir, parents, parent_entity):
+        for path in folder.files:
+            items.append({
+                "action": "copy",
+                "metadata": folder.metadata,
+                "source_path": path,
+                "target_path": os.path.join(target_dir, os.path.basename(path)),
+            })
+
+        for child in folder.children:
+            if child.metadata.get("defer_creation"):
+                continue
+
+            if child.type == "shotgun_entity":
+                for entity in entities.get(child.metadata["entity_type"], []):
+                    if not _matches(entity, child.metadata.get("filters"), parents):
+                        continue
+                    name = _entity_name(child, entity, process_name)
+                    if not name:
+                        continue
+                    link = {"type": entity["type"], "id": entity["id"], "name": name}
+                    path = os.path.join(target_dir, name)
+                    items.append({
+                        "action": "entity_folder",
+                        "metadata": child.metadata,
+                        "path": path,
+                        "entity": link,
+                    })
+                    walk(child, path, dict(parents, **{child.name: link}), link)
+
+            elif child.type == "shotgun_step":
+                if child.metadata.get("create_with_parent") is False:
+                    continue
+                key = (parent_entity["type"], parent_entity["id"])
+                name_field = child.metadata.get("name", "short_name")
+                for step in steps_by_entity.get(key, []):
+                    if not step.get(name_field):
+                        continue
+                    name = process_name("Step", step["id"], name_field, step[name_field])
+                    link = {"type": "Step", "id": step["id"], "name": name}
+                    path = os.path.join(target_dir, name)
+                    items.append({
+                        "action": "entity_folder",
+                        "metadata": child.metadata,
+                        "path": path,
+                        "entity": link,
+                    })
+                    walk(child, path, dict(parents, **{child.name: link}), parent_entity)
+
+            else:
+                path = os.path.join(target_dir, child.name)
+                items.append({"action": "folder", "metadata": child.metadata, "path": path})
+                walk(child, path, parents, parent_entity)
+
+    walk(schema, project_root, {"project": project}, project)
+    return items
+
+
+def scaffold(tk, project_id, preview_mode=False, log=None):
+    """
+    Creates the folders of a whole project through the config's
+    ``process_folder_creation`` core hook.
+
+    :param tk: Toolkit API instance of the project.
+    :param int project_id: Id of the project to scaffold.
+    :param bool preview_mode: Only report what would be created.
+    :param log: Logger progress is reported to.
+    :returns: A summary dictionary of the run.
+    """
+    log = log or logger
+    sg = tk.shotgun
+    schema = load_schema()
+    root_name = schema.metadata.get("root_name") or "primary"
+    project_root = tk.roots[root_name]
+
+    start = time.time()
+    project = sg.find_one("Project", [["id", "is", project_id]], ["name", "tank_name"])
+    project = {"type": "Project", "id": project_id, "name": project.get("tank_name") or project["name"]}
+    entities, steps_by_entity = fetch_entities(sg, project_id, schema)
+
+    def process_name(entity_type, entity_id, field_name, value):
+        # the folder names Toolkit itself would use
+        return tk.execute_core_hook(
+            "process_folder_name",
+            entity_type=entity_type,
+            entity_id=entity_id,
+            field_name=field_name,
+            value=value,
+        )
+
+    items = expand(schema, project, project_root, entities, steps_by_entity, process_name)
+    expanded = time.time()
+    log.info(
+        "Expanded the schema into %d items for %s in %.1fs"
+        % (len(items), ", ".join("%d %s" % (len(v), k) for k, v in sorted(entities.items())), expanded - start)
+    )
+
+    locations = tk.execute_core_hook_method(
+        "process_folder_creation", "execute", items=items, preview_mode=preview_mode
+    )
+    elapsed = max(time.time() - expanded, 1e-6)
+
+    created = set(locations)
+    folders = sum(
+        1 for item in items if item["action"] in ("folder", "entity_folder") and item["path"] in created
+    )
+    files = sum(
+        1 for item in items if item["action"] == "copy" and item["target_path"] in created
+    )
+    summary = {
+        "items": len(items),
+        "folders": folders,
+        "files": files,
+        "seconds": round(elapsed, 3),
+        "folders_per_second": round(folders / elapsed, 1),
+        "files_per_second": round(files / elapsed, 1),
+    }
+    log.info(
+        "%s %d folders and %d files in %.1fs, %.1f folders/sec, %.1f files/sec"
+        % (
+            "Would create" if preview_mode else "Created",
+            folders,
+            files,
+            elapsed,
+            summary["folders_per_second"],
+            summary["files_per_second"],
+        )
+    )
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create the folders of a whole project. The site and "
+        "script credentials are read from SHOTGUN_SITE, CBFX_SCRIPT_NAME "
+        "and CBFX_SCRIPT_KEY."
+    )
+    parser.add_argument("--project-id", type=int, required=True)
+    parser.add_argument("--preview", action="store_true", help="Only report what would be created.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    import sgtk
+
+    authenticator = sgtk.authentication.ShotgunAuthenticator()
+    sgtk.set_authenticated_user(
+        authenticator.create_script_user(
+            api_script=os.environ["CBFX_SCRIPT_NAME"],
+            api_key=os.environ["CBFX_SCRIPT_KEY"],
+            host=os.environ["SHOTGUN_SITE"],
+        )
+    )
+    tk = sgtk.sgtk_from_entity("Project", args.project_id)
+    try:
+        scaffold(tk, args.project_id, args.preview)
+    except SchemaError as e:
+        parser.error(str(e))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+Frame range discovery of image sequences on disk.
+
+The loader needs the first and last frame of every sequence it loads. Globbing
+the sequence and matching each file name against a regular expression is slow
+on NFS for sequences of thousands of frames. :func:`scan` lists the directory
+once with ``os.scandir``, matches the names against a pattern compiled once per
+sequence, and also reports the missing frames.
+
+Results are cached per process, keyed by the directory and its modification
+time, so loading the same publish again doesn't list the directory: adding or
+removing a frame changes the directory's modification time. On NFS, the
+attribute cache can serve an unchanged modification time for up to
+``acdirmax`` seconds (60 by default) after frames were added, so directories
+modified in the last :data:`SETTLE_TIME` seconds, ie. renders in progress,
+are never served from the cache.
+
+:class:`FrameExtractor` reads the frame number of the paths of a Toolkit
+template without parsing every path with ``template.get_fields``.
+"""
+
+import collections
+import functools
+import os
+import re
+import threading
+import time
+
+# a frame number or a frame token at the end of a file name root, ie. 0001,
+# #### or %04d, whatever the padding
+FRAME_PATTERN = re.compile(r"([0-9#]+|%0\dd)$")
+
+# sequences kept in the cache
+MAX_CACHE_SIZE = 256
+
+# seconds a directory must be left untouched before its scan is cached, longer
+# than the default NFS acdirmax
+SETTLE_TIME = 90
+
+# frame applied to a template to find where the frame number goes, large
+# enough not to show up anywhere else in a path
+SENTINEL_FRAME = 987654321
+
+SequenceRange = collections.namedtuple("SequenceRange", ["first", "last", "missing", "count"])
+SequenceRange.__doc__ = """
+Frame range of a sequence on disk.
+
+:param int first: First frame.
+:param int last: Last frame.
+:param list missing: ``(first, last)`` tuples of the missing frame ranges.
+:param int count: Number of frames on disk.
+"""
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def split_path(path):
+    """
+    Splits a sequence path around its frame number or frame token.
+
+    :param str path: Path of a frame, or of the sequence.
+    :returns: A tuple of the directory, the file name prefix and suffix, or
+        ``None`` if the path has no frame number.
+    """
+    root, ext = os.path.splitext(path)
+    match = FRAME_PATTERN.search(root)
+    if not match:
+        return None
+    directory, prefix = os.path.split(root[: match.start()])
+    return directory, prefix, ext
+
+
+def is_sequence_path(path):
+    """
+    :param str path: A file path.
+    :returns: ``True`` if the path has a frame token, ie. ``file.####.exr``
+        or ``file.%04d.exr``, rather than a frame number.
+    """
+    match = FRAME_PATTERN.search(os.path.splitext(path)[0])
+    return bool(match) and not match.group(1).isdigit()
+
+
+def frame_path(path, frame):
+    """
+    Replaces the frame token of a sequence path with a frame number.
+
+    :param str path: Path of the sequence, ie. ``file.####.exr`` or
+        ``file.%04d.exr``.
+    :param int frame: Frame number.
+    :returns: The path of the frame, or the path itself if it has no frame
+        token.
+    """
+    root, ext = os.path.splitext(path)
+    match = FRAME_PATTERN.search(root)
+    if not match or match.group(1).isdigit():
+        return path
+    token = match.group(1)
+    padding = int(token[2]) if token.startswith("%") else len(token)
+    return "%s%0*d%s" % (root[: match.start()], padding, frame, ext)
+
+
+@functools.lru_cache(maxsize=MAX_CACHE_SIZE)
+def _frame_regex(prefix, suffix):
+    return re.compile(re.escape(prefix) + r"(\d+)" + re.escape(suffix) + r"\Z")
+
+
+def missing_ranges(frames):
+    """
+    :param list frames: Sorted frame numbers.
+    :returns: ``(first, last)`` tuples of the frame ranges missing between the
+        first and the last frame.
+    """
+    missing = []
+    for previous, frame in zip(frames, frames[1:]):
+        if frame - previous > 1:
+            missing.append((previous + 1, frame - 1))
+    return missing
+
+
+def _scan_directory(directory, prefix, suffix):
+    match = _frame_regex(prefix, suffix).match
+    frames = []
+    with os.scandir(directory or ".") as entries:
+        for entry in entries:
+            # the cheap checks first, most names aren't frames of the sequence
+            name = entry.name
+            if not name.startswith(prefix) or not name.endswith(suffix):
+                continue
+            found = match(name)
+            if found:
+                frames.append(int(found.group(1)))
+    if not frames:
+        return None
+    frames.sort()
+    return SequenceRange(frames[0], frames[-1], missing_ranges(frames), len(frames))
+
+
+def scan(path):
+    """
+    Finds the frame range of the sequence a path belongs to.
+
+    :param str path: Path of a frame or of the sequence, ie.
+        ``file.0001.exr``, ``file.####.exr`` or ``file.%04d.exr``.
+    :returns: A :class:`SequenceRange`, or ``None`` if the path has no frame
+        number or no frame was found on disk.
+    """
+    parts = split_path(path)
+    if not parts:
+        return None
+    directory, prefix, suffix = parts
+
+    try:
+        mtime = os.stat(directory or ".").st_mtime_ns
+    except OSError:
+        return None
+    # the modification time of a directory still changing may be stale
+    settled = time.time() - mtime / 1e9 > SETTLE_TIME
+
+    key = (directory, prefix, suffix)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if settled and cached and cached[0] == mtime:
+            _cache.move_to_end(key)
+            return cached[1]
+
+    try:
+        sequence_range = _scan_directory(directory, prefix, suffix)
+    except OSError:
+        return None
+
+    if not settled:
+        return sequence_range
+    with _cache_lock:
+        _cache[key] = (mtime, sequence_range)
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return sequence_range
+
+
+def clear_cache():
+    """
+    Forgets the sequences scanned so far.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+
+class FrameExtractor(object):
+    """
+    Reads the frame number of the paths of a template, for a given set of
+    fields.
+
+    The template is resolved once with :data:`SENTINEL_FRAME` as its ``SEQ``
+    field, which gives the part of the path before and after the frame
+    number. A path then only needs a prefix and suffix check, and the frame
+    number is what is left in between. Paths failing the check, ie. with a
+    different ``eye``, are parsed by the template.
+
+    :param template: Toolkit template with a ``SEQ`` key.
+    :param dict fields: Fields of a path of the sequence.
+    """
+
+    def __init__(self, template, fields):
+        self.template = template
+        self.prefix = None
+        self.suffix = None
+        # parsed with the template, the check failed
+        self.fallbacks = 0
+
+        path = template.apply_fields(dict(fields, SEQ=SENTINEL_FRAME))
+        sentinel = str(SENTINEL_FRAME)
+        if path.count(sentinel) == 1:
+            self.prefix, _, self.suffix = path.partition(sentinel)
+
+    def frame(self, path):
+        """
+        :param str path: Path of a frame of the sequence.
+        :returns: The frame number, or ``None`` if the path isn't a frame of
+            the template.
+        """
+        if (
+            self.prefix is not None
+            and path.startswith(self.prefix)
+            and path.endswith(self.suffix)
+            and len(path) > len(self.prefix) + len(self.suffix)
+        ):
+            frame = path[len(self.prefix): len(path) - len(self.suffix)]
+            if frame.isdigit():
+                return int(frame)
+
+        self.fallbacks += 1
+        fields = self.template.validate_and_get_fields(path)
+        return fields.get("SEQ") if fields else None
@@ -0,0 +1,25 @@
+"""
+ShotGrid connection for the command line tools of the config.
+
+The tools run outside of a Toolkit session, ie. as cron jobs or daemons, and
+authenticate with a script key read from ``SHOTGUN_SITE``,
+``CBFX_SCRIPT_NAME`` and ``CBFX_SCRIPT_KEY``.
+"""
+
+import os
+
+
+def connect():
+    """
+    :returns: A ShotGrid API connection authenticated as the config's script.
+    """
+    try:
+        import shotgun_api3
+    except ImportError:
+        from tank_vendor import shotgun_api3
+
+    return shotgun_api3.Shotgun(
+        os.environ["SHOTGUN_SITE"],
+        script_name=os.environ["CBFX_SCRIPT_NAME"],
+        api_key=os.environ["CBFX_SCRIPT_KEY"],
+    )
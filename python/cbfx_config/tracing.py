@@ -0,0 +1,364 @@
+"""
+Latency tracing for the config hooks.
+
+Hooks wrap their work in a :func:`span`, which records the wall time, the
+number of ShotGrid calls and filesystem operations, the engine and the context
+to a JSONL file, one line per span::
+
+    with tracing.span("ContextChange.pre_context_change", context=ctx) as trace:
+        sg = trace.shotgun(tk.shotgun)
+        ...
+        trace.count("fs_ops")
+
+Traces are written to ``CBFX_TRACE_DIR`` (``~/.cbfx/trace`` by default), in
+files named after the host so the files of several artists' machines can be
+gathered in one place. The processes of a host append to the same file, each
+span in a single write. The files are never renamed, which several processes
+couldn't do safely: each day gets its own file, ie.
+``hooks-<host>.jsonl.20240131.0``, a file larger than :data:`MAX_BYTES` is
+continued in the next part, ``.1``, and only the :data:`MAX_FILES` latest
+files are kept. Set ``CBFX_TRACE=0`` to turn tracing off.
+
+The companion CLI aggregates p50/p95/p99 per hook and per engine::
+
+    python -m cbfx_config.tracing /shared/traces/*.jsonl
+"""
+
+import argparse
+import collections
+import contextlib
+import getpass
+import glob
+import json
+import math
+import os
+import socket
+import sys
+import threading
+import time
+
+# size after which a trace file is continued in the next part
+MAX_BYTES = 5 * 1024 * 1024
+
+# trace files kept per host
+MAX_FILES = 10
+
+_trace_file = None
+_trace_file_lock = threading.Lock()
+_user = None
+
+
+def is_enabled():
+    """
+    :returns: ``True`` unless tracing was turned off with ``CBFX_TRACE=0``.
+    """
+    return os.environ.get("CBFX_TRACE", "1").lower() not in ("0", "false", "no")
+
+
+def trace_path():
+    """
+    :returns: Path the trace files of this host are named after, with the day
+        and part appended.
+    """
+    root = os.environ.get("CBFX_TRACE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cbfx", "trace"
+    )
+    return os.path.join(root, "hooks-{}.jsonl".format(socket.gethostname()))
+
+
+class _TraceFile(object):
+    """
+    Appends the spans to the trace files of the host, moving on to a new file
+    every day and whenever the current one is full.
+
+    :param str path: Path the files are named after, see :func:`trace_path`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._day = None
+        self._lock = threading.Lock()
+
+    def _parts(self):
+        # (day, part) of the trace files of the host
+        parts = []
+        for path in glob.glob(glob.escape(self.path) + ".*.*"):
+            day, _, part = path[len(self.path) + 1:].partition(".")
+            if day.isdigit() and part.isdigit():
+                parts.append((day, int(part)))
+        return sorted(parts)
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        day = time.strftime("%Y%m%d")
+        part = max([p for d, p in self._parts() if d == day] or [0])
+        while True:
+            fd = os.open(
+                "{}.{}.{}".format(self.path, day, part),
+                os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                0o644,
+            )
+            if os.fstat(fd).st_size < MAX_BYTES:
+                break
+            # filled by this or another process
+            os.close(fd)
+            part += 1
+        self._fd = fd
+        self._day = day
+
+        for old_day, old_part in self._parts()[:-MAX_FILES]:
+            try:
+                os.remove("{}.{}.{}".format(self.path, old_day, old_part))
+            except OSError:
+                # removed by another process
+                pass
+
+    def write(self, line):
+        """
+        Appends a line to the current trace file, in a single write.
+        """
+        with self._lock:
+            if self._fd is not None and (
+                self._day != time.strftime("%Y%m%d")
+                or os.fstat(self._fd).st_size >= MAX_BYTES
+            ):
+                os.close(self._fd)
+                self._fd = None
+            if self._fd is None:
+                self._open()
+            os.write(self._fd, (line + "\n").encode("utf-8"))
+
+
+def _get_trace_file():
+    global _trace_file
+    # hooks trace from worker threads too, only one may create it
+    with _trace_file_lock:
+        if _trace_file is None:
+            _trace_file = _TraceFile(trace_path())
+    return _trace_file
+
+
+def _current_user():
+    global _user
+    if _user is None:
+        try:
+            _user = getpass.getuser()
+        except Exception:
+            # ie. no passwd entry for the uid
+            _user = str(os.getuid()) if hasattr(os, "getuid") else "unknown"
+    return _user
+
+
+class _CountingShotgun(object):
+    """
+    Proxy of a ShotGrid connection counting the API calls made through it.
+    """
+
+    def __init__(self, sg, trace):
+        self._sg = sg
+        self._trace = trace
+
+    def __getattr__(self, name):
+        attr = getattr(self._sg, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self._trace.count("sg_calls")
+            return attr(*args, **kwargs)
+
+        return counted
+
+
+class Span(object):
+    """
+    Counters of a traced hook call.
+    """
+
+    def __init__(self, hook, engine=None, context=None):
+        self.hook = hook
+        self.engine = engine
+        self.context = context
+        self.counters = collections.Counter(sg_calls=0, fs_ops=0)
+        self._lock = threading.Lock()
+
+    def count(self, kind, amount=1):
+        """
+        Increments one of the counters, ie. ``sg_calls`` or ``fs_ops``. Safe
+        to call from worker threads.
+        """
+        with self._lock:
+            self.counters[kind] += amount
+
+    def shotgun(self, sg):
+        """
+        Wraps a ShotGrid connection so the calls made through it are counted.
+        """
+        if sg is None or isinstance(sg, _CountingShotgun):
+            return sg
+        return _CountingShotgun(sg, self)
+
+
+def _current_engine_name():
+    try:
+        import sgtk
+    except ImportError:
+        return None
+    engine = sgtk.platform.current_engine()
+    return engine.name if engine else None
+
+
+@contextlib.contextmanager
+def span(hook, engine=None, context=None):
+    """
+    Traces the wrapped block.
+
+    :param str hook: Name of the traced hook method.
+    :param str engine: Engine name, defaults to the current engine.
+    :param context: Toolkit context the hook runs in.
+    :yields: The :class:`Span` collecting the counters.
+    """
+    trace = Span(hook, engine, context)
+    user = _current_user()
+    start = time.time()
+    error = None
+    try:
+        yield trace
+    except BaseException as e:
+        error = e.__class__.__name__
+        raise
+    finally:
+        if is_enabled():
+            record = {
+                "ts": round(start, 3),
+                "hook": hook,
+                "wall_ms": round((time.time() - start) * 1000.0, 3),
+                "engine": trace.engine or _current_engine_name(),
+                "context": None if context is None else str(context),
+                "host": socket.gethostname(),
+                "user": user,
+                "pid": os.getpid(),
+                "error": error,
+            }
+            record.update(trace.counters)
+            try:
+                _get_trace_file().write(json.dumps(record, default=str))
+            except (IOError, OSError):
+                # tracing must never break a hook
+                pass
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of values.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    rank = max(int(math.ceil(pct / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def read_spans(paths):
+    """
+    Yields the span records of the given files, directories or glob patterns,
+    including the rotated files.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            files = glob.glob(os.path.join(path, "*.jsonl*"))
+        else:
+            files = glob.glob(path) + glob.glob(path + ".*")
+        for file_path in sorted(set(files)):
+            with open(file_path) as fh:
+                for line in fh:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+
+def aggregate(spans, keys=("hook",)):
+    """
+    Aggregates span records.
+
+    :param spans: Iterable of span records.
+    :param tuple keys: Record keys to group by.
+    :returns: Dictionary of statistics keyed by the group values.
+    """
+    groups = collections.defaultdict(list)
+    for record in spans:
+        groups[tuple(record.get(key) for key in keys)].append(record)
+
+    results = {}
+    for group, records in groups.items():
+        wall = [r["wall_ms"] for r in records]
+        results[group] = {
+            "count": len(records),
+            "p50": percentile(wall, 50),
+            "p95": percentile(wall, 95),
+            "p99": percentile(wall, 99),
+            "sg_calls": sum(r.get("sg_calls", 0) for r in records) / float(len(records)),
+            "fs_ops": sum(r.get("fs_ops", 0) for r in records) / float(len(records)),
+            "errors": sum(1 for r in records if r.get("error")),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Aggregate hook latency traces per hook and per engine."
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="Trace files, directories or glob patterns, defaults to the local trace.",
+    )
+    parser.add_argument("--hook", help="Only report this hook.")
+    parser.add_argument("--json", action="store_true", help="Print JSON instead of a table.")
+    args = parser.parse_args(argv)
+
+    spans = list(read_spans(args.paths or [trace_path()]))
+    if args.hook:
+        spans = [s for s in spans if s.get("hook") == args.hook]
+
+    report = collections.OrderedDict()
+    report["per hook"] = aggregate(spans, ("hook",))
+    report["per hook and engine"] = aggregate(spans, ("hook", "engine"))
+
+    if args.json:
+        print(json.dumps(
+            dict(
+                (title, [dict(group=list(k), **v) for k, v in sorted(stats.items(), key=str)])
+                for title, stats in report.items()
+            ),
+            indent=2,
+        ))
+        return 0
+
+    row = "{:<56} {:>7} {:>10} {:>10} {:>10} {:>8} {:>7} {:>6}"
+    for title, stats in report.items():
+        print("\n{} ({} spans)".format(title, len(spans)))
+        print(row.format("", "count", "p50 ms", "p95 ms", "p99 ms", "sg/call", "fs/call", "errors"))
+        for group, values in sorted(stats.items(), key=str):
+            print(row.format(
+                " / ".join(str(g) for g in group)[:56],
+                values["count"],
+                "%.1f" % values["p50"],
+                "%.1f" % values["p95"],
+                "%.1f" % values["p99"],
+                "%.1f" % values["sg_calls"],
+                "%.1f" % values["fs_ops"],
+                values["errors"],
+            ))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
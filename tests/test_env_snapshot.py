@@ -0,0 +1,74 @@
+"""
+Parity of the environment snapshots with tk-core's resolution.
+
+Every environment of the config is resolved by :mod:`cbfx_config.env_snapshot`
+and by tk-core's include processing, which resolves the ``@`` references, and
+both results must be identical. The snapshot read back from disk, which is
+what the pick environment hook primes Toolkit with, must be identical too.
+
+tk-core's ``python`` folder must be importable, the tests are skipped
+otherwise::
+
+    PYTHONPATH=/path/to/tk-core/python python -m pytest tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(
+    0, os.path.normpath(os.path.join(os.path.dirname(__file__), os.pardir, "python"))
+)
+
+from cbfx_config import env_snapshot  # noqa: E402
+
+try:
+    from tank.platform import environment_includes  # noqa: F401
+except ImportError:
+    environment_includes = None
+
+
+def _environment_paths():
+    return sorted(
+        os.path.join(env_snapshot.ENV_ROOT, name)
+        for name in os.listdir(env_snapshot.ENV_ROOT)
+        if name.endswith(".yml")
+    )
+
+
+@unittest.skipIf(environment_includes is None, "tk-core isn't importable")
+class TestSnapshotParity(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.old_cache_dir = os.environ.get("CBFX_CACHE_DIR")
+        os.environ["CBFX_CACHE_DIR"] = self.cache_dir
+
+    def tearDown(self):
+        if self.old_cache_dir is None:
+            os.environ.pop("CBFX_CACHE_DIR", None)
+        else:
+            os.environ["CBFX_CACHE_DIR"] = self.old_cache_dir
+        shutil.rmtree(self.cache_dir)
+
+    def test_resolution(self):
+        for env_path in _environment_paths():
+            with self.subTest(env=os.path.basename(env_path)):
+                self.assertEqual(
+                    env_snapshot.resolve_environment(env_path)[0],
+                    env_snapshot._reference_resolution(env_path),
+                )
+
+    def test_snapshot(self):
+        for env_path in _environment_paths():
+            with self.subTest(env=os.path.basename(env_path)):
+                env_snapshot.compile_environment(env_path)
+                self.assertEqual(
+                    env_snapshot.load_snapshot(env_path),
+                    env_snapshot._reference_resolution(env_path),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()